@@ -4,9 +4,12 @@ Gerador de Laudo Pericial v3.1 (Streamlit + Lógica Colab + Cores SPTC - Layout
 
 Combina a interface Streamlit e formatação DOCX avançada com a lógica
 de geração de texto e entradas (lacre, RG) do script original do Colab.
-Usa a fonte 'Gadugi' e o método de itálico do script Colab.
+Usa a fonte 'Gadugi' e os termos em itálico do script Colab.
 Layout do cabeçalho ajustado conforme feedback.
 
+A geração do DOCX fica em 'laudo_docx.py' (importável sem o Streamlit);
+este arquivo contém apenas a interface.
+
 Requerimentos:
     - streamlit
     - python-docx
@@ -15,641 +18,336 @@ Requerimentos:
 
 Uso:
     1. Instale as dependências: pip install streamlit python-docx Pillow pytz
-    2. Salve este código como 'gerador_laudo_combinado_v3_1.py' (ou outro nome)
+    2. Mantenha 'laudo.py' e 'laudo_docx.py' no mesmo diretório.
     3. Salve a imagem do logo como 'logo_policia_cientifica.png' no mesmo diretório.
-    4. Execute o script: streamlit run gerador_laudo_combinado_v3_1.py
+    4. Execute o script: streamlit run laudo.py
     5. Interaja com a interface web para inserir dados e gerar o laudo.
     6. Baixe o laudo gerado como um arquivo .docx (nomeado com o RG da Perícia).
 """
 
-import re
 from datetime import datetime
+import copy
 import io
-import pytz
+import tempfile
 import streamlit as st
-from docx import Document
-from docx.shared import Pt, Inches, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.style import WD_STYLE_TYPE
-from PIL import Image
-# Importações necessárias para campos de página
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
 import traceback
+import uuid
+from laudo_docx import (
+    TIPOS_MATERIAL_BASE, TIPOS_EMBALAGEM_BASE, CORES_FEMININO_EMBALAGEM,
+    meses_portugues, dias_semana_portugues
+)
+from laudo_lote import ler_manifesto, exportar_zip
+from laudo_metricas import exportar_prometheus, incrementar
+from laudo_cache import CacheLaudos, cache_compartilhado, chave_laudo, obter_em_cache
+from laudo_importacao import importar_itens
+from laudo_pdf import ErroConversao, FilaCheia, conversor_disponivel, pool_padrao
+from laudo_casos import armazenamento_padrao, novo_caso_id
+from laudo_uploads import SpoolSessao
+from laudo_fila import FilaGeracaoCheia, fila_padrao
+from laudo_recursos import CAMINHO_LOGO, LARGURA_LOGO, aquecer_em_segundo_plano, fuso_horario, logo
+
+# --- Tabelas de Opções do Editor de Itens (montadas uma vez) ---
+OPCOES_MATERIAL = list(TIPOS_MATERIAL_BASE.keys())
+OPCOES_EMBALAGEM = list(TIPOS_EMBALAGEM_BASE.keys())
+OPCOES_COR = [None] + list(CORES_FEMININO_EMBALAGEM.keys())
+INDICE_MATERIAL = {codigo: i for i, codigo in enumerate(OPCOES_MATERIAL)}
+INDICE_EMBALAGEM = {codigo: i for i, codigo in enumerate(OPCOES_EMBALAGEM)}
+INDICE_COR = {codigo: i for i, codigo in enumerate(OPCOES_COR)}
+EMBALAGENS_COM_COR = ('pl', 'pa', 'e', 'z')
+
+# Modos do editor de itens; acima do limite a tabela é o padrão
+MODO_FORMULARIO = "Formulário"
+MODO_TABELA = "Tabela"
+LIMITE_ITENS_FORMULARIO = 15
+
+@st.fragment
+def editar_item(i):
+    """Editor de um item (expander). Como fragmento, editar o item reexecuta só este trecho."""
+    with st.expander(f"Item 1.{i + 1}", expanded=True):
+        item = st.session_state.dados_laudo['itens'][i]
+
+        # Linha 1
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            item['qtd'] = st.number_input(
+                "Quantidade",
+                min_value=1,
+                value=item['qtd'],
+                key=f"qtd_{i}"
+            )
 
-# --- Constantes ---
-TIPOS_MATERIAL_BASE = {
-    "v": "vegetal dessecado",
-    "po": "pulverizado",
-    "pd": "petrificado",
-    "r": "resinoso"
-}
-
-TIPOS_EMBALAGEM_BASE = {
-    "e": "microtubo do tipo eppendorf",
-    "z": "embalagem do tipo ziplock",
-    "a": "papel alumínio",
-    "pl": "plástico",
-    "pa": "papel"
-}
-
-CORES_FEMININO_EMBALAGEM = {
-    "t": "transparente", "b": "branca", "az": "azul", "am": "amarela",
-    "vd": "verde", "vm": "vermelha", "p": "preta", "c": "cinza",
-    "m": "marrom", "r": "rosa", "l": "laranja", "violeta": "violeta", "roxa": "roxa"
-}
-
-QUANTIDADES_EXTENSO = {
-    1: "uma", 2: "duas", 3: "três", 4: "quatro", 5: "cinco",
-    6: "seis", 7: "sete", 8: "oito", 9: "nove", 10: "dez"
-}
-
-meses_portugues = {
-    1: "janeiro", 2: "fevereiro", 3: "março", 4: "abril", 5: "maio", 6: "junho",
-    7: "julho", 8: "agosto", 9: "setembro", 10: "outubro", 11: "novembro", 12: "dezembro"
-}
-
-dias_semana_portugues = {
-    0: "Segunda-feira", 1: "Terça-feira", 2: "Quarta-feira", 3: "Quinta-feira",
-    4: "Sexta-feira", 5: "Sábado", 6: "Domingo"
-}
-
-# Cores Institucionais SPTC/GO (para uso no DOCX)
-DOCX_COR_AZUL_SPTC = RGBColor(0, 71, 143)
-DOCX_COR_CINZA_SPTC = RGBColor(110, 110, 110)
-DOCX_COR_PRETO = RGBColor(0, 0, 0)
-
-# Lista de termos para itálico (do código original Colab)
-TERMOS_ITALICO_ORIGINAL = [
-    'Cannabis sativa L.', # Adicionado L. para consistência
-    'Cannabis sativa',
-    'Scientific Working Group for the Analysis of Seized Drugs',
-    'United Nations Office on Drugs and Crime',
-    'Fast blue salt B', # Usado na seção de Exames do código Colab
-    'eppendorf',
-    'ziplock',
-    'Tetrahidrocanabinol', # Mencionado na conclusão Colab
-    'Portaria nº 344/1998', # Itálico não usual, mas presente implicitamente na formatação Colab
-    'RDC nº 970, de 19/03/2025' # Idem
-    # Adicionar outros termos se necessário
-]
-
-# --- Funções Auxiliares (Pluralização, Extenso, Parágrafo, Imagem) ---
-def pluralizar_palavra(palavra, quantidade):
-    """Pluraliza palavras em português (com algumas regras básicas)."""
-    if quantidade == 1:
-        return palavra
-    # Casos especiais que não pluralizam ou têm forma fixa
-    if palavra in ["microtubo do tipo eppendorf", "embalagem do tipo ziplock", "papel alumínio"]:
-        return palavra
-    if palavra.endswith('m') and palavra not in ["alumínio"]: # Evita 'alumínions'
-        return re.sub(r'm$', 'ns', palavra) # Ex: item -> itens
-    if palavra.endswith('ão'):
-        return re.sub(r'ão$', 'ões', palavra) # Ex: porção -> porções
-    elif palavra.endswith(('r', 'z', 's')):
-        # Termina em 'r' ou 'z': adiciona 'es'
-        if palavra.endswith(('r', 'z')):
-             return palavra + 'es' # Ex: cor -> cores
-        # Termina em 's': geralmente não muda (mas depende da sílaba tônica, simplificado aqui)
-        else:
-             return palavra # Ex: mês -> meses (precisaria de acentuação), mas lápis -> lápis
-    elif palavra.endswith('l'):
-         # Troca 'l' por 'is'
-        return palavra[:-1] + 'is' # Ex: papel -> papéis, vegetal -> vegetais
-    else:
-        # Regra geral: adiciona 's'
-        return palavra + 's'
-
-def obter_quantidade_extenso(qtd):
-    """Retorna a quantidade por extenso (1-10) ou o número como string."""
-    return QUANTIDADES_EXTENSO.get(qtd, str(qtd))
-
-def adicionar_paragrafo(doc, text, style=None, align=None, color=None, size=None, bold=False, italic=False):
-    """Adiciona um parágrafo ao documento docx com formatação flexível."""
-    p = doc.add_paragraph()
-    # Aplica estilo de parágrafo
-    if style and style in doc.styles:
-        try:
-            p.style = doc.styles[style]
-        except Exception as e:
-            print(f"Erro ao aplicar estilo '{style}': {e}. Usando 'Normal'.")
-            p.style = doc.styles['Normal']
-    elif style: # Se o estilo for passado mas não existir, usar Normal
-        print(f"Estilo '{style}' não encontrado. Usando 'Normal'.")
-        p.style = doc.styles['Normal']
-
-    # Aplica alinhamento
-    if align:
-        align_map = {
-            'justify': WD_ALIGN_PARAGRAPH.JUSTIFY, 'center': WD_ALIGN_PARAGRAPH.CENTER,
-            'right': WD_ALIGN_PARAGRAPH.RIGHT, 'left': WD_ALIGN_PARAGRAPH.LEFT
-        }
-        # Garante que a chave é string e minúscula
-        p.alignment = align_map.get(str(align).lower(), WD_ALIGN_PARAGRAPH.LEFT)
-
-    # Adiciona o texto e aplica formatação de caractere
-    run = p.add_run(text)
-    if color:
-        try:
-            if isinstance(color, RGBColor): run.font.color.rgb = color
-            elif isinstance(color, (tuple, list)) and len(color) == 3: run.font.color.rgb = RGBColor(color[0], color[1], color[2])
-            else: print(f"Formato de cor inválido: {color}")
-        except Exception as e: print(f"Erro ao aplicar cor: {e}")
-    if size:
-        try: run.font.size = Pt(int(size))
-        except ValueError: print(f"Tamanho de fonte inválido: {size}")
-    if bold: run.font.bold = True
-    if italic: run.font.italic = True
-
-def inserir_imagem_docx(doc, image_file_uploader):
-    """Insere uma imagem vinda do st.file_uploader no documento docx, centralizada."""
-    try:
-        if image_file_uploader:
-            img_stream = io.BytesIO(image_file_uploader.getvalue())
-            img = Image.open(img_stream)
-            width_px, height_px = img.size
-            max_width_inches = 6.0 # Largura máxima A4 menos margens
-            dpi = img.info.get('dpi', (96, 96))[0] # Tenta obter DPI, padrão 96
-            if dpi <= 0: dpi = 96 # Evita divisão por zero
-
-            width_inches = width_px / dpi
-
-            # Ajusta o tamanho para caber na página se for muito grande
-            if width_inches > max_width_inches:
-                display_width_inches = max_width_inches
-            else:
-                display_width_inches = width_inches
-
-            p = doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            run = p.add_run()
-            img_stream.seek(0) # Volta ao início do stream após ler com PIL
-            run.add_picture(img_stream, width=Inches(display_width_inches))
-    except Exception as e:
-        st.error(f"Erro ao inserir imagem no docx: {e}")
-        print(f"Erro detalhado ao inserir imagem: {e}\n{traceback.format_exc()}")
+        with col2:
+            item['tipo_mat'] = st.selectbox(
+                "Tipo de material",
+                options=OPCOES_MATERIAL,
+                index=INDICE_MATERIAL.get(item['tipo_mat'], 0),
+                key=f"mat_{i}"
+            )
 
-# --- Funções de Estrutura do Documento DOCX ---
+        # Linha 2
+        col3, col4 = st.columns([3, 2])
+        with col3:
+            item['emb'] = st.selectbox(
+                "Embalagem",
+                options=OPCOES_EMBALAGEM,
+                index=INDICE_EMBALAGEM.get(item['emb'], 0),
+                key=f"emb_{i}"
+            )
 
-def configurar_estilos(doc):
-    """Configura os estilos de parágrafo e caractere do documento docx
-       usando a fonte 'Gadugi' e cores institucionais da SPTC/GO."""
+        with col4:
+            if item['emb'] in EMBALAGENS_COM_COR:
+                item['cor_emb'] = st.selectbox(
+                    "Cor",
+                    options=OPCOES_COR,
+                    index=INDICE_COR.get(item['cor_emb'], 0),
+                    key=f"cor_{i}"
+                )
+            else:
+                st.info("Sem cor específica")
 
-    FONTE_PADRAO = 'Gadugi' # Alterado para Gadugi
-    COR_TEXTO_PRINCIPAL = DOCX_COR_PRETO
-    COR_DESTAQUE = DOCX_COR_AZUL_SPTC
-    COR_TEXTO_SECUNDARIO = DOCX_COR_CINZA_SPTC
+        # Linha 3
+        item['ref'] = st.text_input(
+            "Referência do subitem",
+            value=item['ref'],
+            key=f"ref_{i}"
+        )
 
-    def get_or_add_style(doc, style_name, style_type):
-        """Tenta obter um estilo, se não existir, tenta adicioná-lo."""
-        if style_name in doc.styles:
-            return doc.styles[style_name]
-        else:
-            try:
-                return doc.styles.add_style(style_name, style_type)
-            except Exception as e:
-                print(f"Falha ao adicionar estilo '{style_name}': {e}. Usando 'Normal' como fallback.")
-                return doc.styles['Normal'] # Retorna um estilo padrão seguro
-
-    # Estilo Normal (Base)
-    paragrafo_style = doc.styles['Normal']
-    paragrafo_style.font.name = FONTE_PADRAO # Gadugi
-    paragrafo_style.font.size = Pt(12)
-    paragrafo_style.font.color.rgb = COR_TEXTO_PRINCIPAL
-    paragrafo_style.paragraph_format.line_spacing = 1.15
-    paragrafo_style.paragraph_format.space_before = Pt(0)
-    paragrafo_style.paragraph_format.space_after = Pt(8)
-
-    # Estilo para Títulos Principais (Seções)
-    titulo_principal_style = get_or_add_style(doc, 'TituloPrincipal', WD_STYLE_TYPE.PARAGRAPH)
-    titulo_principal_style.base_style = doc.styles['Normal']
-    titulo_principal_style.font.name = FONTE_PADRAO # Gadugi
-    titulo_principal_style.font.size = Pt(14)
-    titulo_principal_style.font.bold = True
-    titulo_principal_style.font.color.rgb = COR_DESTAQUE # Azul SPTC
-    titulo_principal_style.paragraph_format.space_before = Pt(12)
-    titulo_principal_style.paragraph_format.space_after = Pt(6)
-
-    # Estilo para Títulos Secundários (Subseções)
-    titulo_secundario_style = get_or_add_style(doc, 'TituloSecundario', WD_STYLE_TYPE.PARAGRAPH)
-    titulo_secundario_style.base_style = doc.styles['Normal']
-    titulo_secundario_style.font.name = FONTE_PADRAO # Gadugi
-    titulo_secundario_style.font.size = Pt(12)
-    titulo_secundario_style.font.bold = True
-    titulo_secundario_style.font.color.rgb = COR_DESTAQUE # Azul SPTC
-    titulo_secundario_style.paragraph_format.space_before = Pt(10)
-    titulo_secundario_style.paragraph_format.space_after = Pt(4)
-
-    # Estilo para Legendas de Ilustrações
-    ilustracao_style = get_or_add_style(doc, 'Ilustracao', WD_STYLE_TYPE.PARAGRAPH)
-    ilustracao_style.base_style = doc.styles['Normal']
-    ilustracao_style.font.name = FONTE_PADRAO # Gadugi
-    ilustracao_style.font.size = Pt(10) # Tamanho menor para legenda
-    ilustracao_style.font.italic = True
-    ilustracao_style.font.color.rgb = COR_TEXTO_SECUNDARIO # Cinza SPTC
-    ilustracao_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    ilustracao_style.paragraph_format.space_before = Pt(4)
-    ilustracao_style.paragraph_format.space_after = Pt(10)
-
-def configurar_pagina(doc):
-    """Configura margens da página (padrão ABNT)."""
-    for section in doc.sections:
-        section.page_height = Inches(11.69) # A4 Altura
-        section.page_width = Inches(8.27)  # A4 Largura
-        section.top_margin = Inches(1.18)  # 3 cm
-        section.bottom_margin = Inches(0.79) # 2 cm
-        section.left_margin = Inches(1.18)   # 3 cm
-        section.right_margin = Inches(0.79)  # 2 cm
-
-def adicionar_cabecalho_rodape(doc):
-    """Adiciona cabeçalho e rodapé padrão ao documento docx."""
-    FONTE_CABECALHO_RODAPE = 'Gadugi' # Usar Gadugi aqui também
-    TAMANHO_CABECALHO_RODAPE = Pt(10)
-
-    section = doc.sections[0] # Assume que há pelo menos uma seção
-
-    # --- Cabeçalho ---
-    header = section.header
-    # Limpa cabeçalho existente para evitar duplicação
-    if header.paragraphs:
-        for para in header.paragraphs:
-            p_element = para._element
-            if p_element.getparent() is not None:
-                p_element.getparent().remove(p_element)
-
-    # Adiciona novo cabeçalho
-    header_paragraph = header.add_paragraph()
-    run_header_left = header_paragraph.add_run("POLÍCIA CIENTÍFICA DE GOIÁS")
-    run_header_left.font.name = FONTE_CABECALHO_RODAPE
-    run_header_left.font.size = TAMANHO_CABECALHO_RODAPE
-    run_header_left.font.bold = True
-    header_paragraph.add_run("\t\t") # Usar tabulação para espaçar
-    run_header_right = header_paragraph.add_run("LAUDO DE PERÍCIA CRIMINAL")
-    run_header_right.font.name = FONTE_CABECALHO_RODAPE
-    run_header_right.font.size = TAMANHO_CABECALHO_RODAPE
-    run_header_right.font.bold = False
-    header_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT # Alinhado à direita fica melhor
-
-    # --- Rodapé (Numeração de Página) ---
-    footer = section.footer
-    # Limpa rodapé existente
-    if footer.paragraphs:
-        for para in footer.paragraphs:
-             p_element = para._element
-             if p_element.getparent() is not None:
-                 p_element.getparent().remove(p_element)
-    # Adiciona parágrafo para numeração
-    page_num_paragraph = footer.add_paragraph()
-    page_num_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    # Adiciona "Página X"
-    run_page = page_num_paragraph.add_run("Página ")
-    run_page.font.name = FONTE_CABECALHO_RODAPE
-    run_page.font.size = TAMANHO_CABECALHO_RODAPE
-    # Campo PAGE
-    fld_char_begin = OxmlElement('w:fldChar')
-    fld_char_begin.set(qn('w:fldCharType'), 'begin')
-    run_page._r.append(fld_char_begin)
-    instr_text = OxmlElement('w:instrText')
-    instr_text.set(qn('xml:space'), 'preserve')
-    instr_text.text = 'PAGE \* MERGEFORMAT'
-    run_page._r.append(instr_text)
-    fld_char_sep = OxmlElement('w:fldChar')
-    fld_char_sep.set(qn('w:fldCharType'), 'separate')
-    run_page._r.append(fld_char_sep)
-    fld_char_end = OxmlElement('w:fldChar')
-    fld_char_end.set(qn('w:fldCharType'), 'end')
-    run_page._r.append(fld_char_end)
-
-    # Adiciona " de Y"
-    run_num_pages = page_num_paragraph.add_run(" de ")
-    run_num_pages.font.name = FONTE_CABECALHO_RODAPE
-    run_num_pages.font.size = TAMANHO_CABECALHO_RODAPE
-    # Campo NUMPAGES
-    fld_char_begin_np = OxmlElement('w:fldChar')
-    fld_char_begin_np.set(qn('w:fldCharType'), 'begin')
-    run_num_pages._r.append(fld_char_begin_np)
-    instr_text_np = OxmlElement('w:instrText')
-    instr_text_np.set(qn('xml:space'), 'preserve')
-    instr_text_np.text = 'NUMPAGES \* MERGEFORMAT'
-    run_num_pages._r.append(instr_text_np)
-    fld_char_sep_np = OxmlElement('w:fldChar')
-    fld_char_sep_np.set(qn('w:fldCharType'), 'separate')
-    run_num_pages._r.append(fld_char_sep_np)
-    fld_char_end_np = OxmlElement('w:fldChar')
-    fld_char_end_np.set(qn('w:fldCharType'), 'end')
-    run_num_pages._r.append(fld_char_end_np)
-
-# --- Funções das Seções do Laudo (Numeração e Conteúdo Ajustados) ---
-
-def adicionar_material_recebido(doc, dados_laudo):
-    """Adiciona a seção '1 MATERIAL RECEBIDO PARA EXAME' ao laudo docx."""
-    # Numeração corrigida para 1.
-    adicionar_paragrafo(doc, "1 MATERIAL RECEBIDO PARA EXAME", style='TituloPrincipal')
-    # Texto introdutório pode ser adicionado aqui se desejado. Ex:
-    # adicionar_paragrafo(doc, "O material foi recebido neste Instituto devidamente acondicionado e lacrado.", align='justify', style='Normal')
-
-    imagem_carregada = dados_laudo.get('imagem')
-    if imagem_carregada:
-        inserir_imagem_docx(doc, imagem_carregada)
-        # Adiciona legenda à imagem (usará a cor Cinza SPTC e fonte Gadugi definida no estilo 'Ilustracao')
-        adicionar_paragrafo(doc, "Ilustração 1: Material(is) recebido(s).", style='Ilustracao')
-
-    subitens_cannabis = {}
-    subitens_cocaina = {}
-
-    if not dados_laudo.get('itens'):
-        adicionar_paragrafo(doc, "Nenhum item de material foi descrito para exame.", style='Normal')
-        return subitens_cannabis, subitens_cocaina
-
-    for i, item in enumerate(dados_laudo['itens']):
-        qtd = item.get('qtd', 1)
-        qtd_ext = obter_quantidade_extenso(qtd)
-        tipo_mat_cod = item.get('tipo_mat', '')
-        tipo_material = TIPOS_MATERIAL_BASE.get(tipo_mat_cod, f"tipo '{tipo_mat_cod}'")
-        emb_cod = item.get('emb', '')
-        embalagem = TIPOS_EMBALAGEM_BASE.get(emb_cod, f"embalagem '{emb_cod}'")
-        cor_emb_cod = item.get('cor_emb')
-        desc_cor = ""
-        if cor_emb_cod and emb_cod in ['pl', 'pa', 'e', 'z']:
-            cor = CORES_FEMININO_EMBALAGEM.get(cor_emb_cod, cor_emb_cod)
-            desc_cor = f" de cor {cor}"
-
-        embalagem_base_plural = pluralizar_palavra(embalagem, qtd)
-        embalagem_final = f"{embalagem_base_plural}{desc_cor}"
-        porcao = pluralizar_palavra("porção", qtd)
-        acond = "acondicionada em" if qtd == 1 else "acondicionadas, individualmente, em" # Ajustado ", individualmente,"
-        ref_texto = f", relacionada a {item['pessoa']}" if item.get('pessoa') else ""
-        subitem_ref = item.get('ref', '')
-        # Texto adaptado do código Colab original
-        subitem_texto = f", referente à amostra do subitem {subitem_ref} do laudo de constatação supracitado" if subitem_ref else ""
-        item_num_str = f"1.{i + 1}" # Numeração corrigida para 1.x
-        final_ponto = "."
-        texto = (f"{item_num_str} {qtd} ({qtd_ext}) {porcao} de material {tipo_material}, {acond} {embalagem_final}{subitem_texto}{ref_texto}{final_ponto}")
-        adicionar_paragrafo(doc, texto, style='Normal', align='justify')
-
-        # Mapeamento para Exames/Resultados/Conclusão
-        chave_mapeamento = subitem_ref if subitem_ref else f"Item_{item_num_str}" # Mantém fallback se ref vazia
-        item_num_referencia = item_num_str # Usar a referência 1.x para os textos
-        if tipo_mat_cod in ["v", "r"]:
-            subitens_cannabis[chave_mapeamento] = item_num_referencia
-        elif tipo_mat_cod in ["po", "pd"]:
-             subitens_cocaina[chave_mapeamento] = item_num_referencia
-
-    return subitens_cannabis, subitens_cocaina
-
-def adicionar_objetivo_exames(doc):
-    """Adiciona a seção '2 OBJETIVO DOS EXAMES' (Texto do Colab)."""
-    # Numeração corrigida para 2.
-    adicionar_paragrafo(doc, "2 OBJETIVO DOS EXAMES", style='TituloPrincipal')
-    # Texto do código Colab original
-    texto = ("Visa esclarecer à autoridade requisitante quanto às características do material apresentado, "
-             "bem como se ele contém substância de uso proscrito no Brasil e capaz de causar dependência física e/ou psíquica. "
-             "O presente laudo pericial busca demonstrar a materialidade da infração penal apurada.")
-    adicionar_paragrafo(doc, texto, align='justify', style='Normal')
-
-def adicionar_exames(doc, subitens_cannabis, subitens_cocaina, dados_laudo):
-    """Adiciona a seção '3 EXAMES' (Texto e lógica do Colab)."""
-    # Numeração corrigida para 3.
-    adicionar_paragrafo(doc, "3 EXAMES", style='TituloPrincipal')
-
-    has_cannabis_item = bool(subitens_cannabis)
-    has_cocaina_item = bool(subitens_cocaina)
-
-    # Adota a estrutura de subitens do código Colab
-    idx_subitem = 1
-    if has_cannabis_item:
-        adicionar_paragrafo(doc, f"3.{idx_subitem} Exames realizados para pesquisa de Cannabis sativa L. (maconha)", style='TituloSecundario')
-        adicionar_paragrafo(doc, f"3.{idx_subitem}.1 Ensaio químico com Fast blue salt B: teste de cor em reação com solução aquosa de sal de azul sólido B em meio alcalino;", style='Normal', align='justify')
-        adicionar_paragrafo(doc, f"3.{idx_subitem}.2 Cromatografia em Camada Delgada (CCD), comparativa com substância padrão, em sistemas contendo eluentes apropriados e posterior revelação com solução aquosa de azul sólido B.", style='Normal', align='justify')
-        idx_subitem += 1
-
-    if has_cocaina_item:
-        adicionar_paragrafo(doc, f"3.{idx_subitem} Exames realizados para pesquisa de cocaína", style='TituloSecundario')
-        adicionar_paragrafo(doc, f"3.{idx_subitem}.1 Ensaio químico com teste de tiocianato de cobalto-reação de cor com solução de tiocianato de cobalto em meio ácido;", style='Normal', align='justify')
-        adicionar_paragrafo(doc, f"3.{idx_subitem}.2 Cromatografia em Camada Delgada (CCD), comparativa com substância padrão, em sistemas com eluentes apropriados e revelação com solução de iodo platinado.", style='Normal', align='justify')
-        idx_subitem += 1
-
-    # Se nenhum dos dois foi detectado mas há itens, adiciona exame macroscópico
-    if not has_cannabis_item and not has_cocaina_item and dados_laudo.get('itens'):
-        adicionar_paragrafo(doc, f"3.{idx_subitem} Exames realizados", style='TituloSecundario')
-        adicionar_paragrafo(doc, f"3.{idx_subitem}.1 Exame macroscópico;", style='Normal', align='justify')
-        idx_subitem += 1
-
-    if idx_subitem == 1: # Se nenhum item foi adicionado
-         adicionar_paragrafo(doc, "Nenhum exame específico a relatar com base nos materiais descritos.", style='Normal')
-
-def adicionar_resultados(doc, subitens_cannabis, subitens_cocaina, dados_laudo):
-    """Adiciona a seção '4 RESULTADOS' (Texto e lógica do Colab)."""
-    # Numeração corrigida para 4.
-    adicionar_paragrafo(doc, "4 RESULTADOS", style='TituloPrincipal')
-
-    has_cannabis_item = bool(subitens_cannabis)
-    has_cocaina_item = bool(subitens_cocaina)
-    idx_subitem = 1
-
-    if has_cannabis_item:
-        # Obtém os números dos itens (1.x) associados a Cannabis
-        itens_referencia = sorted(list(subitens_cannabis.values()))
-        refs_str = " e ".join(itens_referencia)
-        label = f"no item {refs_str}" if len(itens_referencia) == 1 else f"nos itens {refs_str}"
-        adicionar_paragrafo(doc, f"4.{idx_subitem} Resultados obtidos para o(s) material(is) descrito(s) {label}:", style='TituloSecundario')
-        adicionar_paragrafo(doc, f"4.{idx_subitem}.1 No ensaio com Fast blue salt B, foram obtidas coloração característica para canabinol e tetrahidrocanabinol (princípios ativos da Cannabis sativa L.).", style='Normal', align='justify')
-        adicionar_paragrafo(doc, f"4.{idx_subitem}.2 Na CCD, obtiveram-se perfis cromatográficos coincidentes com o material de referência (padrão de Cannabis sativa L.); portanto, a substância tetrahidrocanabinol está presente nos materiais questionados.", style='Normal', align='justify')
-        idx_subitem += 1
-
-    if has_cocaina_item:
-        itens_referencia = sorted(list(subitens_cocaina.values()))
-        refs_str = " e ".join(itens_referencia)
-        label = f"no item {refs_str}" if len(itens_referencia) == 1 else f"nos itens {refs_str}"
-        adicionar_paragrafo(doc, f"4.{idx_subitem} Resultados obtidos para o(s) material(is) descrito(s) {label}:", style='TituloSecundario')
-        adicionar_paragrafo(doc, f"4.{idx_subitem}.1 No teste de tiocianato de cobalto, foram obtidas coloração característica para cocaína;", style='Normal', align='justify')
-        adicionar_paragrafo(doc, f"4.{idx_subitem}.2 Na CCD, obteve-se perfis cromatográficos coincidentes com o material de referência (padrão de cocaína); portanto, a substância cocaína está presente nos materiais questionados.", style='Normal', align='justify')
-        idx_subitem += 1
-
-    if idx_subitem == 1: # Se nenhum resultado foi adicionado
-        if dados_laudo.get('itens'):
-            adicionar_paragrafo(doc, "Não foram obtidos resultados positivos para Cannabis ou Cocaína nos testes realizados para os materiais descritos.", style='Normal', align='justify')
-        else:
-            adicionar_paragrafo(doc, "Nenhum material foi submetido a exame, portanto, não há resultados a relatar.", style='Normal', align='justify')
-
-
-def adicionar_conclusao(doc, subitens_cannabis, subitens_cocaina, dados_laudo):
-    """Adiciona a seção '5 CONCLUSÃO' (Texto e lógica do Colab)."""
-    # Numeração corrigida para 5.
-    adicionar_paragrafo(doc, "5 CONCLUSÃO", style='TituloPrincipal')
-
-    conclusoes = []
-    if subitens_cannabis:
-        itens_referencia = sorted(list(subitens_cannabis.values()))
-        refs_str = " e ".join(itens_referencia)
-        label = f"no item {refs_str}" if len(itens_referencia) == 1 else f"nos itens {refs_str}"
-        conclusoes.append(f"no(s) material(is) descrito(s) {label}, foi detectada a presença de partes "
-                           f"da planta Cannabis sativa L., vulgarmente conhecida por maconha. "
-                           f"A Cannabis sativa L. contém princípios ativos chamados canabinóis, dentre os quais se encontra o tetrahidrocanabinol, substância perturbadora do sistema nervoso central. "
-                           f"Tanto a Cannabis sativa L. quanto a tetrahidrocanabinol são proscritas no país, com fulcro na Portaria nº 344/1998, atualizada por meio da RDC nº 970, de 19/03/2025, da Anvisa.") # Data da RDC do código Colab
-
-    if subitens_cocaina:
-        itens_referencia = sorted(list(subitens_cocaina.values()))
-        refs_str = " e ".join(itens_referencia)
-        label = f"no item {refs_str}" if len(itens_referencia) == 1 else f"nos itens {refs_str}" # Ajuste na descrição (era 'no(s) subitem(ns)')
-        conclusoes.append(f"no(s) material(is) descrito(s) {label}, foi detectada a presença de cocaína, substância alcaloide estimulante do sistema nervoso central. A cocaína é proscrita no país, com fulcro na Portaria nº 344/1998, atualizada por meio da RDC nº 970, de 19/03/2025, da Anvisa.") # Data da RDC do código Colab
-
-    if conclusoes:
-        # Junta as conclusões com "Outrossim," como no código Colab
-        texto_final = "A partir das análises realizadas, conclui-se que, " + " Outrossim, ".join(conclusoes)
-    elif dados_laudo.get('itens'): # Se houve itens mas sem resultado positivo
-        texto_final = "A partir das análises realizadas, conclui-se que não foram detectadas substâncias de uso proscrito nos materiais analisados."
-    else: # Se não houve itens
-        texto_final = "Não houve material submetido a exame, portanto, não há conclusões a apresentar."
-
-    adicionar_paragrafo(doc, texto_final, align='justify', style='Normal')
-
-def adicionar_custodia_material(doc, dados_laudo):
-    """Adiciona a seção '6 CUSTÓDIA DO MATERIAL' (Texto do Colab, com Lacre do input)."""
-    # Numeração corrigida para 6.
-    adicionar_paragrafo(doc, "6 CUSTÓDIA DO MATERIAL", style='TituloPrincipal')
-    adicionar_paragrafo(doc, "6.1 Contraprova", style='TituloSecundario') # Usar TituloSecundario para subitem
-
-    # Pega o lacre do estado da sessão (que veio do input do Streamlit)
-    lacre = dados_laudo.get('lacre', '_______') # Usa placeholder se não informado
-
-    # Texto adaptado do código Colab
-    texto_contraprova = (f"A amostra contraprova ficará armazenada neste Instituto, conforme Portaria 0003/2019/SSP "
-                         f"(Lacre nº {lacre}).")
-    adicionar_paragrafo(doc, texto_contraprova, style='Normal', align='justify')
-
-def adicionar_referencias(doc, subitens_cannabis, subitens_cocaina):
-    """Adiciona a seção 'REFERÊNCIAS' (Texto e lógica do Colab)."""
-    adicionar_paragrafo(doc, "REFERÊNCIAS", style='TituloPrincipal')
-    # Tamanho da fonte menor para referências
-    tamanho_ref = 10
-
-    referencias_base = [
-        "BRASIL. Ministério da Saúde. Portaria SVS/MS n° 344, de 12 de maio de 1998. Aprova o regulamento técnico sobre substâncias e medicamentos sujeitos a controle especial. Diário Oficial da União: Brasília, DF, p. 37, 19 maio 1998. Alterada pela RDC nº 970, de 19/03/2025.", # Data da RDC do Colab
-        "GOIÁS. Secretaria de Estado da Segurança Pública. Portaria nº 0003/2019/SSP de 10 de janeiro de 2019. Regulamenta a apreensão, movimentação, exames, acondicionamento, armazenamento e destruição de drogas no âmbito da Secretaria de Estado da Segurança Pública. Diário Oficial do Estado de Goiás: n° 22.972, Goiânia, GO, p. 4-5, 15 jan. 2019.",
-        "SWGDRUG: Scientific Working Group for the Analysis of Seized Drugs. Recommendations. Version 8.0 june. 2019. Disponível em: http://www.swgdrug.org/Documents/SWGDRUG%20Recommendations%20Version%208_FINAL_ForPosting_092919.pdf. Acesso em: 07/10/2019." # Data de acesso fixa do código Colab
-    ]
-
-    for ref in referencias_base:
-        adicionar_paragrafo(doc, ref, style='Normal', align='justify', size=tamanho_ref)
-
-    if subitens_cannabis:
-        adicionar_paragrafo(doc, "UNODC (United Nations Office on Drugs and Crime). Laboratory and scientific section. Recommended Methods for the Identification and Analysis of Cannabis and Cannabis Products. New York: 2012.", style='Normal', align='justify', size=tamanho_ref) # Ano ajustado para 2012 como no Colab v2
-    if subitens_cocaina:
-        adicionar_paragrafo(doc, "UNODC (United Nations Office on Drugs and Crime). Laboratory and Scientific Section. Recommended Methods for the Identification and Analysis of Cocaine in Seized Materials. New York: 2012.", style='Normal', align='justify', size=tamanho_ref)
-
-def adicionar_encerramento_assinatura(doc):
-    """Adiciona a frase de encerramento, data, local e a assinatura do perito (formato Colab)."""
-    # Frase de encerramento pode ser omitida ou adaptada se preferir o "É o laudo."
-    # adicionar_paragrafo(doc, "\nÉ o laudo. Nada mais havendo a lavrar, encerra-se o presente.", style='Normal', align='justify')
+        item['pessoa'] = st.text_input(
+            "Pessoa relacionada (opcional)",
+            value=item['pessoa'],
+            key=f"pessoa_{i}"
+        )
 
+def _reiniciar_widgets_itens(quantidade):
+    """Descarta o estado dos widgets dos itens: na próxima execução eles leem dados_laudo."""
+    for i in range(quantidade):
+        for prefixo in ('qtd', 'mat', 'emb', 'cor', 'ref', 'pessoa'):
+            st.session_state.pop(f"{prefixo}_{i}", None)
+    st.session_state.itens_tabela_base = None
+
+def spool_da_sessao():
+    """SpoolSessao desta sessão: a pasta das imagens é apagada quando a sessão termina."""
+    if 'spool_uploads' not in st.session_state:
+        st.session_state.spool_uploads = SpoolSessao()
+    return st.session_state.spool_uploads
+
+def _liberar_upload(arquivo):
+    """Descarta a cópia do upload mantida pelo Streamlit até o fim da sessão (o arquivo já está em disco)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        contexto = get_script_run_ctx()
+        contexto.uploaded_file_mgr.remove_file(contexto.session_id, arquivo.file_id)
+    except Exception as e:
+        print(f"Upload '{getattr(arquivo, 'name', '')}' não liberado: {e}")
+
+def receber_uploads():
+    """Callback do seletor de imagens: grava os arquivos em disco e reinicia o seletor."""
+    chave = f"image_uploader_{st.session_state.uploader_versao}"
+    spool = spool_da_sessao()
+    imagens = st.session_state.dados_laudo['imagens']
+    presentes = {imagem['arquivo'].sha256 for imagem in imagens}
+    for arquivo in st.session_state.get(chave) or []:
+        registro = spool.guardar(arquivo)
+        if registro.sha256 not in presentes:
+            presentes.add(registro.sha256)
+            imagens.append({'arquivo': registro, 'itens': []})
+        _liberar_upload(arquivo)
+    st.session_state.pop(chave, None)
+    st.session_state.uploader_versao += 1
+
+def remover_imagem(sha256):
+    """Callback: tira a imagem do laudo e apaga o arquivo em disco."""
+    st.session_state.dados_laudo['imagens'] = [imagem for imagem in st.session_state.dados_laudo['imagens']
+                                               if imagem['arquivo'].sha256 != sha256]
+    st.session_state.pop(f"img_itens_{sha256[:16]}", None)
+    pedido = st.session_state.get('tarefa_laudo')
+    if pedido is None or all(imagem['arquivo'].sha256 != sha256 for imagem in pedido[1].get('imagens', [])):
+        spool_da_sessao().remover(sha256) # Se o laudo na fila usa a imagem, o arquivo fica até o fim da sessão
+
+def usuario_da_sessao():
+    """Identificador desta sessão na fila de geração (rodízio e limite de pedidos por usuário)."""
+    if 'usuario_fila' not in st.session_state:
+        st.session_state.usuario_fila = uuid.uuid4().hex
+    return st.session_state.usuario_fila
+
+def concluir_laudo(chave, entrada, dados_laudo):
+    """Marca o laudo como o gerado da sessão e o guarda no caso (armazenamento local)."""
+    st.session_state.laudo_gerado = chave
+    armazenamento = armazenamento_padrao()
+    if armazenamento: # O caso precisa estar no banco antes do laudo
+        armazenamento[1].agendar(st.session_state.caso_id, dados_laudo)
+        armazenamento[1].descarregar()
+        armazenamento[0].guardar_laudo(st.session_state.caso_id, chave, f"{dados_laudo.get('rg_pericia', '').strip()}.docx", entrada.conteudo)
+
+def receber_tarefa(cache_laudos):
+    """Se o pedido desta sessão na fila terminou, guarda o laudo nos caches e no caso (ou mostra o erro)."""
+    pedido = st.session_state.get('tarefa_laudo') # (Tarefa, cópia de dados_laudo submetida)
+    if pedido is None or pedido[0].estado not in ('pronta', 'erro'):
+        return
+    tarefa, dados = st.session_state.pop('tarefa_laudo')
     try:
-        brasilia_tz = pytz.timezone('America/Sao_Paulo')
-        hoje = datetime.now(brasilia_tz)
-    except Exception:
-        hoje = datetime.now() # Fallback
-    mes_atual = meses_portugues.get(hoje.month, f"Mês {hoje.month}")
-    # Formato da data e local do código Colab
-    data_formatada = f"Goiânia, {hoje.day} de {mes_atual} de {hoje.year}."
-
-    doc.add_paragraph() # Espaço
-    adicionar_paragrafo(doc, data_formatada, align='right', style='Normal') # Alinhado à direita como no Colab
-
-    doc.add_paragraph(); doc.add_paragraph() # Mais espaço
-
-    # Assinatura - Usando o formato/texto do Colab
-    adicionar_paragrafo(doc, "Laudo assinado digitalmente com dados do assinador à esquerda das páginas", align='left', style='Normal', size=9, italic=True) # Nota sobre assinatura digital
-    adicionar_paragrafo(doc, "________________________________________", align='center', style='Normal')
-    adicionar_paragrafo(doc, "Daniel Chendes Lima", align='center', style='Normal', bold=True) # Nome do Perito do Colab
-    adicionar_paragrafo(doc, "Perito Criminal", align='center', style='Normal') # Cargo do Colab
-    # Adicionar Matrícula se desejar/tiver
-    # adicionar_paragrafo(doc, "Matrícula nº XXXXXXX", align='center', style='Normal')
-
-def aplicar_italico_fonte_original(doc):
-    """Aplica fonte Gadugi e itálico a termos específicos, como no código Colab original."""
-    termos_para_italico = TERMOS_ITALICO_ORIGINAL
-
-    for paragraph in doc.paragraphs:
-        # Verifica se o parágrafo é a legenda da ilustração para usar tamanho 10
-        is_ilustracao = "Ilustração 1:" in paragraph.text and paragraph.style.name == 'Ilustracao'
-        tamanho_fonte = Pt(10) if is_ilustracao else Pt(12)
-
-        full_text = paragraph.text
-        if not full_text: continue # Pula parágrafos vazios
-
-        # Limpa o parágrafo preservando a formatação original (alinhamento, estilo)
-        original_alignment = paragraph.alignment
-        original_style = paragraph.style
-        paragraph.clear()
-        paragraph.alignment = original_alignment
-        paragraph.style = original_style
-
-        idx = 0
-        while idx < len(full_text):
-            match_found = False
-            # Procura pelo termo mais longo primeiro para evitar correspondências parciais
-            # Ordena por comprimento descendente
-            termos_ordenados = sorted(termos_para_italico, key=len, reverse=True)
-            for phrase in termos_ordenados:
-                # Verifica se o termo começa na posição atual
-                # Adiciona espaço/início de string antes e espaço/fim de string depois para evitar subpalavras (simplificado)
-                # Melhor seria usar regex com word boundaries, mas mantendo a lógica simples do Colab:
-                if full_text[idx:].startswith(phrase):
-                    # Verifica se é uma palavra completa (simplificado)
-                    ends_correctly = (idx + len(phrase) == len(full_text)) or (not full_text[idx + len(phrase)].isalnum())
-                    starts_correctly = (idx == 0) or (not full_text[idx-1].isalnum())
-
-                    if ends_correctly and starts_correctly:
-                        run = paragraph.add_run(phrase)
-                        run.font.name = 'Gadugi'
-                        run.font.size = tamanho_fonte
-                        run.italic = True # Aplica itálico
-                        idx += len(phrase)
-                        match_found = True
-                        break # Sai do loop de termos e continua varrendo o texto
-
-            # Se nenhum termo em itálico foi encontrado começando em 'idx'
-            if not match_found:
-                run = paragraph.add_run(full_text[idx])
-                run.font.name = 'Gadugi'
-                run.font.size = tamanho_fonte
-                run.italic = False # Garante que não seja itálico por padrão
-                idx += 1
-
-        # Se o parágrafo ficou vazio após o processo (pouco provável), restaura o texto original
-        if not paragraph.text and full_text:
-             paragraph.text = full_text
-
-
-# --- Função Principal de Geração do DOCX ---
-
-def gerar_laudo_docx(dados_laudo):
-    """Gera o laudo completo em formato docx."""
-    document = Document()
-    configurar_estilos(document) # Configura estilos COM fonte Gadugi e cores SPTC
-    configurar_pagina(document)
-    adicionar_cabecalho_rodape(document)
-
-    # Adiciona Seções na Ordem Correta usando as funções modificadas
-    subitens_cannabis, subitens_cocaina = adicionar_material_recebido(document, dados_laudo)
-    adicionar_objetivo_exames(document)
-    adicionar_exames(document, subitens_cannabis, subitens_cocaina, dados_laudo)
-    adicionar_resultados(document, subitens_cannabis, subitens_cocaina, dados_laudo)
-    adicionar_conclusao(document, subitens_cannabis, subitens_cocaina, dados_laudo)
-    adicionar_custodia_material(document, dados_laudo) # Passa dados_laudo para pegar o lacre
-    adicionar_referencias(document, subitens_cannabis, subitens_cocaina)
-    adicionar_encerramento_assinatura(document)
-
-    # Aplica fonte Gadugi e itálico usando o método do código Colab original
-    aplicar_italico_fonte_original(document)
-
-    return document
+        entrada = tarefa.resultado()
+        cache_laudos.guardar(tarefa.chave, entrada) # O compartilhado já recebeu da fila
+        incrementar('laudo_cache_laudos_total', origem='gerado')
+        concluir_laudo(tarefa.chave, entrada, dados)
+    except Exception as e:
+        st.error(f"❌ Ocorreu um erro ao gerar o laudo:")
+        st.exception(e)
+        print(f"Erro detalhado na geração do DOCX: {e}\n{traceback.format_exc()}")
+
+@st.fragment(run_every=1)
+def acompanhar_geracao():
+    """Posição na fila e tempo estimado, atualizados a cada segundo; recarrega a página quando o laudo fica pronto.
+
+    Só é montado enquanto há tarefa pendente: o st.rerun() do fim da geração o desmonta e o timer para.
+    """
+    pedido = st.session_state.get('tarefa_laudo')
+    if pedido is None:
+        return
+    tarefa, fila = pedido[0], fila_padrao()
+    if tarefa.estado in ('pronta', 'erro'):
+        st.rerun()
+    estimativa = fila.estimativa(tarefa)
+    restante = f" (cerca de {estimativa:.0f} s)" if estimativa is not None else ""
+    if tarefa.estado == 'fila':
+        st.info(f"⏳ Laudo na fila de geração: posição {fila.posicao(tarefa)}{restante}.")
+    else:
+        st.info(f"⚙️ Gerando documento...{restante}")
+
+def dados_laudo_vazio():
+    return {
+        'rg_pericia': '', # Adicionado
+        'lacre': '',      # Adicionado
+        'itens': [],
+        'imagens': [], # [{'arquivo': ArquivoEmDisco, 'itens': ['1.1', ...]}] (ver laudo_uploads)
+        'ilustracao_grade': False,
+        'agrupar_itens': False # Um parágrafo por grupo de itens idênticos (grandes apreensões)
+    }
+
+def abrir_caso(caso_id, dados=None):
+    """Callback: troca o caso da sessão (dados=None abre o salvo com esse id) e reinicia os widgets."""
+    armazenamento = armazenamento_padrao()
+    if dados is None:
+        armazenamento[1].descarregar() # O rascunho do caso atual vai para o banco antes da troca
+        dados = armazenamento[0].carregar_caso(caso_id)
+        if dados is None:
+            st.session_state.aviso_casos = "Caso não encontrado no armazenamento."
+            return
+        armazenamento[1].marcar_gravado(caso_id, dados)
+    anteriores = len(st.session_state.get('dados_laudo', {}).get('itens', []))
+    st.session_state.dados_laudo = dict(dados_laudo_vazio(), **dados)
+    st.session_state.caso_id = caso_id
+    st.query_params['caso'] = caso_id
+    _reiniciar_widgets_itens(max(anteriores, len(st.session_state.dados_laudo['itens'])))
+    if 'spool_uploads' in st.session_state: # Imagens do caso anterior saem do disco
+        st.session_state.spool_uploads.manter(imagem['arquivo'] for imagem in st.session_state.dados_laudo['imagens'])
+    for chave in ('rg_pericia_input', 'lacre_input', 'ilustracao_grade_input', 'agrupar_itens_input', 'laudo_gerado', 'pdf_laudo', 'laudo_salvo', 'tarefa_laudo'):
+        st.session_state.pop(chave, None)
+    st.session_state.num_itens_input = len(st.session_state.dados_laudo['itens'])
+
+def novo_caso():
+    """Callback: começa um caso em branco (o atual continua salvo)."""
+    armazenamento = armazenamento_padrao()
+    if armazenamento:
+        armazenamento[1].descarregar()
+    abrir_caso(novo_caso_id(), dados_laudo_vazio())
+
+def painel_casos_salvos(repositorio):
+    """Busca de casos salvos (RG, lacre, pessoa) e laudos já gerados do caso atual."""
+    with st.expander("Casos salvos (rascunhos e laudos gerados)"):
+        st.caption("O caso atual é salvo automaticamente (sem as imagens) e reaberto ao recarregar a página.")
+        col_rg, col_lacre, col_pessoa = st.columns(3)
+        busca_rg = col_rg.text_input("RG da Perícia", key="busca_rg")
+        busca_lacre = col_lacre.text_input("Lacre", key="busca_lacre")
+        busca_pessoa = col_pessoa.text_input("Pessoa", key="busca_pessoa")
+        casos = repositorio.buscar(busca_rg, busca_lacre, busca_pessoa, limite=20)
+        if not casos:
+            st.info("Nenhum caso encontrado.")
+        for caso in casos:
+            col_texto, col_botao = st.columns([5, 1])
+            atual = " (atual)" if caso['id'] == st.session_state.caso_id else ""
+            quando = datetime.fromtimestamp(caso['atualizado']).strftime('%d/%m/%Y %H:%M')
+            col_texto.markdown(f"**{caso['rg_pericia'] or 'sem RG'}** · lacre {caso['lacre'] or '-'} · "
+                               f"{caso['itens']} item(ns) · {quando}{atual}")
+            col_botao.button("Abrir", key=f"abrir_{caso['id']}", on_click=abrir_caso, args=(caso['id'],), disabled=bool(atual))
+        st.button("➕ Novo caso", on_click=novo_caso)
+        if 'aviso_casos' in st.session_state:
+            st.warning(st.session_state.pop('aviso_casos'))
+
+        laudos = repositorio.laudos_do_caso(st.session_state.caso_id)
+        if laudos:
+            opcoes = {laudo['id']: f"{laudo['nome']} · {datetime.fromtimestamp(laudo['gerado']).strftime('%d/%m/%Y %H:%M')}"
+                      for laudo in laudos}
+            laudo_id = st.selectbox("Laudos gerados deste caso", list(opcoes), format_func=opcoes.get, key="laudo_salvo_id")
+            if st.button("Preparar download do laudo salvo"):
+                st.session_state.laudo_salvo = (laudo_id,) + repositorio.obter_laudo(laudo_id)
+            salvo = st.session_state.get('laudo_salvo')
+            if salvo is not None and salvo[0] == laudo_id:
+                st.download_button(f"✅ Download {salvo[1]}", data=salvo[2], file_name=salvo[1],
+                                   mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                   key="download_laudo_salvo")
+
+def importar_itens_em_lote():
+    """Callback do botão 'Importar itens': roda antes do script, então pode reiniciar os widgets dos itens."""
+    arquivo = st.session_state.get('importacao_arquivo')
+    texto = arquivo.getvalue().decode('utf-8-sig') if arquivo is not None else st.session_state.get('importacao_texto', '')
+    novos, erros = importar_itens(texto)
+    itens = st.session_state.dados_laudo['itens']
+    anteriores = len(itens)
+    if st.session_state.get('importacao_modo') == "Substituir os itens":
+        itens[:] = novos
+    else:
+        itens.extend(novos)
+    # Os widgets dos itens voltam a ler os valores de dados_laudo
+    _reiniciar_widgets_itens(max(anteriores, len(itens)))
+    st.session_state.num_itens_input = len(itens)
+    st.session_state.resultado_importacao = (len(novos), erros)
+
+def _item_da_tabela(linha):
+    """Normaliza uma linha do st.data_editor (células vazias viram os valores padrão do item)."""
+    qtd = linha.get('qtd')
+    return {
+        'qtd': int(qtd) if qtd and qtd == qtd else 1, # qtd == qtd descarta NaN
+        'tipo_mat': linha.get('tipo_mat') or OPCOES_MATERIAL[0],
+        'emb': linha.get('emb') or OPCOES_EMBALAGEM[0],
+        'cor_emb': linha.get('cor_emb') or None,
+        'ref': linha.get('ref') or '',
+        'pessoa': linha.get('pessoa') or '',
+    }
+
+def editar_itens_tabela(numero_itens):
+    """Editor tabular: um único st.data_editor para todos os itens, em vez de seis widgets por item."""
+    itens = st.session_state.dados_laudo['itens']
+    # A base do editor só é remontada quando o número de itens ou o modo muda;
+    # entre um rerun e outro as edições ficam no estado do próprio widget.
+    if st.session_state.get('itens_tabela_base') is None or len(st.session_state.itens_tabela_base) != numero_itens:
+        st.session_state.itens_tabela_base = [dict(item) for item in itens]
+        st.session_state.pop('itens_editor', None)
+    editados = st.data_editor(
+        st.session_state.itens_tabela_base,
+        key='itens_editor',
+        num_rows='fixed',
+        column_order=('qtd', 'tipo_mat', 'emb', 'cor_emb', 'ref', 'pessoa'),
+        column_config={
+            'qtd': st.column_config.NumberColumn("Quantidade", min_value=1, step=1, required=True),
+            'tipo_mat': st.column_config.SelectboxColumn("Tipo de material", options=OPCOES_MATERIAL, required=True,
+                                                         format_func=lambda codigo: TIPOS_MATERIAL_BASE.get(codigo, codigo)),
+            'emb': st.column_config.SelectboxColumn("Embalagem", options=OPCOES_EMBALAGEM, required=True,
+                                                    format_func=lambda codigo: TIPOS_EMBALAGEM_BASE.get(codigo, codigo)),
+            'cor_emb': st.column_config.SelectboxColumn("Cor", options=OPCOES_COR[1:], help="Só usada em plástico, papel, eppendorf e ziplock",
+                                                        format_func=lambda codigo: CORES_FEMININO_EMBALAGEM.get(codigo, codigo)),
+            'ref': st.column_config.TextColumn("Referência do subitem"),
+            'pessoa': st.column_config.TextColumn("Pessoa relacionada (opcional)"),
+        },
+    )
+    for i, linha in enumerate(editados[:numero_itens]):
+        itens[i] = _item_da_tabela(linha)
 
 # --- Interface Streamlit ---
-st.set_page_config(layout="centered", page_title="Gerador de Laudo")
 def main():
-st.set_page_config(layout="centered", page_title="Gerador de Laudo")
+    st.set_page_config(layout="centered", page_title="Gerador de Laudo")
+    # Na primeira execução do processo: recursos e um laudo descartável, aqui e nos processos da fila
+    aquecer_em_segundo_plano(fila_padrao())
 
     # --- Cores UI ---
     UI_COR_AZUL_SPTC = "#eaeff2"
@@ -659,8 +357,7 @@ st.set_page_config(layout="centered", page_title="Gerador de Laudo")
     data_placeholder = st.empty()
     def atualizar_data():
         try:
-            brasilia_tz = pytz.timezone('America/Sao_Paulo')
-            now = datetime.now(brasilia_tz)
+            now = datetime.now(fuso_horario())
             dia_semana = dias_semana_portugues.get(now.weekday(), '')
             mes = meses_portugues.get(now.month, '')
             data_formatada = f"{dia_semana}, {now.day} de {mes} de {now.year}"
@@ -685,10 +382,10 @@ st.set_page_config(layout="centered", page_title="Gerador de Laudo")
     col_logo, col_titulo = st.columns([1, 5]) # Ex: Proporção 1 para logo, 5 para título
 
     with col_logo: # Coluna da Logo
-        logo_path = "logo_policia_cientifica.png"
+        logo_path = CAMINHO_LOGO
         try:
-            # Reduz a largura da imagem da logo
-            st.image(logo_path, width=100) # <<-- LARGURA REDUZIDA AQUI (Ajuste 100, 110, 120...)
+            # Logo já reduzido para a largura exibida (carregado uma vez por processo)
+            st.image(logo(LARGURA_LOGO), width=LARGURA_LOGO)
         except FileNotFoundError:
             st.error(f"Erro: Logo '{logo_path}' não encontrado.")
             st.info("Coloque 'logo_policia_cientifica.png' na mesma pasta do script.")
@@ -702,19 +399,34 @@ st.set_page_config(layout="centered", page_title="Gerador de Laudo")
 
     st.markdown("---") # Separador visual
 
+    # --- Caso da Sessão (armazenamento local; ?caso=<id> na URL reabre o rascunho) ---
+    armazenamento = armazenamento_padrao()
+    if 'caso_id' not in st.session_state:
+        caso_id = st.query_params.get('caso')
+        dados_salvos = None
+        if armazenamento and caso_id and 'dados_laudo' not in st.session_state:
+            dados_salvos = armazenamento[0].carregar_caso(caso_id)
+        if dados_salvos is not None:
+            armazenamento[1].marcar_gravado(caso_id, dados_salvos)
+            st.session_state.dados_laudo = dict(dados_laudo_vazio(), **dados_salvos)
+        else:
+            caso_id = novo_caso_id()
+        st.session_state.caso_id = caso_id
+        if armazenamento:
+            st.query_params['caso'] = caso_id
+    if armazenamento:
+        painel_casos_salvos(armazenamento[0])
+
     # --- Inicialização do Estado da Sessão (Adicionado lacre e rg_pericia) ---
     if 'dados_laudo' not in st.session_state:
-        st.session_state.dados_laudo = {
-            'rg_pericia': '', # Adicionado
-            'lacre': '',      # Adicionado
-            'itens': [],
-            'imagem': None
-        }
+        st.session_state.dados_laudo = dados_laudo_vazio()
     # Garante que as chaves existem mesmo se o estado já foi inicializado antes
     if 'rg_pericia' not in st.session_state.dados_laudo: st.session_state.dados_laudo['rg_pericia'] = ''
     if 'lacre' not in st.session_state.dados_laudo: st.session_state.dados_laudo['lacre'] = ''
     if 'itens' not in st.session_state.dados_laudo: st.session_state.dados_laudo['itens'] = []
-    if 'imagem' not in st.session_state.dados_laudo: st.session_state.dados_laudo['imagem'] = None
+    if 'imagens' not in st.session_state.dados_laudo: st.session_state.dados_laudo['imagens'] = []
+    if 'ilustracao_grade' not in st.session_state.dados_laudo: st.session_state.dados_laudo['ilustracao_grade'] = False
+    if 'agrupar_itens' not in st.session_state.dados_laudo: st.session_state.dados_laudo['agrupar_itens'] = False
     if not isinstance(st.session_state.dados_laudo.get('itens'), list): st.session_state.dados_laudo['itens'] = []
 
 
@@ -741,133 +453,233 @@ st.set_page_config(layout="centered", page_title="Gerador de Laudo")
     # --- Coleta de Dados para o Laudo (Itens) ---
     st.header("1 MATERIAL RECEBIDO PARA EXAME")
 
-numero_itens = st.number_input(
-    "Número de tipos diferentes de material/acondicionamento a descrever",
-    min_value=0,
-    value=max(0, len(st.session_state.dados_laudo.get('itens', []))),
-    step=1,
-    key="num_itens_input"
-)
-
-# --- Mantida a lógica de adição/remoção de itens ---
-current_num_itens = len(st.session_state.dados_laudo['itens'])
-if numero_itens > current_num_itens:
-    for _ in range(numero_itens - current_num_itens):
-        st.session_state.dados_laudo['itens'].append({
-            'qtd': 1, 'tipo_mat': list(TIPOS_MATERIAL_BASE.keys())[0],
-            'emb': list(TIPOS_EMBALAGEM_BASE.keys())[0], 'cor_emb': None,
-            'ref': '', 'pessoa': ''
-        })
-elif numero_itens < current_num_itens:
-    st.session_state.dados_laudo['itens'] = st.session_state.dados_laudo['itens'][:numero_itens]
-
-# --- Interface simplificada mantendo os expanders ---
-if numero_itens > 0:
-    for i in range(numero_itens):
-        with st.expander(f"Item 1.{i + 1}", expanded=True):
-            item = st.session_state.dados_laudo['itens'][i]
-            
-            # Linha 1
-            col1, col2 = st.columns([1, 3])
-            with col1:
-                item['qtd'] = st.number_input(
-                    "Quantidade", 
-                    min_value=1,
-                    value=item['qtd'],
-                    key=f"qtd_{i}"
-                )
-            
-            with col2:
-                item['tipo_mat'] = st.selectbox(
-                    "Tipo de material",
-                    options=list(TIPOS_MATERIAL_BASE.keys()),
-                    index=list(TIPOS_MATERIAL_BASE.keys()).index(item['tipo_mat']),
-                    key=f"mat_{i}"
-                )
-
-            # Linha 2
-            col3, col4 = st.columns([3, 2])
-            with col3:
-                item['emb'] = st.selectbox(
-                    "Embalagem",
-                    options=list(TIPOS_EMBALAGEM_BASE.keys()),
-                    index=list(TIPOS_EMBALAGEM_BASE.keys()).index(item['emb']),
-                    key=f"emb_{i}"
-                )
-            
-            with col4:
-                if item['emb'] in ['pl', 'pa', 'e', 'z']:
-                    item['cor_emb'] = st.selectbox(
-                        "Cor",
-                        options=[None] + list(CORES_FEMININO_EMBALAGEM.keys()),
-                        index=0 if item['cor_emb'] is None else list(CORES_FEMININO_EMBALAGEM.keys()).index(item['cor_emb']) + 1,
-                        key=f"cor_{i}"
-                    )
-                else:
-                    st.info("Sem cor específica")
-
-            # Linha 3
-            item['ref'] = st.text_input(
-                "Referência do subitem",
-                value=item['ref'],
-                key=f"ref_{i}"
-            )
+    # --- Importação em lote (códigos do Colab ou CSV) ---
+    with st.expander("Importar itens em lote (códigos do Colab ou CSV)"):
+        st.text_area(
+            "Um item por linha: qtd tipo_mat emb [cor] [ref] [pessoa]",
+            key="importacao_texto",
+            placeholder="3 v z t 1.2 Fulano de Tal\n1 po e 2.1\n10 v a - 1.3 Violeta Souza",
+            help="Códigos — material: " + ", ".join(TIPOS_MATERIAL_BASE) + "; embalagem: " + ", ".join(TIPOS_EMBALAGEM_BASE)
+                 + "; cor: " + ", ".join(CORES_FEMININO_EMBALAGEM) + ". Use '-' para pular a cor. "
+                 "Também aceita CSV com cabeçalho qtd,tipo_mat,emb,cor_emb,ref,pessoa."
+        )
+        st.file_uploader("...ou um arquivo CSV/TXT", type=["csv", "txt"], key="importacao_arquivo")
+        st.radio("Itens importados", ["Acrescentar aos itens", "Substituir os itens"], horizontal=True, key="importacao_modo")
+        st.button("📥 Importar itens", on_click=importar_itens_em_lote)
+        if 'resultado_importacao' in st.session_state:
+            importados, erros = st.session_state.resultado_importacao
+            if importados:
+                st.success(f"{importados} item(ns) importado(s).")
+            for num_linha, linha, erro in erros[:50]:
+                st.warning(f"Linha {num_linha} ('{linha}'): {erro}")
+            if len(erros) > 50:
+                st.warning(f"... e mais {len(erros) - 50} linha(s) com erro.")
+
+    # Valor inicial via session_state (a importação em lote também o altera)
+    if 'num_itens_input' not in st.session_state:
+        st.session_state.num_itens_input = len(st.session_state.dados_laudo.get('itens', []))
+    numero_itens = st.number_input(
+        "Número de tipos diferentes de material/acondicionamento a descrever",
+        min_value=0,
+        step=1,
+        key="num_itens_input"
+    )
+
+    # --- Mantida a lógica de adição/remoção de itens ---
+    current_num_itens = len(st.session_state.dados_laudo['itens'])
+    if numero_itens > current_num_itens:
+        for _ in range(numero_itens - current_num_itens):
+            st.session_state.dados_laudo['itens'].append({
+                'qtd': 1, 'tipo_mat': OPCOES_MATERIAL[0],
+                'emb': OPCOES_EMBALAGEM[0], 'cor_emb': None,
+                'ref': '', 'pessoa': ''
+            })
+    elif numero_itens < current_num_itens:
+        st.session_state.dados_laudo['itens'] = st.session_state.dados_laudo['itens'][:numero_itens]
+
+    # --- Editor de itens: formulário (um fragmento por item) ou tabela (apreensões grandes) ---
+    if numero_itens > 0:
+        modo_itens = st.radio(
+            "Modo de edição dos itens",
+            options=[MODO_FORMULARIO, MODO_TABELA],
+            index=1 if numero_itens > LIMITE_ITENS_FORMULARIO else 0,
+            horizontal=True,
+            key="modo_itens_input",
+            help="A tabela edita todos os itens num único componente e é mais rápida com muitos itens."
+        )
+        if modo_itens != st.session_state.get('modo_itens_anterior'):
+            st.session_state.itens_tabela_base = None # Itens editados no outro modo: remonta a tabela
+            st.session_state.modo_itens_anterior = modo_itens
+        if modo_itens == MODO_TABELA:
+            editar_itens_tabela(numero_itens)
+        else:
+            for i in range(numero_itens):
+                editar_item(i)
+    if numero_itens > 1:
+        st.session_state.dados_laudo['agrupar_itens'] = st.checkbox(
+            "Agrupar itens idênticos no laudo (ex.: \"Itens 1.1 a 1.250: ...\")",
+            value=st.session_state.dados_laudo['agrupar_itens'],
+            key="agrupar_itens_input",
+            help="Itens de mesmo material, embalagem, cor e pessoa viram um único parágrafo, com as quantidades somadas."
+        )
 
-            item['pessoa'] = st.text_input(
-                "Pessoa relacionada (opcional)",
-                value=item['pessoa'],
-                key=f"pessoa_{i}"
-            )
-            
     st.markdown("---")
 
-    # --- Upload de Imagem ---
-    st.header("Ilustração (Opcional)")
-    uploaded_image = st.file_uploader(
-        "Carregar imagem do(s) material(is) recebido(s)",
+    # --- Upload de Imagens ---
+    st.header("Ilustrações (Opcional)")
+    # O upload vai para o disco (laudo_uploads) e o seletor é reiniciado: a sessão guarda só as prévias
+    if 'uploader_versao' not in st.session_state:
+        st.session_state.uploader_versao = 0
+    st.file_uploader(
+        "Carregar imagens do(s) material(is) recebido(s)",
         type=["png", "jpg", "jpeg", "bmp", "gif"],
-        key="image_uploader",
-        help="Faça o upload de uma imagem. Será incluída na Seção 1."
+        accept_multiple_files=True,
+        key=f"image_uploader_{st.session_state.uploader_versao}",
+        on_change=receber_uploads,
+        help="Faça o upload de uma ou mais imagens. Serão incluídas na Seção 1 como 'Ilustração N'."
+        )
+    referencias_itens = [f"1.{i + 1}" for i in range(numero_itens)]
+    imagens = st.session_state.dados_laudo['imagens']
+    for idx, imagem in enumerate(imagens):
+        arquivo = imagem['arquivo']
+        chave_itens = f"img_itens_{arquivo.sha256[:16]}"
+        # Itens que deixaram de existir saem da seleção (o multiselect exige opções válidas)
+        st.session_state[chave_itens] = [ref for ref in st.session_state.get(chave_itens, imagem['itens']) if ref in referencias_itens]
+        col_previa, col_itens = st.columns([1, 3])
+        with col_previa:
+            if arquivo.previa:
+                st.image(arquivo.previa, width='stretch')
+            else:
+                st.caption(f"🖼️ {arquivo.nome} (sem prévia)")
+        with col_itens:
+            imagem['itens'] = st.multiselect(
+                f"Itens mostrados em '{arquivo.nome}' (Ilustração {idx + 1})",
+                options=referencias_itens,
+                key=chave_itens
+            )
+            st.button("Remover imagem", key=f"remover_img_{arquivo.sha256[:16]}", on_click=remover_imagem, args=(arquivo.sha256,))
+    if len(imagens) > 1:
+        st.session_state.dados_laudo['ilustracao_grade'] = st.checkbox(
+            "Combinar as fotos numa única ilustração (grade numerada)",
+            value=st.session_state.dados_laudo['ilustracao_grade'],
+            key="ilustracao_grade_input"
         )
-    # Atualiza estado da imagem
-    if uploaded_image is not None:
-        st.session_state.dados_laudo['imagem'] = uploaded_image
-    # Detecta se o usuário removeu a imagem
-    elif 'image_uploader' in st.session_state and st.session_state.image_uploader is None:
-         st.session_state.dados_laudo['imagem'] = None
-
 
     # --- Botão de Geração e Download ---
     st.markdown("---")
     st.header("Gerar e Baixar Laudo")
 
+    # Laudos gerados nesta sessão, pelo hash do conteúdo: sobrevivem aos reruns
+    if 'cache_laudos' not in st.session_state:
+        st.session_state.cache_laudos = CacheLaudos()
+    cache_laudos = st.session_state.cache_laudos
+    chave_atual = chave_laudo(st.session_state.dados_laudo)
+    rg_pericia = st.session_state.dados_laudo.get('rg_pericia', '').strip()
+    receber_tarefa(cache_laudos)
+
     if st.button("📊 Gerar Laudo (.docx)"):
         # Validação simples: Verifica se RG da Perícia foi preenchido
-        rg_pericia = st.session_state.dados_laudo.get('rg_pericia', '').strip()
         if not rg_pericia:
             st.warning("⚠️ Por favor, informe o RG da Perícia para gerar o nome do arquivo.")
         else:
-            with st.spinner("Gerando documento... Por favor, aguarde."):
+            # Sem mudanças desde a última geração, o laudo sai direto do cache
+            entrada, origem = obter_em_cache(chave_atual, cache_laudos, cache_compartilhado)
+            if entrada is not None:
+                incrementar('laudo_cache_laudos_total', origem=origem)
+                concluir_laudo(chave_atual, entrada, st.session_state.dados_laudo)
+                st.info("Dados sem alteração: laudo reaproveitado do cache.")
+            elif st.session_state.get('tarefa_laudo', (None,))[0] is None or st.session_state.tarefa_laudo[0].chave != chave_atual:
+                # A geração roda na fila do servidor; a cópia evita que edições feitas enquanto espera entrem no laudo
+                dados = copy.deepcopy(st.session_state.dados_laudo)
                 try:
-                    document = gerar_laudo_docx(st.session_state.dados_laudo)
-                    doc_io = io.BytesIO()
-                    document.save(doc_io)
-                    doc_io.seek(0)
-
-                    # Usa o RG da Perícia para o nome do arquivo
-                    file_name = f"{rg_pericia}.docx"
-
-                    st.download_button(
-                        label=f"✅ Download Laudo ({file_name})", data=doc_io,
-                        file_name=file_name,
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        key="download_button"
-                    )
-                    st.success("Laudo gerado com sucesso! Clique no botão acima para baixar.")
-                except Exception as e:
-                    st.error(f"❌ Ocorreu um erro ao gerar o laudo:")
-                    st.exception(e)
-                    print(f"Erro detalhado na geração do DOCX: {e}\n{traceback.format_exc()}")
+                    tarefa = fila_padrao().submeter(dados, chave=chave_atual, usuario=usuario_da_sessao())
+                    st.session_state.tarefa_laudo = (tarefa, dados)
+                except FilaGeracaoCheia as e:
+                    st.warning(f"⚠️ O servidor está ocupado ({e}); tente novamente em instantes.")
+    if st.session_state.get('tarefa_laudo'): # Sem tarefa, nenhum rerun periódico do fragmento
+        acompanhar_geracao()
+
+    # O botão de download continua disponível enquanto os dados não mudarem
+    entrada = cache_laudos.obter(chave_atual) if st.session_state.get('laudo_gerado') == chave_atual else None
+    if entrada is not None:
+        for aviso in entrada.avisos: # Falha na imagem não impede o laudo: apenas exibe o erro
+            st.error(aviso)
+        # Usa o RG da Perícia para o nome do arquivo
+        file_name = f"{rg_pericia}.docx"
+        st.download_button(
+            label=f"✅ Download Laudo ({file_name})", data=entrada.conteudo,
+            file_name=file_name,
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            key="download_button"
+        )
+        st.success("Laudo gerado com sucesso! Clique no botão acima para baixar.")
+
+        # --- PDF (pool de conversores do processo, compartilhado entre as sessões) ---
+        if conversor_disponivel():
+            pdf = st.session_state.get('pdf_laudo') # (chave, bytes) do último PDF convertido
+            if (pdf is None or pdf[0] != chave_atual) and st.button("📄 Converter para PDF"):
+                try:
+                    with st.spinner("Convertendo para PDF..."):
+                        pdf = st.session_state.pdf_laudo = (chave_atual, pool_padrao().converter(entrada.conteudo, bloquear=False))
+                except FilaCheia:
+                    st.warning("⚠️ O conversor de PDF está ocupado; tente novamente em instantes.")
+                except ErroConversao as e:
+                    st.error(f"❌ Falha ao converter o laudo para PDF: {e}")
+            if pdf is not None and pdf[0] == chave_atual:
+                st.download_button(
+                    label=f"✅ Download PDF ({rg_pericia}.pdf)", data=pdf[1],
+                    file_name=f"{rg_pericia}.pdf", mime="application/pdf", key="download_pdf_button"
+                )
+    elif st.session_state.get('laudo_gerado'):
+        st.info("Os dados mudaram desde a última geração: gere o laudo novamente para baixar a versão atual.")
+
+    # --- Exportação em Lote (.zip) ---
+    with st.expander("Exportação em lote (.zip)"):
+        manifesto = st.file_uploader(
+            "Manifesto de casos (JSONL ou CSV, mesmo formato do laudo_lote.py)",
+            type=["jsonl", "csv"],
+            key="manifesto_uploader",
+            help="Cada laudo é gravado no ZIP assim que fica pronto; o ZIP inclui 'manifesto.json' com tamanhos e tempos."
+        )
+        incluir_pdf = conversor_disponivel() and st.checkbox("Incluir o PDF de cada laudo no ZIP", key="lote_pdf_input")
+        if manifesto is not None and st.button("📦 Gerar lote (.zip)"):
+            formato = 'csv' if manifesto.name.lower().endswith('.csv') else 'jsonl'
+            progresso = st.empty()
+            contagem = {'ok': 0, 'falhas': 0}
+            def ao_progresso(registro):
+                contagem['ok' if registro['arquivo'] else 'falhas'] += 1
+                progresso.text(f"{contagem['ok']} laudo(s) gerado(s), {contagem['falhas']} com erro...")
+            try:
+                # ZIP em arquivo temporário no disco: os laudos não ficam acumulados em memória
+                arquivo_zip = tempfile.TemporaryFile()
+                texto_manifesto = io.TextIOWrapper(manifesto, encoding='utf-8', newline='')
+                with st.spinner("Gerando lote... Por favor, aguarde."):
+                    entradas = exportar_zip(ler_manifesto(texto_manifesto, formato), arquivo_zip, ao_progresso=ao_progresso,
+                                            pool_pdf=pool_padrao() if incluir_pdf else None)
+                texto_manifesto.detach()
+                arquivo_zip.seek(0)
+                for entrada in entradas:
+                    if not entrada['arquivo']:
+                        st.warning(f"Linha {entrada['linha']} ({entrada['rg_pericia'] or 'sem RG'}): {entrada['erro']}")
+                    elif incluir_pdf and not entrada.get('pdf'):
+                        st.warning(f"Linha {entrada['linha']} ({entrada['rg_pericia']}): PDF não gerado.")
+                st.download_button(
+                    label=f"✅ Download Lote ({contagem['ok']} laudos)", data=arquivo_zip,
+                    file_name="laudos.zip", mime="application/zip", key="download_zip_button"
+                )
+            except Exception as e:
+                st.error("❌ Ocorreu um erro ao gerar o lote:")
+                st.exception(e)
+                print(f"Erro detalhado na exportação ZIP: {e}\n{traceback.format_exc()}")
+
+    # --- Salvamento automático (gravado em lote quando as mudanças param) ---
+    dados = st.session_state.dados_laudo
+    if armazenamento and (dados['rg_pericia'] or dados['lacre'] or dados['itens']):
+        armazenamento[1].agendar(st.session_state.caso_id, dados)
+
+    # --- Métricas (tempos por etapa e contadores deste processo) ---
+    with st.expander("Métricas de desempenho"):
+        st.code(exportar_prometheus(), language="text")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+API HTTP assíncrona de geração de laudos (somente biblioteca padrão).
+
+O laço asyncio só recebe e responde requisições; gerar_laudo_docx roda num
+pool limitado de processos. Quando há 'max_fila' laudos pendentes (em geração
+ou esperando processo), novas requisições recebem 429 com Retry-After; cada
+laudo tem um tempo limite (504 quando estoura).
+
+Rotas:
+    POST /laudos[?backend=ooxml]   gera o laudo e devolve o .docx
+        application/json:    dados_laudo; 'imagem' e 'imagens' em base64
+                             (aceita prefixo 'data:image/...;base64,');
+                             'imagens' também aceita {"arquivo": <base64>, "itens": [...]}
+        multipart/form-data: campo 'dados' (JSON de dados_laudo) e arquivos
+                             'imagem' e 'imagens' (repetível); em dados['imagens'],
+                             {"arquivo": "<nome do campo>", "itens": [...]} usa
+                             o arquivo enviado naquele campo
+    GET /saude                     estado do serviço (JSON)
+    GET /metricas                  métricas no formato Prometheus
+
+Uso:
+    python laudo_api.py --porta 8502 -j 4 --fila 16 --timeout 60
+    curl -o laudo.docx -H 'Content-Type: application/json' -d @caso.json localhost:8502/laudos
+    curl -o laudo.docx -F dados=@caso.json -F imagem=@foto.jpg localhost:8502/laudos
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import io
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from urllib.parse import parse_qs, quote, urlsplit
+
+import laudo_metricas
+from laudo_metricas import HISTOGRAMA_ETAPAS, incrementar, observar, registrar_evento
+
+PORTA_PADRAO = 8502
+TIMEOUT_PADRAO = float(os.environ.get('LAUDO_API_TIMEOUT', '60'))
+MAX_CORPO = 64 * 1024 * 1024 # Bytes aceitos por requisição (imagens incluídas)
+TIMEOUT_OCIOSO = 30.0 # Conexão keep-alive sem nova requisição é fechada
+
+MOTIVOS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 415: 'Unsupported Media Type', 429: 'Too Many Requests',
+           500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+MIME_DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+class ErroRequisicao(Exception):
+    """Requisição inválida: vira uma resposta com o status indicado."""
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+# --- Processo Trabalhador ---
+
+def _aquecer_trabalhador():
+    """Inicializador do pool: carrega os recursos e gera um laudo descartável antes do primeiro laudo."""
+    from laudo_recursos import aquecer
+    aquecer(interface=False)
+
+def _como_arquivo(valor):
+    return io.BytesIO(valor) if isinstance(valor, (bytes, bytearray)) else valor
+
+def gerar_laudo_api(dados_laudo, backend=None):
+    """Executa no processo trabalhador. Retorna (EntradaLaudo, métricas extraídas do processo)."""
+    from laudo_cache import gerar_entrada
+    dados = dict(dados_laudo)
+    dados['imagem'] = _como_arquivo(dados.get('imagem'))
+    dados['imagens'] = [dict(imagem, arquivo=_como_arquivo(imagem['arquivo'])) if isinstance(imagem, dict) else _como_arquivo(imagem)
+                        for imagem in dados.get('imagens') or []]
+    entrada = gerar_entrada(dados, backend)
+    return entrada, laudo_metricas.extrair()
+
+# --- Leitura do Corpo ---
+
+def _decodificar_base64(valor, campo):
+    if valor.startswith('data:'):
+        valor = valor.partition(',')[2]
+    try:
+        return base64.b64decode(valor, validate=True)
+    except (binascii.Error, ValueError):
+        raise ErroRequisicao(400, f"'{campo}' não é base64 válido")
+
+def dados_de_json(corpo):
+    """dados_laudo de um corpo JSON, com as imagens em base64 convertidas para bytes."""
+    try:
+        dados = json.loads(corpo)
+    except ValueError as e:
+        raise ErroRequisicao(400, f"JSON inválido: {e}")
+    if not isinstance(dados, dict):
+        raise ErroRequisicao(400, "o corpo deve ser um objeto JSON (dados_laudo)")
+    if isinstance(dados.get('imagem'), str):
+        dados['imagem'] = _decodificar_base64(dados['imagem'], 'imagem')
+    imagens = []
+    for i, imagem in enumerate(dados.get('imagens') or []):
+        if isinstance(imagem, dict):
+            imagens.append(dict(imagem, arquivo=_decodificar_base64(str(imagem.get('arquivo') or ''), f'imagens[{i}]')))
+        else:
+            imagens.append(_decodificar_base64(str(imagem), f'imagens[{i}]'))
+    dados['imagens'] = imagens
+    return dados
+
+def dados_de_multipart(corpo, tipo_conteudo):
+    """dados_laudo de um multipart/form-data: campo 'dados' (JSON) e arquivos de imagem."""
+    mensagem = BytesParser(policy=policy.HTTP).parsebytes(
+        b'Content-Type: ' + tipo_conteudo.encode('latin-1') + b'\r\n\r\n' + corpo)
+    if not mensagem.is_multipart():
+        raise ErroRequisicao(400, "multipart/form-data sem partes")
+    campos, imagens = {}, []
+    for parte in mensagem.iter_parts():
+        nome = parte.get_param('name', header='content-disposition')
+        conteudo = parte.get_payload(decode=True) or b''
+        if nome == 'imagens':
+            imagens.append(conteudo)
+        elif nome:
+            campos[nome] = conteudo
+    if 'dados' not in campos:
+        raise ErroRequisicao(400, "multipart sem o campo 'dados' (JSON de dados_laudo)")
+    try:
+        dados = json.loads(campos['dados'])
+    except ValueError as e:
+        raise ErroRequisicao(400, f"JSON inválido no campo 'dados': {e}")
+    if not isinstance(dados, dict):
+        raise ErroRequisicao(400, "o campo 'dados' deve ser um objeto JSON")
+    if 'imagem' in campos:
+        dados['imagem'] = campos['imagem']
+    referenciadas = []
+    for imagem in dados.get('imagens') or []: # {"arquivo": "<campo>"} aponta para um arquivo enviado
+        campo = imagem.get('arquivo') if isinstance(imagem, dict) else imagem
+        if campo not in campos:
+            raise ErroRequisicao(400, f"imagem '{campo}' citada em dados['imagens'] não foi enviada")
+        referenciadas.append(dict(imagem, arquivo=campos[campo]) if isinstance(imagem, dict) else campos[campo])
+    dados['imagens'] = referenciadas + imagens
+    return dados
+
+def validar_dados(dados):
+    """Verificações baratas feitas no laço, antes de ocupar um processo."""
+    if not str(dados.get('rg_pericia') or '').strip():
+        raise ErroRequisicao(400, "dados_laudo sem 'rg_pericia'")
+    itens = dados.get('itens', [])
+    if not isinstance(itens, list) or not all(isinstance(item, dict) for item in itens):
+        raise ErroRequisicao(400, "'itens' deve ser uma lista de objetos")
+
+# --- Servidor ---
+
+class ServidorLaudos:
+    """Servidor HTTP/1.1 (keep-alive, Content-Length) sobre asyncio.start_server."""
+
+    def __init__(self, processos=None, max_fila=None, timeout=TIMEOUT_PADRAO):
+        self.processos = processos or os.cpu_count() or 1
+        self.max_fila = max_fila or self.processos * 4
+        self.timeout = timeout
+        self.pendentes = 0 # Laudos submetidos ao pool e ainda não concluídos
+        self.atendidos = 0
+        self.inicio = time.time()
+        self._executor = None
+        self._servidor = None
+        self._loop = None
+
+    async def iniciar(self, host='127.0.0.1', porta=PORTA_PADRAO):
+        from laudo_docx import BACKENDS_LAUDO
+        self._backends = BACKENDS_LAUDO
+        self._loop = asyncio.get_running_loop()
+        self._executor = ProcessPoolExecutor(max_workers=self.processos, initializer=_aquecer_trabalhador)
+        self._servidor = await asyncio.start_server(self._atender, host, porta)
+        return self._servidor
+
+    async def servir(self):
+        async with self._servidor:
+            await self._servidor.serve_forever()
+
+    def encerrar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Conexão ---
+
+    async def _atender(self, leitor, escritor):
+        try:
+            while True:
+                try:
+                    linha = await asyncio.wait_for(leitor.readline(), TIMEOUT_OCIOSO)
+                except asyncio.TimeoutError:
+                    break
+                if not linha:
+                    break
+                try:
+                    metodo, alvo, versao = linha.decode('latin-1').split()
+                except ValueError:
+                    await self._responder(escritor, 400, {'erro': 'linha de requisição inválida'}, manter=False)
+                    break
+                cabecalhos = {}
+                while True:
+                    linha = await leitor.readline()
+                    if linha in (b'\r\n', b'\n', b''):
+                        break
+                    nome, _, valor = linha.decode('latin-1').partition(':')
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+                manter = versao == 'HTTP/1.1' and cabecalhos.get('connection', '').lower() != 'close'
+                if 'chunked' in cabecalhos.get('transfer-encoding', '').lower():
+                    await self._responder(escritor, 411, {'erro': 'envie o corpo com Content-Length'}, manter=False)
+                    break
+                valor_tamanho = cabecalhos.get('content-length') or '0'
+                if not (valor_tamanho.isascii() and valor_tamanho.isdigit()): # int() aceitaria '-1', '+1', '1_0'
+                    await self._responder(escritor, 400, {'erro': 'Content-Length inválido'}, manter=False)
+                    break
+                tamanho = int(valor_tamanho)
+                if tamanho > MAX_CORPO:
+                    await self._responder(escritor, 413, {'erro': f'corpo acima de {MAX_CORPO // (1024 * 1024)} MB'}, manter=False)
+                    break
+                if tamanho and cabecalhos.get('expect', '').lower() == '100-continue':
+                    escritor.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                corpo = await leitor.readexactly(tamanho) if tamanho else b''
+                status, corpo_resposta, extras = await self._rotear(metodo, alvo, cabecalhos, corpo)
+                await self._responder(escritor, status, corpo_resposta, extras, manter)
+                if not manter:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass # Cliente desconectou ou enviou cabeçalhos inválidos
+        finally:
+            escritor.close()
+
+    async def _responder(self, escritor, status, corpo, extras=None, manter=True):
+        cabecalhos = {'Content-Type': 'application/json; charset=utf-8'}
+        if not isinstance(corpo, (bytes, bytearray)):
+            corpo = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        cabecalhos.update(extras or {})
+        cabecalhos['Content-Length'] = str(len(corpo))
+        cabecalhos['Connection'] = 'keep-alive' if manter else 'close'
+        cabeca = f"HTTP/1.1 {status} {MOTIVOS.get(status, '')}\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in cabecalhos.items())
+        escritor.write(cabeca.encode('latin-1') + b'\r\n' + corpo)
+        await escritor.drain()
+
+    # --- Rotas ---
+
+    async def _rotear(self, metodo, alvo, cabecalhos, corpo):
+        url = urlsplit(alvo)
+        inicio = time.perf_counter()
+        try:
+            if url.path == '/laudos':
+                if metodo != 'POST':
+                    raise ErroRequisicao(405, "use POST")
+                resposta = await self._gerar(parse_qs(url.query), cabecalhos, corpo)
+            elif url.path == '/saude':
+                resposta = 200, self.saude(), None
+            elif url.path == '/metricas':
+                resposta = 200, laudo_metricas.exportar_prometheus().encode('utf-8'), {'Content-Type': 'text/plain; version=0.0.4'}
+            else:
+                raise ErroRequisicao(404, f"rota desconhecida: {url.path}")
+        except ErroRequisicao as e:
+            resposta = e.status, {'erro': str(e)}, {'Retry-After': '1'} if e.status in (429, 503) else None
+        except Exception as e:
+            print(f"Erro detalhado na API ({metodo} {url.path}): {type(e).__name__}: {e}", file=sys.stderr)
+            resposta = 500, {'erro': f"{type(e).__name__}: {e}"}, None
+        incrementar('laudo_api_requisicoes_total', rota=url.path if url.path in ('/laudos', '/saude', '/metricas') else 'outra',
+                    status=resposta[0])
+        if url.path == '/laudos':
+            observar(HISTOGRAMA_ETAPAS, time.perf_counter() - inicio, etapa='api_laudo')
+        return resposta
+
+    def saude(self):
+        return {'status': 'ok' if self._executor is not None else 'parado', 'processos': self.processos,
+                'pendentes': self.pendentes, 'max_fila': self.max_fila, 'atendidos': self.atendidos,
+                'segundos_no_ar': round(time.time() - self.inicio, 1)}
+
+    async def _gerar(self, parametros, cabecalhos, corpo):
+        # Contrapressão: recusa antes de decodificar imagens ou ocupar um processo
+        if self.pendentes >= self.max_fila:
+            raise ErroRequisicao(429, f"fila cheia ({self.pendentes} laudos pendentes)")
+        backend = (parametros.get('backend') or [None])[0]
+        if backend is not None and backend not in self._backends:
+            raise ErroRequisicao(400, f"backend desconhecido: '{backend}' (use {', '.join(self._backends)})")
+        tipo = cabecalhos.get('content-type', '')
+        # Decodificação (base64/multipart, até MAX_CORPO) numa thread, fora do laço de eventos
+        if tipo.startswith('application/json'):
+            dados = await asyncio.to_thread(dados_de_json, corpo)
+        elif tipo.startswith('multipart/form-data'):
+            dados = await asyncio.to_thread(dados_de_multipart, corpo, tipo)
+        else:
+            raise ErroRequisicao(415, "use application/json ou multipart/form-data")
+        validar_dados(dados)
+
+        self.pendentes += 1
+        futuro = self._executor.submit(gerar_laudo_api, dados, backend)
+        # A vaga só é liberada quando o processo termina (mesmo após o 504, o laudo continua ocupando-o);
+        # as métricas do trabalhador também são mescladas nesse momento, com ou sem 504
+        futuro.add_done_callback(self._ao_concluir)
+        try:
+            entrada, _ = await asyncio.wait_for(asyncio.wrap_future(futuro), self.timeout)
+        except asyncio.TimeoutError:
+            registrar_evento('timeout_api', rg_pericia=dados.get('rg_pericia'), segundos=self.timeout)
+            raise ErroRequisicao(504, f"laudo não ficou pronto em {self.timeout:g}s")
+        self.atendidos += 1
+        nome = f"{str(dados['rg_pericia']).strip().replace('/', '_').replace(chr(92), '_')}.docx"
+        return 200, entrada.conteudo, {
+            'Content-Type': MIME_DOCX,
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nome)}",
+            'X-Laudo-Segundos': f"{entrada.segundos:.4f}",
+            'X-Laudo-Avisos': quote(json.dumps(list(entrada.avisos), ensure_ascii=False)),
+        }
+
+    def _ao_concluir(self, futuro):
+        """Roda na thread do executor: devolve a vaga ao laço."""
+        try:
+            self._loop.call_soon_threadsafe(self._liberar, futuro)
+        except RuntimeError: # Laço já encerrado
+            pass
+
+    def _liberar(self, futuro):
+        """Devolve a vaga e mescla as métricas das etapas do trabalhador (também após um 504)."""
+        self.pendentes -= 1
+        if not futuro.cancelled() and futuro.exception() is None:
+            laudo_metricas.mesclar(futuro.result()[1])
+
+async def _executar(args):
+    servidor = ServidorLaudos(args.processos, args.fila, args.timeout)
+    try:
+        await servidor.iniciar(args.host, args.porta)
+    except OSError as e:
+        servidor.encerrar()
+        print(f"Não foi possível escutar em {args.host}:{args.porta}: {e.strerror or e}", file=sys.stderr)
+        return 1
+    try: # SIGTERM encerra como o Ctrl+C (o pool de processos é desligado)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError: # Windows
+        pass
+    print(f"API de laudos em http://{args.host}:{args.porta} ({servidor.processos} processo(s), fila {servidor.max_fila}, "
+          f"timeout {servidor.timeout:g}s)", file=sys.stderr, flush=True)
+    try:
+        await servidor.servir()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        servidor.encerrar()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP de geração de laudos .docx.")
+    parser.add_argument('--host', default='127.0.0.1', help="Endereço de escuta (padrão: 127.0.0.1)")
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO, help=f"Porta (padrão: {PORTA_PADRAO})")
+    parser.add_argument('-j', '--processos', type=int, default=None, help="Processos geradores (padrão: núcleos da CPU)")
+    parser.add_argument('--fila', type=int, default=None, help="Laudos pendentes antes de responder 429 (padrão: 4 por processo)")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT_PADRAO, help="Tempo limite por laudo, em segundos")
+    parser.add_argument('--log-json', action='store_true', help="Emite eventos JSON na saída de erro")
+    args = parser.parse_args(argv)
+    if args.log_json:
+        laudo_metricas.configurar_log_json()
+    try:
+        return asyncio.run(_executar(args))
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,714 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark reprodutível de gerar_laudo_docx.
+
+Gera entradas sintéticas de dados_laudo (1 a 10.000 itens, cannabis/cocaína/
+misto, com e sem imagem) e mede, para cada caso e backend:
+    - tempo de cada etapa (novo documento, seções, imagens, save) e total;
+    - pico de memória (tracemalloc, numa execução separada; só conta alocações
+      do Python, não a memória interna do libxml2 usada pelo lxml/python-docx);
+    - número de parágrafos e runs em word/document.xml e bytes do .docx.
+Toda parte XML do .docx gerado é lida por um parser XML (verificar_xml); o
+lacre sintético traz um caractere de controle, que os backends removem.
+Os tempos por etapa vêm de laudo_metricas.medicao(); 'sobrecarga' mede o custo
+da própria instrumentação (métricas ligadas x desligadas).
+
+Os resultados são gravados em JSON e podem ser comparados entre versões;
+'comparar' aponta as regressões acima de um limite.
+
+Uso:
+    python laudo_benchmark.py executar -o base.json
+    python laudo_benchmark.py executar -o novo.json --tamanhos 1,10,100 --backends ooxml
+    python laudo_benchmark.py comparar base.json novo.json --limite 0.10
+    python laudo_benchmark.py sobrecarga --itens 100 --backend ooxml
+    python laudo_benchmark.py interface --tamanhos 1,20,80,160
+    python laudo_benchmark.py api --processos 1,2,4 --clientes 8 --requisicoes 64
+    python laudo_benchmark.py casos --casos 50000
+    python laudo_benchmark.py apreensao --tamanhos 250,2000,10000 --backend ooxml
+    python laudo_benchmark.py uploads --sessoes 20 --fotos 5
+    python laudo_benchmark.py fila --processos 1,2,4 --usuarios 8 --pedidos 8
+    python laudo_benchmark.py aquecimento --backends docx,ooxml --itens 20
+    python laudo_benchmark.py memoria --backends docx,ooxml,fluxo --tamanhos 1000,10000,50000
+"""
+
+import argparse
+import collections
+import functools
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+import xml.etree.ElementTree as ET
+
+import laudo_docx
+import laudo_metricas
+
+TAMANHOS_PADRAO = (1, 10, 100, 1000, 10000)
+MISTURAS = ('cannabis', 'cocaina', 'misto')
+CODIGOS_MISTURA = {'cannabis': ['v', 'r'], 'cocaina': ['po', 'pd'], 'misto': ['v', 'r', 'po', 'pd']}
+
+_PADRAO_PARAGRAFO = re.compile(rb'<w:p[ >/]')
+_PADRAO_RUN = re.compile(rb'<w:r[ >]')
+
+# --- Entradas Sintéticas ---
+
+@functools.lru_cache(maxsize=None)
+def imagem_sintetica(largura=3000, altura=2000):
+    """JPEG determinístico (gradiente + ruído) do tamanho de uma foto de celular."""
+    from PIL import Image
+    rng = random.Random(42)
+    pequena = Image.new('RGB', (largura // 16, altura // 16))
+    pequena.putdata([(x * 255 // (largura // 16), rng.randrange(256), y * 255 // (altura // 16))
+                     for y in range(altura // 16) for x in range(largura // 16)])
+    saida = io.BytesIO()
+    pequena.resize((largura, altura)).save(saida, 'JPEG', quality=92)
+    return saida.getvalue()
+
+def gerar_dados_sinteticos(n_itens, mistura='misto', com_imagem=False, semente=0):
+    """dados_laudo sintético e determinístico com n_itens itens."""
+    rng = random.Random(semente)
+    codigos = CODIGOS_MISTURA[mistura]
+    embalagens = list(laudo_docx.TIPOS_EMBALAGEM_BASE)
+    cores = list(laudo_docx.CORES_FEMININO_EMBALAGEM)
+    itens = [{
+        'qtd': rng.randint(1, 50),
+        'tipo_mat': codigos[i % len(codigos)],
+        'emb': rng.choice(embalagens),
+        'cor_emb': rng.choice(cores),
+        'ref': str(i + 1),
+        'pessoa': f"Pessoa {rng.randint(1, 20)}",
+    } for i in range(n_itens)]
+    # \x0b (proibido no XML) sai do texto em todos os backends; verificar_xml confere o pacote
+    dados = {'rg_pericia': f"BENCH_{n_itens}_{mistura}", 'lacre': '000\x0b0000', 'itens': itens}
+    if com_imagem:
+        dados['imagens'] = [io.BytesIO(imagem_sintetica())]
+    return dados
+
+# --- Medição ---
+
+def _limpar_caches():
+    """Descarta caches de imagem e de fragmentos entre repetições (mede o custo real)."""
+    import laudo_imagem
+    import laudo_ooxml
+    laudo_imagem.limpar_cache_imagens()
+    laudo_ooxml.paragrafo_xml.cache_clear()
+
+def verificar_xml(conteudo):
+    """Levanta ValueError se alguma parte XML do .docx não for XML bem formado (o Word não abriria)."""
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as z:
+        for nome in z.namelist():
+            if nome.endswith(('.xml', '.rels')):
+                try:
+                    ET.fromstring(z.read(nome))
+                except ET.ParseError as e:
+                    raise ValueError(f"{nome} inválido no .docx gerado: {e}") from e
+
+def _gerar_e_salvar(dados, backend):
+    document = laudo_docx.gerar_laudo_docx(dados, backend=backend)
+    saida = io.BytesIO()
+    document.save(saida)
+    laudo_docx.fechar_documento(document)
+    return saida.getvalue()
+
+def medir_caso(n_itens, mistura, com_imagem, backend, repeticoes=3):
+    """Mede um caso: tempos por etapa (mediana das repetições), pico de memória e contagens do XML."""
+    dados = gerar_dados_sinteticos(n_itens, mistura, com_imagem)
+    _gerar_e_salvar(dados, backend) # Aquecimento: modelo base, imports e pacote OOXML
+
+    amostras = []
+    for _ in range(repeticoes):
+        _limpar_caches()
+        saida = io.BytesIO()
+        with laudo_metricas.medicao() as tempos:
+            document = laudo_docx.gerar_laudo_docx(dados, backend=backend)
+            with laudo_metricas.cronometro('save'):
+                document.save(saida)
+        laudo_docx.fechar_documento(document)
+        tempos['total'] = tempos['gerar_laudo_docx'] + tempos['save']
+        amostras.append(tempos)
+    conteudo = saida.getvalue()
+    verificar_xml(conteudo)
+
+    # Memória numa execução à parte: o tracemalloc deixa a geração mais lenta
+    _limpar_caches()
+    tracemalloc.start()
+    try:
+        _gerar_e_salvar(dados, backend)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    document_xml = zipfile.ZipFile(io.BytesIO(conteudo)).read('word/document.xml')
+    etapas = sorted({etapa for amostra in amostras for etapa in amostra})
+    return {
+        'nome': f"{backend}/{mistura}/{n_itens}/{'com_imagem' if com_imagem else 'sem_imagem'}",
+        'backend': backend, 'itens': n_itens, 'mistura': mistura, 'imagem': com_imagem,
+        'repeticoes': repeticoes,
+        'tempos_ms': {etapa: round(statistics.median(a.get(etapa, 0.0) for a in amostras) * 1000, 3) for etapa in etapas},
+        'total_ms_min': round(min(a['total'] for a in amostras) * 1000, 3),
+        'pico_memoria_mb': round(pico / 1e6, 3),
+        'paragrafos_xml': len(_PADRAO_PARAGRAFO.findall(document_xml)),
+        'runs_xml': len(_PADRAO_RUN.findall(document_xml)),
+        'bytes_saida': len(conteudo),
+    }
+
+def medir_sobrecarga(n_itens=100, backend='ooxml', repeticoes=200):
+    """Tempo de geração com métricas ligadas x desligadas (medianas intercaladas, em ms)."""
+    dados = gerar_dados_sinteticos(n_itens)
+    _gerar_e_salvar(dados, backend)
+    amostras = {True: [], False: []}
+    ativo_original = laudo_metricas.ATIVO
+    try:
+        for i in range(repeticoes * 2):
+            laudo_metricas.ATIVO = ativo = bool(i % 2)
+            inicio = time.perf_counter()
+            _gerar_e_salvar(dados, backend)
+            amostras[ativo].append(time.perf_counter() - inicio)
+    finally:
+        laudo_metricas.ATIVO = ativo_original
+    ligadas, desligadas = (statistics.median(amostras[a]) * 1000 for a in (True, False))
+    return {'itens': n_itens, 'backend': backend, 'repeticoes': repeticoes, 'ms_metricas_ligadas': round(ligadas, 4),
+            'ms_metricas_desligadas': round(desligadas, 4), 'sobrecarga_pct': round((ligadas / desligadas - 1) * 100, 2)}
+
+def executar(tamanhos, misturas, imagens, backends, repeticoes, saida_progresso=sys.stderr):
+    """Executa a matriz de casos e retorna o relatório (dict pronto para JSON)."""
+    casos = []
+    for backend in backends:
+        for n_itens in tamanhos:
+            for mistura in misturas:
+                for com_imagem in imagens:
+                    caso = medir_caso(n_itens, mistura, com_imagem, backend, repeticoes)
+                    casos.append(caso)
+                    print(f"{caso['nome']:40s} {caso['tempos_ms']['total']:10.1f} ms  "
+                          f"{caso['pico_memoria_mb']:8.1f} MB  {caso['runs_xml']:7d} runs  {caso['bytes_saida']:9d} B",
+                          file=saida_progresso)
+    return {
+        'meta': {'data': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                 'plataforma': platform.platform(), 'processador': platform.processor() or platform.machine()},
+        'sobrecarga_metricas': medir_sobrecarga(),
+        'casos': casos,
+    }
+
+def medir_rerun_interface(tamanhos=(1, 10, 20, 40, 80, 160), modos=('Formulário', 'Tabela'), repeticoes=5, script='laudo.py'):
+    """Tempo de um rerun completo da interface (streamlit.testing.AppTest) por número de itens e modo do editor."""
+    from streamlit.testing.v1 import AppTest
+    resultados = []
+    for modo in modos:
+        for n_itens in tamanhos:
+            app = AppTest.from_file(script, default_timeout=120)
+            app.session_state['dados_laudo'] = gerar_dados_sinteticos(n_itens)
+            app.session_state['modo_itens_input'] = modo
+            app.run() # Primeira execução: imports e criação dos widgets
+            tempos = []
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                app.run()
+                tempos.append(time.perf_counter() - inicio)
+            resultados.append({'modo': modo, 'itens': n_itens, 'rerun_ms': round(statistics.median(tempos) * 1000, 2)})
+            print(f"{modo:12s} {n_itens:5d} itens  {resultados[-1]['rerun_ms']:9.1f} ms", file=sys.stderr)
+    return resultados
+
+def _esperar_api(porta, limite=30.0):
+    """Espera a API responder em /saude."""
+    fim = time.monotonic() + limite
+    while True:
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=2)
+            conexao.request('GET', '/saude')
+            conexao.getresponse().read()
+            conexao.close()
+            return
+        except OSError:
+            if time.monotonic() > fim:
+                raise RuntimeError(f"a API não respondeu na porta {porta}")
+            time.sleep(0.1)
+
+def medir_api(lista_processos=(1, 2, 4), clientes=8, requisicoes=64, n_itens=20, backend='ooxml', porta=8599):
+    """Vazão e latência da laudo_api.py sob carga, para cada número de processos geradores.
+
+    Para cada valor sobe a API num subprocesso, aquece um laudo por processo e
+    dispara 'requisicoes' POST /laudos a partir de 'clientes' threads (cada uma
+    com sua conexão keep-alive). 429 contam como recusados, não como latência.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'laudo_api.py')
+    dados = gerar_dados_sinteticos(n_itens)
+    dados['rg_pericia'] = '2025_00001'
+    corpo = json.dumps(dados).encode('utf-8')
+    caminho = f'/laudos?backend={backend}'
+    resultados = []
+    for processos in lista_processos:
+        servidor = subprocess.Popen([sys.executable, script, '--porta', str(porta), '-j', str(processos),
+                                     '--fila', str(max(clientes, processos) * 2)], stderr=subprocess.DEVNULL)
+        try:
+            _esperar_api(porta)
+            latencias, status, lock = [], collections.Counter(), threading.Lock()
+            fila = itertools.count()
+
+            def cliente(total):
+                conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=120)
+                while next(fila) < total:
+                    inicio = time.perf_counter()
+                    conexao.request('POST', caminho, corpo, {'Content-Type': 'application/json'})
+                    resposta = conexao.getresponse()
+                    resposta.read()
+                    with lock:
+                        status[resposta.status] += 1
+                        if resposta.status == 200:
+                            latencias.append(time.perf_counter() - inicio)
+                conexao.close()
+
+            def rodada(total):
+                threads = [threading.Thread(target=cliente, args=(total,)) for _ in range(clientes)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            rodada(processos) # Aquecimento: um laudo por processo
+            fila = itertools.count()
+            latencias.clear()
+            status.clear()
+            inicio = time.perf_counter()
+            rodada(requisicoes)
+            segundos = time.perf_counter() - inicio
+        finally:
+            servidor.terminate()
+            servidor.wait()
+        quantis = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else [0.0] * 99
+        resultados.append({'processos': processos, 'clientes': clientes, 'requisicoes': requisicoes, 'itens': n_itens,
+                           'backend': backend, 'segundos': round(segundos, 3),
+                           'laudos_por_segundo': round(status[200] / segundos, 2),
+                           'p50_ms': round(quantis[49] * 1000, 1), 'p95_ms': round(quantis[94] * 1000, 1),
+                           'status': {str(codigo): n for codigo, n in sorted(status.items())}})
+        print(f"{processos:3d} processo(s)  {resultados[-1]['laudos_por_segundo']:8.2f} laudos/s  "
+              f"p50 {resultados[-1]['p50_ms']:8.1f} ms  p95 {resultados[-1]['p95_ms']:8.1f} ms  {resultados[-1]['status']}",
+              file=sys.stderr)
+    return {'cpus': os.cpu_count(), 'resultados': resultados}
+
+NOMES_SINTETICOS = ('João Silva', 'Maria Souza', 'José Pereira', 'Ana Lima', 'Fulano de Tal', 'Carlos Andrade', 'Beatriz Rocha')
+
+def _mediana_ms(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return round(statistics.median(tempos) * 1000, 3)
+
+def dados_apreensao(n_itens, grupos=2):
+    """Grande apreensão: n_itens linhas repartidas em poucos grupos de itens idênticos."""
+    modelos = [{'tipo_mat': 'po', 'emb': 'e', 'cor_emb': 'az', 'pessoa': 'Fulano'},
+               {'tipo_mat': 'v', 'emb': 'pl', 'cor_emb': 't', 'pessoa': 'Beltrano'},
+               {'tipo_mat': 'pd', 'emb': 'a', 'cor_emb': None, 'pessoa': ''}][:grupos]
+    itens = [dict(modelos[i * len(modelos) // n_itens], qtd=1, ref=str(i + 1)) for i in range(n_itens)]
+    return {'rg_pericia': f"BENCH_APREENSAO_{n_itens}", 'lacre': '0000000', 'itens': itens}
+
+def medir_apreensao(tamanhos=(250, 2000, 10000), backend='ooxml', repeticoes=3):
+    """Laudo de grande apreensão com e sem agrupar_itens: tempo, bytes e parágrafos de document.xml."""
+    resultados = []
+    for n_itens in tamanhos:
+        for agrupar in (False, True):
+            dados = dict(dados_apreensao(n_itens), agrupar_itens=agrupar)
+            conteudo = _gerar_e_salvar(dados, backend)
+            verificar_xml(conteudo)
+            document_xml = zipfile.ZipFile(io.BytesIO(conteudo)).read('word/document.xml')
+            resultados.append({
+                'itens': n_itens, 'agrupar_itens': agrupar, 'backend': backend,
+                'total_ms': _mediana_ms(lambda: _gerar_e_salvar(dados, backend), repeticoes),
+                'bytes_saida': len(conteudo), 'bytes_document_xml': len(document_xml),
+                'paragrafos_xml': len(_PADRAO_PARAGRAFO.findall(document_xml)),
+            })
+    return resultados
+
+def medir_uploads(n_sessoes=20, fotos=5, backend='ooxml', repeticoes=3):
+    """Memória das sessões com fotos na memória (UploadedFile) x gravadas em disco (laudo_uploads), e tempo do laudo."""
+    from laudo_uploads import SpoolSessao
+    originais = [imagem_sintetica()[:-4] + i.to_bytes(4, 'big') for i in range(n_sessoes * fotos)] # Conteúdos distintos
+    resultado = {'sessoes': n_sessoes, 'fotos_por_sessao': fotos, 'bytes_foto': len(originais[0])}
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessoes = [[io.BytesIO(bytes(bytearray(originais[s * fotos + f]))) for f in range(fotos)] for s in range(n_sessoes)] # Cópia, como no upload
+    resultado['memoria_em_memoria_mb'] = round((tracemalloc.get_traced_memory()[0] - base) / 1e6, 2)
+    del sessoes
+    with tempfile.TemporaryDirectory() as pasta:
+        base = tracemalloc.get_traced_memory()[0]
+        spools = [SpoolSessao(pasta) for _ in range(n_sessoes)]
+        arquivos = [[spool.guardar(originais[s * fotos + f], nome=f"{f}.jpg") for f in range(fotos)] for s, spool in enumerate(spools)]
+        resultado['memoria_em_disco_mb'] = round((tracemalloc.get_traced_memory()[0] - base) / 1e6, 2)
+        tracemalloc.stop()
+        resultado['memoria_sessao_max_bytes'] = max(spool.bytes_memoria for spool in spools)
+
+        dados_memoria = dict(gerar_dados_sinteticos(5), imagens=[io.BytesIO(originais[f]) for f in range(fotos)])
+        dados_disco = dict(gerar_dados_sinteticos(5), imagens=arquivos[0])
+        for nome, dados in (('memoria', dados_memoria), ('disco', dados_disco)):
+            def gerar():
+                _limpar_caches()
+                _gerar_e_salvar(dados, backend)
+            resultado[f'laudo_ms_{nome}'] = _mediana_ms(gerar, repeticoes)
+        for spool in spools:
+            spool.encerrar()
+    return resultado
+
+def medir_fila(lista_processos=(1, 2, 4), usuarios=8, pedidos=8, duplicados=0.25, n_itens=100, backend='ooxml', semente=0):
+    """Sessões simultâneas gerando laudos: na thread da sessão (como antes) x pela fila (laudo_fila) com N processos.
+
+    Cada usuário faz 'pedidos' laudos em sequência; a fração 'duplicados' deles
+    é um caso comum a todos (o mesmo conteúdo pedido por várias sessões).
+    """
+    from laudo_fila import FilaGeracao, FilaGeracaoCheia
+    aleatorio = random.Random(semente)
+    comuns = [gerar_dados_sinteticos(n_itens, semente=10_000 + i) for i in range(max(1, pedidos // 4))]
+    roteiros = [[aleatorio.choice(comuns) if aleatorio.random() < duplicados else gerar_dados_sinteticos(n_itens, semente=u * 1000 + p)
+                 for p in range(pedidos)] for u in range(usuarios)]
+
+    def rodada(gerar):
+        latencias = [[] for _ in range(usuarios)]
+        def sessao(u):
+            for dados in roteiros[u]:
+                inicio = time.perf_counter()
+                gerar(dados, u)
+                latencias[u].append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        threads = [threading.Thread(target=sessao, args=(u,)) for u in range(usuarios)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+        todas = sorted(itertools.chain.from_iterable(latencias))
+        medias = [statistics.fmean(lat) for lat in latencias]
+        return {
+            'laudos_por_s': round(len(todas) / duracao, 1),
+            'latencia_p50_ms': round(todas[len(todas) // 2] * 1000, 1),
+            'latencia_p95_ms': round(todas[int(len(todas) * 0.95)] * 1000, 1),
+            # Justiça: razão entre a latência média do usuário mais lento e a do mais rápido
+            'media_usuario_max_min': round(max(medias) / min(medias), 2),
+        }
+
+    def contador(metricas, nome, **rotulos):
+        return sum(valor for n, r, valor in metricas['contadores'] if n == nome and rotulos.items() <= r.items())
+
+    resultado = {'cpus': os.cpu_count(), 'usuarios': usuarios, 'pedidos_por_usuario': pedidos, 'itens': n_itens, 'rodadas': []}
+    laudo_metricas.extrair()
+    rodada_sessao = rodada(lambda dados, u: _gerar_e_salvar(dados, backend))
+    resultado['rodadas'].append(dict(rodada_sessao, modo='sessao', laudos_gerados=contador(laudo_metricas.extrair(), 'laudo_laudos_total')))
+    for processos in lista_processos:
+        with FilaGeracao(processos=processos, max_pendentes=usuarios * pedidos) as fila:
+            # Sobe e aquece todos os processos do pool fora da medição
+            for tarefa in [fila.submeter(gerar_dados_sinteticos(1, semente=-p), backend=backend, usuario=-p) for p in range(processos)]:
+                tarefa.resultado()
+            laudo_metricas.extrair()
+            def gerar(dados, u):
+                while True:
+                    try:
+                        return fila.submeter(dados, backend=backend, usuario=u).resultado()
+                    except FilaGeracaoCheia:
+                        time.sleep(0.01)
+            medicao = rodada(gerar)
+            metricas = laudo_metricas.extrair()
+            resultado['rodadas'].append(dict(medicao, modo='fila', processos=processos,
+                                             laudos_gerados=contador(metricas, 'laudo_fila_total', resultado='ok'),
+                                             deduplicados=contador(metricas, 'laudo_fila_total', resultado='deduplicado')))
+    return resultado
+
+# Executado num processo novo: tempos do primeiro laudo e dos seguintes, com ou sem aquecer() antes
+_CODIGO_AQUECIMENTO = '''
+import json, sys, time
+inicio = time.perf_counter()
+import laudo_cache, laudo_recursos, laudo_benchmark
+importacao = time.perf_counter() - inicio
+backend, n_itens, aquecer = sys.argv[1], int(sys.argv[2]), sys.argv[3] == '1'
+casos = [laudo_benchmark.gerar_dados_sinteticos(n_itens, semente=semente) for semente in range(6)]
+inicio = time.perf_counter()
+if aquecer:
+    laudo_recursos.aquecer(backends=[backend])
+aquecimento = time.perf_counter() - inicio
+tempos = []
+for dados in casos:
+    inicio = time.perf_counter()
+    laudo_cache.gerar_entrada(dados, backend)
+    tempos.append(time.perf_counter() - inicio)
+print(json.dumps({'importacao': importacao, 'aquecimento': aquecimento, 'tempos': tempos}))
+'''
+
+def medir_aquecimento(backends=('docx', 'ooxml'), n_itens=20, repeticoes=5):
+    """Latência do primeiro laudo de um processo novo, frio x após laudo_recursos.aquecer(), e a de regime.
+
+    Cada medição roda num subprocesso novo (mediana de 'repeticoes' processos).
+    """
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    resultados = []
+    for backend in backends:
+        for aquecer in (False, True):
+            amostras = []
+            for _ in range(repeticoes):
+                saida = subprocess.run([sys.executable, '-c', _CODIGO_AQUECIMENTO, backend, str(n_itens), '1' if aquecer else '0'],
+                                       cwd=pasta, capture_output=True, text=True, check=True)
+                amostras.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+            def mediana_ms(valores):
+                return round(statistics.median(valores) * 1000, 1)
+            resultados.append({
+                'backend': backend, 'itens': n_itens, 'modo': 'aquecido' if aquecer else 'frio',
+                'importacao_ms': mediana_ms([a['importacao'] for a in amostras]),
+                'aquecimento_ms': mediana_ms([a['aquecimento'] for a in amostras]),
+                'primeiro_laudo_ms': mediana_ms([a['tempos'][0] for a in amostras]),
+                'regime_ms': mediana_ms([t for a in amostras for t in a['tempos'][1:]]),
+            })
+            print(f"{backend:6s} {resultados[-1]['modo']:9s} primeiro {resultados[-1]['primeiro_laudo_ms']:7.1f} ms  "
+                  f"regime {resultados[-1]['regime_ms']:7.1f} ms  aquecimento {resultados[-1]['aquecimento_ms']:7.1f} ms",
+                  file=sys.stderr)
+    return {'repeticoes': repeticoes, 'resultados': resultados}
+
+_CODIGO_MEMORIA = '''
+import gc, json, os, resource, sys, tempfile, time
+import laudo_benchmark, laudo_docx
+backend, n_itens, agrupar = sys.argv[1], int(sys.argv[2]), sys.argv[3] == '1'
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+dados = laudo_benchmark.gerar_dados_sinteticos(n_itens, semente=n_itens)
+dados['agrupar_itens'] = agrupar
+with tempfile.TemporaryDirectory() as pasta:
+    laudo_docx.gerar_laudo_docx(laudo_benchmark.gerar_dados_sinteticos(20), backend=backend).save(os.path.join(pasta, 'aquecimento.docx'))
+    gc.collect()
+    antes = rss()
+    inicio = time.perf_counter()
+    laudo_docx.gerar_laudo_docx(dados, backend=backend).save(os.path.join(pasta, 'laudo.docx'))
+    segundos = time.perf_counter() - inicio
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    tamanho = os.path.getsize(os.path.join(pasta, 'laudo.docx'))
+print(json.dumps({'antes': antes, 'pico': pico, 'segundos': segundos, 'bytes_saida': tamanho}))
+'''
+
+def medir_memoria(backends=('docx', 'ooxml', 'fluxo'), tamanhos=(1000, 10000, 50000), agrupar=False):
+    """Pico de memória residente (RSS) de um laudo enorme, por backend e número de itens.
+
+    Cada medição roda num subprocesso novo (Linux: /proc e getrusage). 'pico_mb'
+    é o pico do processo acima do RSS com os dados de entrada já montados e um
+    laudo pequeno de aquecimento: conta também a memória do libxml2, que o
+    tracemalloc de 'executar' não vê.
+    """
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    resultados = []
+    for backend in backends:
+        for n_itens in tamanhos:
+            saida = subprocess.run([sys.executable, '-c', _CODIGO_MEMORIA, backend, str(n_itens), '1' if agrupar else '0'],
+                                   cwd=pasta, capture_output=True, text=True, check=True)
+            medida = json.loads(saida.stdout.strip().splitlines()[-1])
+            resultados.append({
+                'backend': backend, 'itens': n_itens, 'agrupar_itens': agrupar,
+                'pico_mb': round(max(medida['pico'] - medida['antes'], 0) / 1e6, 1),
+                'segundos': round(medida['segundos'], 2),
+                'bytes_saida': medida['bytes_saida'],
+            })
+            print(f"{backend:6s} {n_itens:7d} itens  pico +{resultados[-1]['pico_mb']:7.1f} MB  "
+                  f"{resultados[-1]['segundos']:6.2f} s", file=sys.stderr)
+    return {'resultados': resultados}
+
+def medir_casos(n_casos=50000, repeticoes=50, semente=0):
+    """Armazenamento de casos (laudo_casos): carga em lote, buscas, abertura e salvamento automático."""
+    from laudo_casos import GravadorRascunhos, RepositorioCasos, novo_caso_id, serializar_rascunho
+    rnd = random.Random(semente)
+    with tempfile.TemporaryDirectory() as pasta:
+        repositorio = RepositorioCasos(os.path.join(pasta, 'casos.sqlite3'))
+        inicio, lote, ids = time.perf_counter(), {}, []
+        for i in range(n_casos):
+            dados = gerar_dados_sinteticos(rnd.randint(1, 10), semente=i)
+            dados['rg_pericia'] = f"2025_{i % 12:02d}_{i:06d}"
+            dados['lacre'] = f"{rnd.randint(0, 9999999):07d}"
+            for item in dados['itens']:
+                item['pessoa'] = f"{rnd.choice(NOMES_SINTETICOS)} {i}"
+            ids.append(novo_caso_id())
+            lote[ids[-1]] = (dados, serializar_rascunho(dados))
+            if len(lote) == 1000 or i == n_casos - 1:
+                repositorio.salvar_rascunhos(lote)
+                lote = {}
+        carga = time.perf_counter() - inicio
+        buscas = {
+            'rg_prefixo': lambda: repositorio.buscar(rg_pericia='2025_03_0012'),
+            'lacre': lambda: repositorio.buscar(lacre='00123'),
+            'pessoa_comum': lambda: repositorio.buscar(pessoa='souza'),
+            'pessoa_rara': lambda: repositorio.buscar(pessoa='joao 4123'),
+            'pessoa_comum_e_rg': lambda: repositorio.buscar(rg_pericia='2025_03', pessoa='souza'),
+            'recentes': lambda: repositorio.buscar(),
+            'abrir_caso': lambda: repositorio.carregar_caso(ids[n_casos // 2]),
+        }
+        resultado = {'casos': n_casos, 'carga_casos_por_segundo': round(n_casos / carga, 1),
+                     'ms': {nome: _mediana_ms(busca, repeticoes) for nome, busca in buscas.items()}}
+        # Digitação: 200 mudanças em ~2 s viram poucas transações
+        gravador = GravadorRascunhos(repositorio, atraso=0.2, atraso_maximo=1.0)
+        dados = gerar_dados_sinteticos(50)
+        resultado['ms']['agendar_autosave_50_itens'] = _mediana_ms(lambda: gravador.agendar('bench', dict(dados, lacre=str(rnd.random()))), repeticoes)
+        gravador.descarregar()
+        transacoes = gravador.transacoes
+        for k in range(200):
+            gravador.agendar('bench', dict(dados, lacre=str(k)))
+            time.sleep(0.01)
+        gravador.descarregar()
+        resultado['autosave'] = {'mudancas': 200, 'transacoes': gravador.transacoes - transacoes}
+    return resultado
+
+# --- Comparação ---
+
+# Métricas comparadas: (chave, unidade, piso absoluto abaixo do qual a variação é ignorada)
+METRICAS_COMPARADAS = (('total', 'ms', 1.0), ('pico_memoria_mb', 'MB', 0.1), ('bytes_saida', 'B', 512), ('runs_xml', 'runs', 0))
+
+def _valor(caso, metrica):
+    return caso['tempos_ms']['total'] if metrica == 'total' else caso[metrica]
+
+def comparar(base, novo, limite=0.10):
+    """Compara dois relatórios. Retorna [(caso, métrica, valor_base, valor_novo, variação)] das regressões."""
+    casos_base = {caso['nome']: caso for caso in base['casos']}
+    regressoes = []
+    for caso in novo['casos']:
+        anterior = casos_base.get(caso['nome'])
+        if anterior is None:
+            continue
+        for metrica, _, piso in METRICAS_COMPARADAS:
+            valor_base, valor_novo = _valor(anterior, metrica), _valor(caso, metrica)
+            if valor_novo - valor_base <= piso:
+                continue
+            variacao = (valor_novo - valor_base) / valor_base if valor_base else float('inf')
+            if variacao > limite:
+                regressoes.append((caso['nome'], metrica, valor_base, valor_novo, variacao))
+    return regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de gerar_laudo_docx.")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_exec = sub.add_parser('executar', help="Executa o benchmark e grava o relatório JSON")
+    p_exec.add_argument('-o', '--saida', default='benchmark.json', help="Arquivo JSON de saída")
+    p_exec.add_argument('--tamanhos', default=','.join(map(str, TAMANHOS_PADRAO)), help="Números de itens, separados por vírgula")
+    p_exec.add_argument('--misturas', default=','.join(MISTURAS), help="Misturas: cannabis, cocaina, misto")
+    p_exec.add_argument('--imagem', choices=['sem', 'com', 'ambos'], default='ambos', help="Casos com e/ou sem imagem")
+    p_exec.add_argument('--backends', default=','.join(laudo_docx.BACKENDS_LAUDO), help="Backends: docx, ooxml, fluxo")
+    p_exec.add_argument('-r', '--repeticoes', type=int, default=3, help="Repetições por caso (mediana)")
+
+    p_comp = sub.add_parser('comparar', help="Compara dois relatórios e aponta regressões")
+    p_comp.add_argument('base')
+    p_comp.add_argument('novo')
+    p_comp.add_argument('--limite', type=float, default=0.10, help="Variação máxima tolerada (0.10 = 10%%)")
+
+    p_sobre = sub.add_parser('sobrecarga', help="Mede o custo da instrumentação de laudo_metricas")
+    p_sobre.add_argument('--itens', type=int, default=100)
+    p_sobre.add_argument('--backend', default='ooxml', choices=laudo_docx.BACKENDS_LAUDO)
+    p_sobre.add_argument('-r', '--repeticoes', type=int, default=200)
+
+    p_ui = sub.add_parser('interface', help="Mede o tempo de rerun da interface Streamlit por número de itens")
+    p_ui.add_argument('--tamanhos', default='1,10,20,40,80,160', help="Números de itens, separados por vírgula")
+    p_ui.add_argument('-r', '--repeticoes', type=int, default=5)
+
+    p_api = sub.add_parser('api', help="Teste de carga da API HTTP (laudo_api.py) por número de processos")
+    p_api.add_argument('--processos', default='1,2,4', help="Números de processos geradores, separados por vírgula")
+    p_api.add_argument('--clientes', type=int, default=8, help="Clientes simultâneos")
+    p_api.add_argument('--requisicoes', type=int, default=64, help="Requisições por rodada")
+    p_api.add_argument('--itens', type=int, default=20)
+    p_api.add_argument('--backend', default='ooxml', choices=laudo_docx.BACKENDS_LAUDO)
+    p_api.add_argument('--porta', type=int, default=8599)
+
+    p_casos = sub.add_parser('casos', help="Mede carga, busca e autosave do armazenamento de casos (SQLite)")
+    p_casos.add_argument('--casos', type=int, default=50000)
+    p_casos.add_argument('-r', '--repeticoes', type=int, default=50)
+    p_apreensao = sub.add_parser('apreensao', help="Compara o laudo de uma grande apreensão com e sem agrupar_itens")
+    p_apreensao.add_argument('--tamanhos', default='250,2000,10000')
+    p_apreensao.add_argument('--backend', choices=laudo_docx.BACKENDS_LAUDO, default='ooxml')
+    p_apreensao.add_argument('-r', '--repeticoes', type=int, default=3)
+    p_uploads = sub.add_parser('uploads', help="Memória por sessão das fotos em memória x em disco (laudo_uploads)")
+    p_uploads.add_argument('--sessoes', type=int, default=20)
+    p_uploads.add_argument('--fotos', type=int, default=5)
+    p_uploads.add_argument('--backend', choices=laudo_docx.BACKENDS_LAUDO, default='ooxml')
+    p_uploads.add_argument('-r', '--repeticoes', type=int, default=3)
+    p_fila = sub.add_parser('fila', help="Sessões simultâneas: geração na sessão x fila de geração (laudo_fila)")
+    p_fila.add_argument('--processos', default='1,2,4', help="Números de processos da fila, separados por vírgula")
+    p_fila.add_argument('--usuarios', type=int, default=8)
+    p_fila.add_argument('--pedidos', type=int, default=8, help="Laudos por usuário")
+    p_fila.add_argument('--duplicados', type=float, default=0.25, help="Fração dos pedidos com conteúdo comum a todos")
+    p_fila.add_argument('--itens', type=int, default=100)
+    p_fila.add_argument('--backend', choices=laudo_docx.BACKENDS_LAUDO, default='ooxml')
+    p_aquecimento = sub.add_parser('aquecimento', help="Primeiro laudo de um processo novo: frio x aquecido (laudo_recursos)")
+    p_aquecimento.add_argument('--backends', default=','.join(laudo_docx.BACKENDS_LAUDO))
+    p_aquecimento.add_argument('--itens', type=int, default=20)
+    p_aquecimento.add_argument('-r', '--repeticoes', type=int, default=5, help="Processos por modo (mediana)")
+    p_memoria = sub.add_parser('memoria', help="Pico de memória (RSS) de laudos enormes por backend (ex.: docx x fluxo)")
+    p_memoria.add_argument('--backends', default=','.join(laudo_docx.BACKENDS_LAUDO))
+    p_memoria.add_argument('--tamanhos', default='1000,10000,50000', help="Números de itens, separados por vírgula")
+    p_memoria.add_argument('--agrupar', action='store_true', help="Agrupa itens idênticos (agrupar_itens)")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'memoria':
+        print(json.dumps(medir_memoria(args.backends.split(','), [int(t) for t in args.tamanhos.split(',')], args.agrupar),
+                         ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'aquecimento':
+        print(json.dumps(medir_aquecimento(args.backends.split(','), args.itens, args.repeticoes), ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'fila':
+        print(json.dumps(medir_fila([int(p) for p in args.processos.split(',')], args.usuarios, args.pedidos,
+                                    args.duplicados, args.itens, args.backend), ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'uploads':
+        print(json.dumps(medir_uploads(args.sessoes, args.fotos, args.backend, args.repeticoes), ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'apreensao':
+        print(json.dumps(medir_apreensao([int(t) for t in args.tamanhos.split(',')], args.backend, args.repeticoes),
+                         ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'casos':
+        print(json.dumps(medir_casos(args.casos, args.repeticoes), ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'api':
+        print(json.dumps(medir_api([int(p) for p in args.processos.split(',')], args.clientes, args.requisicoes,
+                                   args.itens, args.backend, args.porta), ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'interface':
+        print(json.dumps(medir_rerun_interface([int(t) for t in args.tamanhos.split(',')], repeticoes=args.repeticoes),
+                         ensure_ascii=False, indent=1))
+        return 0
+
+    if args.comando == 'sobrecarga':
+        print(json.dumps(medir_sobrecarga(args.itens, args.backend, args.repeticoes), ensure_ascii=False))
+        return 0
+
+    if args.comando == 'executar':
+        imagens = {'sem': [False], 'com': [True], 'ambos': [False, True]}[args.imagem]
+        relatorio = executar([int(t) for t in args.tamanhos.split(',')], args.misturas.split(','), imagens,
+                             args.backends.split(','), args.repeticoes)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=1)
+        print(f"Relatório gravado em {args.saida} ({len(relatorio['casos'])} casos).", file=sys.stderr)
+        return 0
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.novo, encoding='utf-8') as f:
+        novo = json.load(f)
+    regressoes = comparar(base, novo, args.limite)
+    unidades = {metrica: unidade for metrica, unidade, _ in METRICAS_COMPARADAS}
+    for nome, metrica, valor_base, valor_novo, variacao in regressoes:
+        print(f"REGRESSÃO {nome:40s} {metrica:16s} {round(valor_base, 1):>12} -> {round(valor_novo, 1):>12} {unidades[metrica]} (+{variacao:.0%})")
+    print(f"{len(regressoes)} regressão(ões) acima de {args.limite:.0%}.")
+    return 1 if regressoes else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
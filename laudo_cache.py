@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Cache de laudos já gerados, indexado por um hash do conteúdo de dados_laudo.
+
+chave_laudo() serializa dados_laudo de forma canônica (chaves ordenadas,
+imagens substituídas pelo SHA-256 dos bytes) junto com o backend, a data do
+encerramento e a chave do modelo base; o mesmo conteúdo gera sempre a mesma
+chave, e qualquer mudança que altere o .docx gera outra.
+
+CacheLaudos é um LRU limitado por número de entradas e por bytes. A interface
+mantém um por sessão (em st.session_state) e, opcionalmente, um compartilhado
+entre as sessões do processo (LAUDO_CACHE_COMPARTILHADO_MB > 0).
+
+Uso:
+    cache = CacheLaudos()
+    chave, entrada, origem = obter_ou_gerar(dados_laudo, cache)   # entrada: EntradaLaudo(conteudo, avisos, segundos)
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+
+from laudo_metricas import cronometro, incrementar
+
+MAX_ENTRADAS_SESSAO = 8
+MAX_BYTES_SESSAO = 32 * 1024 * 1024
+# Cache entre sessões: desligado por padrão (0 MB)
+MAX_BYTES_COMPARTILHADO = int(os.environ.get('LAUDO_CACHE_COMPARTILHADO_MB', '0')) * 1024 * 1024
+MAX_ENTRADAS_COMPARTILHADO = 256
+
+# conteudo: bytes do .docx; avisos: mensagens de falha de imagem da geração; segundos: tempo de geração
+EntradaLaudo = namedtuple('EntradaLaudo', ['conteudo', 'avisos', 'segundos'])
+
+# --- Chave do Laudo ---
+
+# Arquivo de imagem -> SHA-256 (uploads não mudam; evita reler os bytes a cada rerun)
+_digests = weakref.WeakKeyDictionary()
+_digests_lock = threading.Lock()
+
+def digest_arquivo(arquivo):
+    """SHA-256 (hex) dos bytes de um arquivo com getvalue() (UploadedFile, BytesIO) ou já calculado (ArquivoEmDisco)."""
+    if getattr(arquivo, 'sha256', None):
+        return arquivo.sha256
+    with _digests_lock:
+        try:
+            digest = _digests.get(arquivo)
+        except TypeError: # Objeto sem suporte a weakref
+            digest = None
+    if digest is None:
+        digest = hashlib.sha256(arquivo.getvalue()).hexdigest()
+        with _digests_lock:
+            try:
+                _digests[arquivo] = digest
+            except TypeError:
+                pass
+    return digest
+
+def _canonico(valor):
+    """Converte dados_laudo numa estrutura JSON estável (arquivos viram {'sha256': ...})."""
+    if isinstance(valor, dict):
+        return {str(k): _canonico(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_canonico(v) for v in valor]
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, (bytes, bytearray)):
+        return {'sha256': hashlib.sha256(valor).hexdigest()}
+    if hasattr(valor, 'getvalue') or hasattr(valor, 'sha256'):
+        return {'sha256': digest_arquivo(valor)}
+    return repr(valor)
+
+def chave_laudo(dados_laudo, backend=None):
+    """Hash (hex) do conteúdo do laudo: dados_laudo + backend + data do encerramento + modelo base."""
+    from laudo_docx import chave_template_base, data_formatada_laudo, escolher_backend
+    documento = {
+        'dados': _canonico(dados_laudo),
+        'backend': escolher_backend(dados_laudo, backend),
+        'data': data_formatada_laudo(), # O laudo traz a data do dia
+        'modelo': _canonico(chave_template_base()),
+    }
+    serializado = json.dumps(documento, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+# --- Cache LRU ---
+
+class CacheLaudos:
+    """LRU de EntradaLaudo limitado por número de entradas e pelo total de bytes."""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS_SESSAO, max_bytes=MAX_BYTES_SESSAO):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict() # chave -> EntradaLaudo (mais recente no fim)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave):
+        """EntradaLaudo da chave (marcada como recente) ou None."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.faltas += 1
+            else:
+                self.acertos += 1
+                self._entradas.move_to_end(chave)
+            return entrada
+
+    def guardar(self, chave, entrada):
+        """Guarda a entrada, descartando as menos usadas até caber nos limites."""
+        if len(entrada.conteudo) > self.max_bytes:
+            return # Maior que o cache inteiro
+        with self._lock:
+            anterior = self._entradas.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior.conteudo)
+            self._entradas[chave] = entrada
+            self._bytes += len(entrada.conteudo)
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, antiga = self._entradas.popitem(last=False)
+                self._bytes -= len(antiga.conteudo)
+
+    def __contains__(self, chave):
+        with self._lock:
+            return chave in self._entradas
+
+    def __len__(self):
+        return len(self._entradas)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+# Compartilhado entre as sessões do processo (None quando desligado)
+cache_compartilhado = CacheLaudos(MAX_ENTRADAS_COMPARTILHADO, MAX_BYTES_COMPARTILHADO) if MAX_BYTES_COMPARTILHADO > 0 else None
+
+def gerar_entrada(dados_laudo, backend=None):
+    """Gera o laudo e devolve EntradaLaudo; falhas de imagem viram avisos (o laudo sai sem a imagem)."""
+    from laudo_docx import fechar_documento, gerar_laudo_docx
+    inicio = time.perf_counter()
+    avisos = []
+    document = gerar_laudo_docx(dados_laudo, ao_erro_imagem=avisos.append, backend=backend)
+    saida = io.BytesIO()
+    try:
+        with cronometro('save'):
+            document.save(saida)
+    finally:
+        fechar_documento(document)
+    return EntradaLaudo(saida.getvalue(), tuple(avisos), time.perf_counter() - inicio)
+
+def obter_em_cache(chave, cache, compartilhado=None):
+    """(EntradaLaudo, origem) do cache da sessão ou do compartilhado; (None, None) se nenhum tiver a chave."""
+    entrada = cache.obter(chave)
+    if entrada is not None:
+        return entrada, 'sessao'
+    if compartilhado is not None:
+        entrada = compartilhado.obter(chave)
+        if entrada is not None:
+            cache.guardar(chave, entrada)
+            return entrada, 'compartilhado'
+    return None, None
+
+def obter_ou_gerar(dados_laudo, cache, compartilhado=None, backend=None, chave=None):
+    """Retorna (chave, EntradaLaudo, origem), com origem 'sessao', 'compartilhado' ou 'gerado'.
+
+    Procura no cache da sessão, depois no compartilhado; só gera o laudo se
+    nenhum dos dois tiver a chave. O resultado novo vai para os dois caches.
+    """
+    chave = chave or chave_laudo(dados_laudo, backend)
+    entrada, origem = obter_em_cache(chave, cache, compartilhado)
+    if entrada is None:
+        entrada, origem = gerar_entrada(dados_laudo, backend), 'gerado'
+        cache.guardar(chave, entrada)
+        if compartilhado is not None:
+            compartilhado.guardar(chave, entrada)
+    incrementar('laudo_cache_laudos_total', origem=origem)
+    return chave, entrada, origem
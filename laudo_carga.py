@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Teste de carga da interface: N sessões simultâneas do Streamlit num processo.
+
+Cada sessão é um AppTest (streamlit.testing) rodando laudo.py na sua própria
+thread, como as sessões do servidor, e segue o roteiro de um perito: informa o
+RG, cria os itens pelos widgets (num_itens_input, qtd_{i}, mat_{i}), envia uma
+foto pelo seletor de imagens e gera o laudo, esperando a fila de geração como
+o fragmento da página. São medidos a latência de cada rerun, a de cada geração
+(do clique até o botão de download) e o aumento de memória do processo por
+sessão.
+
+Cada número de sessões roda num subprocesso novo (memória, caches e fila
+limpos), com banco de casos e pasta de uploads temporários e cache
+compartilhado desligado; cada sessão tem RG, itens e foto próprios, para que
+nenhum laudo saia do cache. Antes da medição, uma sessão de aquecimento faz o
+roteiro inteiro. Nada sai da máquina.
+
+O AppTest não passa pelo websocket nem pelo navegador: mede o custo do
+servidor (script, widgets, sessão, geração), não o de rede ou renderização. A
+memória é o RSS do processo da interface; os processos da fila não entram.
+Cada run do AppTest troca estado global do Streamlit (Runtime._instance,
+config), então os reruns das sessões se revezam num lock, como as threads de
+script do servidor se revezam no GIL: 'rerun_ms' é a latência vista pelo
+perito (inclui a espera pelos reruns das outras sessões) e 'execucao_ms' só a
+do script. As gerações seguem em paralelo na fila.
+
+O envio da foto usa o file_uploader do AppTest, que só existe a partir do
+Streamlit 1.56 (a interface em si roda desde o 1.49); com versão anterior o
+teste para logo no início, com a versão exigida.
+
+O relatório JSON pode ser comparado entre versões: 'comparar' aponta as
+regressões de p95 e de memória acima de um limite.
+
+Uso:
+    python laudo_carga.py executar --sessoes 1,2,4,8 --itens 5 -o carga.json
+    python laudo_carga.py comparar base.json carga.json --limite 0.20
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_INTERFACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'laudo.py')
+TIMEOUT_RERUN = 120 # s
+TIMEOUT_GERACAO = 300 # s
+INTERVALO_ESPERA = 0.05 # s entre consultas ao estado da geração
+TENTATIVAS_FILA_CHEIA = 20
+# AppTest com suporte a file_uploader (a interface em si exige só o 1.49, ver requirements.txt)
+STREAMLIT_MINIMO_CARGA = (1, 56)
+
+_lock_apptest = threading.Lock() # Um run do AppTest por vez (ver docstring)
+
+def verificar_streamlit():
+    """Levanta RuntimeError se o Streamlit instalado for anterior a STREAMLIT_MINIMO_CARGA."""
+    import streamlit
+    versao = tuple(int(parte) for parte in streamlit.__version__.split('.')[:2] if parte.isdigit())
+    if versao < STREAMLIT_MINIMO_CARGA:
+        minimo = '.'.join(map(str, STREAMLIT_MINIMO_CARGA))
+        raise RuntimeError(f"o teste de carga exige streamlit>={minimo} (file_uploader no AppTest); "
+                           f"instalado: {streamlit.__version__}")
+
+# --- Medição ---
+
+def _rss_bytes():
+    """Memória residente do processo (Linux: /proc; nos demais, o pico do getrusage)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == 'darwin' else pico * 1024
+
+def percentis_ms(valores):
+    """{'p50', 'p95', 'p99'} em ms (None sem amostras)."""
+    if not valores:
+        return {'p50': None, 'p95': None, 'p99': None}
+    if len(valores) == 1:
+        return {'p50': round(valores[0] * 1000, 1), 'p95': round(valores[0] * 1000, 1), 'p99': round(valores[0] * 1000, 1)}
+    quantis = statistics.quantiles(valores, n=100, method='inclusive')
+    return {'p50': round(quantis[49] * 1000, 1), 'p95': round(quantis[94] * 1000, 1), 'p99': round(quantis[98] * 1000, 1)}
+
+class Sessao:
+    """Uma sessão simulada: o AppTest e as latências dos seus reruns e gerações."""
+
+    def __init__(self, indice, n_itens, pausa, foto, semente=0, script=SCRIPT_INTERFACE):
+        from streamlit.testing.v1 import AppTest
+        self.indice = indice
+        self.n_itens = n_itens
+        self.pausa = pausa
+        self.foto = foto
+        self.rng = random.Random(semente * 100_003 + indice)
+        self.app = AppTest.from_file(script, default_timeout=TIMEOUT_RERUN)
+        self.reruns = []
+        self.execucoes = []
+        self.geracoes = []
+        self.erros = []
+        self.recusas = 0
+
+    def _rodar(self, widget=None):
+        """Um rerun (após interagir com 'widget', se informado), cronometrado."""
+        inicio = time.perf_counter()
+        with _lock_apptest:
+            inicio_execucao = time.perf_counter()
+            (widget or self.app).run()
+            fim = time.perf_counter()
+        self.reruns.append(fim - inicio)
+        self.execucoes.append(fim - inicio_execucao)
+        if self.app.exception:
+            self.erros.append(self.app.exception[0].message)
+        if self.pausa:
+            time.sleep(self.pausa)
+
+    def _gerar(self):
+        """Clica em Gerar e espera o laudo (a página consulta a fila; aqui, o estado da tarefa)."""
+        app = self.app
+        inicio = time.perf_counter()
+        for _ in range(TENTATIVAS_FILA_CHEIA):
+            self._rodar(next(botao for botao in app.button if 'Gerar Laudo' in botao.label).click())
+            if 'tarefa_laudo' in app.session_state or app.get('download_button'):
+                break
+            self.recusas += 1 # Fila cheia: o perito tenta de novo
+            time.sleep(1.0)
+        limite = time.monotonic() + TIMEOUT_GERACAO
+        while 'tarefa_laudo' in app.session_state and app.session_state['tarefa_laudo'][0].estado in ('fila', 'gerando'):
+            if time.monotonic() > limite:
+                self.erros.append("geração não terminou no tempo limite")
+                return
+            time.sleep(INTERVALO_ESPERA)
+        self._rodar() # O fragmento recarrega a página quando o laudo fica pronto
+        if any('Download Laudo' in botao.label for botao in app.get('download_button')):
+            self.geracoes.append(time.perf_counter() - inicio)
+        else:
+            self.erros.append("laudo gerado sem botão de download")
+
+    def executar(self):
+        """Roteiro do perito: RG, itens pelos widgets, foto e geração."""
+        from laudo_docx import TIPOS_MATERIAL_BASE
+        materiais = list(TIPOS_MATERIAL_BASE)
+        app = self.app
+        try:
+            self._rodar()
+            self._rodar(app.text_input(key='rg_pericia_input').input(f"CARGA_{os.getpid()}_{self.indice}"))
+            self._rodar(app.number_input(key='num_itens_input').set_value(self.n_itens))
+            for i in range(self.n_itens):
+                self._rodar(app.number_input(key=f"qtd_{i}").set_value(self.rng.randint(1, 50)))
+                self._rodar(app.selectbox(key=f"mat_{i}").set_value(self.rng.choice(materiais)))
+            seletor = next(widget for widget in app.get('file_uploader') if widget.key.startswith('image_uploader_'))
+            self._rodar(seletor.set_value((f"foto_{self.indice}.jpg", self.foto, 'image/jpeg')))
+            if len(app.session_state['dados_laudo']['imagens']) != 1:
+                self.erros.append("foto não chegou ao laudo")
+            self._gerar()
+        except Exception as e:
+            self.erros.append(f"{type(e).__name__}: {e}")
+
+def _foto_distinta(indice):
+    """A foto sintética do benchmark com bytes finais distintos (nenhuma sessão reaproveita o cache de imagens)."""
+    from laudo_benchmark import imagem_sintetica
+    return imagem_sintetica()[:-2] + indice.to_bytes(4, 'big') + imagem_sintetica()[-2:]
+
+def executar_rodada(n_sessoes, n_itens=5, pausa=0.0, script=SCRIPT_INTERFACE):
+    """Roda N sessões simultâneas neste processo e retorna as medidas da rodada."""
+    import laudo_metricas
+    verificar_streamlit()
+    Sessao(-1, n_itens, 0.0, _foto_distinta(10 ** 6), script=script).executar() # Aquecimento: imports, pool, caches
+    gc.collect()
+    memoria_antes = _rss_bytes()
+
+    sessoes = [Sessao(i, n_itens, pausa, _foto_distinta(i), script=script) for i in range(n_sessoes)]
+    largada = threading.Barrier(n_sessoes)
+    def rodar(sessao):
+        largada.wait()
+        sessao.executar()
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=rodar, args=(sessao,), name=f"sessao-{sessao.indice}") for sessao in sessoes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+    gc.collect()
+    memoria_depois = _rss_bytes()
+
+    reruns = [t for sessao in sessoes for t in sessao.reruns]
+    execucoes = [t for sessao in sessoes for t in sessao.execucoes]
+    geracoes = [t for sessao in sessoes for t in sessao.geracoes]
+    medidores = {nome: valor for nome, _, valor in laudo_metricas.instantaneo()['medidores']}
+    erros = [erro for sessao in sessoes for erro in sessao.erros]
+    return {
+        'nome': f"sessoes_{n_sessoes}",
+        'sessoes': n_sessoes, 'itens': n_itens, 'pausa_s': pausa,
+        'segundos': round(duracao, 2),
+        'reruns': len(reruns),
+        'rerun_ms': percentis_ms(reruns),
+        'execucao_ms': percentis_ms(execucoes),
+        'geracoes': len(geracoes),
+        'geracao_ms': percentis_ms(geracoes),
+        'memoria_processo_mb': round(memoria_depois / 1e6, 1),
+        'memoria_por_sessao_mb': round((memoria_depois - memoria_antes) / n_sessoes / 1e6, 2),
+        'sessoes_bytes_memoria': medidores.get('laudo_sessoes_bytes_memoria'),
+        'recusas_fila': sum(sessao.recusas for sessao in sessoes),
+        'erros': len(erros),
+        'exemplos_erros': erros[:3],
+    }
+
+def executar(lista_sessoes, n_itens=5, pausa=0.0, saida_progresso=sys.stderr):
+    """Uma rodada por número de sessões, cada uma num subprocesso novo. Retorna o relatório."""
+    verificar_streamlit()
+    rodadas = []
+    for n_sessoes in lista_sessoes:
+        with tempfile.TemporaryDirectory() as pasta:
+            ambiente = dict(os.environ, LAUDO_CASOS_DB=os.path.join(pasta, 'casos.sqlite3'),
+                            LAUDO_UPLOADS_DIR=os.path.join(pasta, 'uploads'), LAUDO_CACHE_COMPARTILHADO_MB='0')
+            saida = subprocess.run([sys.executable, os.path.abspath(__file__), 'rodada', '--sessoes', str(n_sessoes),
+                                    '--itens', str(n_itens), '--pausa', str(pausa)],
+                                   cwd=os.path.dirname(SCRIPT_INTERFACE), env=ambiente, capture_output=True, text=True)
+        if saida.returncode != 0:
+            print(saida.stderr[-2000:], file=saida_progresso)
+            raise RuntimeError(f"rodada com {n_sessoes} sessões falhou (código {saida.returncode})")
+        rodada = json.loads(saida.stdout.strip().splitlines()[-1])
+        rodadas.append(rodada)
+        print(f"{n_sessoes:4d} sessões  rerun p50/p95/p99 {rodada['rerun_ms']['p50']}/{rodada['rerun_ms']['p95']}/"
+              f"{rodada['rerun_ms']['p99']} ms  geração p50/p95/p99 {rodada['geracao_ms']['p50']}/"
+              f"{rodada['geracao_ms']['p95']}/{rodada['geracao_ms']['p99']} ms  "
+              f"{rodada['memoria_por_sessao_mb']} MB/sessão  {rodada['erros']} erro(s)", file=saida_progresso)
+    return {
+        'meta': {'data': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                 'plataforma': platform.platform(), 'processador': platform.processor() or platform.machine(),
+                 'cpus': os.cpu_count()},
+        'rodadas': rodadas,
+    }
+
+# --- Comparação ---
+
+# (métrica, unidade, piso): variações abaixo do piso são ruído, não regressão
+METRICAS_COMPARADAS = (('rerun_p95', 'ms', 5.0), ('geracao_p95', 'ms', 20.0), ('memoria_por_sessao_mb', 'MB', 0.5))
+
+def _valor(rodada, metrica):
+    if metrica == 'rerun_p95':
+        return rodada['rerun_ms']['p95']
+    if metrica == 'geracao_p95':
+        return rodada['geracao_ms']['p95']
+    return rodada[metrica]
+
+def comparar(base, novo, limite=0.20):
+    """Compara dois relatórios. Retorna [(rodada, métrica, valor_base, valor_novo, variação)] das regressões."""
+    rodadas_base = {rodada['nome']: rodada for rodada in base['rodadas']}
+    regressoes = []
+    for rodada in novo['rodadas']:
+        anterior = rodadas_base.get(rodada['nome'])
+        if anterior is None:
+            continue
+        for metrica, _, piso in METRICAS_COMPARADAS:
+            valor_base, valor_novo = _valor(anterior, metrica), _valor(rodada, metrica)
+            if valor_base is None or valor_novo is None or valor_novo - valor_base <= piso:
+                continue
+            variacao = (valor_novo - valor_base) / valor_base if valor_base else float('inf')
+            if variacao > limite:
+                regressoes.append((rodada['nome'], metrica, valor_base, valor_novo, variacao))
+    return regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga da interface (sessões simultâneas via AppTest).")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_exec = sub.add_parser('executar', help="Roda as rodadas e grava o relatório JSON")
+    p_exec.add_argument('-o', '--saida', default='carga.json', help="Arquivo JSON de saída")
+    p_exec.add_argument('--sessoes', default='1,2,4,8', help="Números de sessões simultâneas, separados por vírgula")
+    p_exec.add_argument('--itens', type=int, default=5, help="Itens criados por sessão")
+    p_exec.add_argument('--pausa', type=float, default=0.0, help="Pausa (s) entre as ações de cada sessão")
+
+    p_rodada = sub.add_parser('rodada', help="Uma rodada neste processo (usado por 'executar'); imprime o JSON")
+    p_rodada.add_argument('--sessoes', type=int, required=True)
+    p_rodada.add_argument('--itens', type=int, default=5)
+    p_rodada.add_argument('--pausa', type=float, default=0.0)
+
+    p_comp = sub.add_parser('comparar', help="Compara dois relatórios e aponta regressões")
+    p_comp.add_argument('base')
+    p_comp.add_argument('novo')
+    p_comp.add_argument('--limite', type=float, default=0.20, help="Variação máxima tolerada (0.20 = 20%%)")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'rodada':
+        print(json.dumps(executar_rodada(args.sessoes, args.itens, args.pausa), ensure_ascii=False))
+        return 0
+
+    if args.comando == 'executar':
+        relatorio = executar([int(n) for n in args.sessoes.split(',')], args.itens, args.pausa)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=1)
+        print(f"Relatório gravado em {args.saida} ({len(relatorio['rodadas'])} rodadas).", file=sys.stderr)
+        return 0
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.novo, encoding='utf-8') as f:
+        novo = json.load(f)
+    regressoes = comparar(base, novo, args.limite)
+    unidades = {metrica: unidade for metrica, unidade, _ in METRICAS_COMPARADAS}
+    for nome, metrica, valor_base, valor_novo, variacao in regressoes:
+        print(f"REGRESSÃO {nome:14s} {metrica:22s} {valor_base:>10} -> {valor_novo:>10} {unidades[metrica]} (+{variacao:.0%})")
+    print(f"{len(regressoes)} regressão(ões) acima de {args.limite:.0%}.")
+    return 1 if regressoes else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Armazenamento local dos casos (SQLite): rascunhos de dados_laudo e laudos gerados.
+
+Cada caso tem um id (hex) e guarda dados_laudo em JSON, sem as imagens: elas
+vêm do upload da página e não voltam para o file_uploader; os laudos gerados
+(.docx, com as imagens) ficam guardados à parte. A busca usa índices:
+    - rg_pericia e lacre: prefixo, sem diferenciar maiúsculas;
+    - pessoa: cada palavra do nome das pessoas dos itens (sem acentos) numa
+      tabela de termos; todas as palavras da busca precisam casar por prefixo.
+
+GravadorRascunhos faz o salvamento automático: cada rerun da página agenda o
+estado atual, e uma thread grava todos os casos pendentes numa só transação
+quando as mudanças param por 'atraso' segundos (ou após 'atraso_maximo').
+Se a gravação falha (disco cheio, banco só de leitura), o lote volta para a
+fila e a próxima tentativa espera o dobro da anterior, de 'atraso' até
+'atraso_maximo'; a falha é registrada uma vez por sequência de falhas.
+
+Variável de ambiente LAUDO_CASOS_DB: caminho do banco (padrão
+~/.laudo/casos.sqlite3; vazio desliga o armazenamento na interface).
+
+Uso:
+    repositorio = RepositorioCasos('casos.sqlite3')
+    gravador = GravadorRascunhos(repositorio)
+    gravador.agendar(caso_id, dados_laudo)      # a cada rerun; grava depois, em lote
+    repositorio.buscar(pessoa='fulano tal')     # [{'id', 'rg_pericia', 'lacre', 'itens', 'atualizado'}]
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+
+from laudo_metricas import HISTOGRAMA_ETAPAS, incrementar, observar, registrar_evento
+
+CAMINHO_PADRAO = os.environ.get('LAUDO_CASOS_DB', os.path.join(os.path.expanduser('~'), '.laudo', 'casos.sqlite3'))
+ATRASO_AUTOSAVE = 1.0 # Segundos sem mudanças antes de gravar
+ATRASO_MAXIMO_AUTOSAVE = 5.0 # Mudanças contínuas são gravadas ao menos neste intervalo
+LIMITE_BUSCA = 50
+# Termo de pessoa com menos casos que isto guia a busca pelo índice de termos;
+# acima, é mais rápido percorrer os casos do mais recente para trás até o limite
+LIMIAR_TERMO_SELETIVO = 2000
+CAMPOS_NAO_SALVOS = ('imagem', 'imagens') # Arquivos de upload não entram no rascunho
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS casos (
+    id TEXT PRIMARY KEY,
+    rg_pericia TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    lacre TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    itens INTEGER NOT NULL DEFAULT 0,
+    dados TEXT NOT NULL,
+    criado REAL NOT NULL,
+    atualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS casos_rg ON casos (rg_pericia);
+CREATE INDEX IF NOT EXISTS casos_lacre ON casos (lacre);
+CREATE INDEX IF NOT EXISTS casos_atualizado ON casos (atualizado);
+CREATE TABLE IF NOT EXISTS pessoas (
+    termo TEXT NOT NULL,
+    caso_id TEXT NOT NULL REFERENCES casos (id) ON DELETE CASCADE,
+    PRIMARY KEY (termo, caso_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pessoas_caso ON pessoas (caso_id);
+CREATE TABLE IF NOT EXISTS laudos (
+    id INTEGER PRIMARY KEY,
+    caso_id TEXT NOT NULL REFERENCES casos (id) ON DELETE CASCADE,
+    chave TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    gerado REAL NOT NULL,
+    conteudo BLOB NOT NULL,
+    UNIQUE (caso_id, chave)
+);
+"""
+
+def novo_caso_id():
+    return uuid.uuid4().hex
+
+def normalizar(texto):
+    """Minúsculas e sem acentos ('João' -> 'joao')."""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+def termos_pessoas(dados_laudo):
+    """Palavras (normalizadas) dos nomes das pessoas dos itens, sem repetição."""
+    termos = set()
+    for item in dados_laudo.get('itens') or []:
+        termos.update(normalizar(item.get('pessoa')).split())
+    return termos
+
+def serializar_rascunho(dados_laudo):
+    """JSON estável de dados_laudo sem os arquivos de imagem."""
+    return json.dumps({k: v for k, v in dados_laudo.items() if k not in CAMPOS_NAO_SALVOS},
+                      ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def _limites_prefixo(prefixo):
+    """(início, fim) para 'coluna >= início AND coluna < fim', que usa o índice (ao contrário de LIKE)."""
+    return prefixo, prefixo + '\U0010ffff'
+
+class RepositorioCasos:
+    """Casos e laudos num arquivo SQLite (WAL; uma conexão por thread)."""
+
+    def __init__(self, caminho=CAMINHO_PADRAO):
+        self.caminho = caminho
+        if caminho != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self._local = threading.local()
+        self._conexao().executescript(ESQUEMA)
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=30)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute('PRAGMA journal_mode=WAL') # Leituras não esperam pela gravação do autosave
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            conexao.execute('PRAGMA foreign_keys=ON')
+            self._local.conexao = conexao
+        return conexao
+
+    # --- Gravação ---
+
+    def salvar_rascunhos(self, rascunhos):
+        """Grava {caso_id: (dados_laudo, json)} numa única transação."""
+        agora = time.time()
+        conexao = self._conexao()
+        with conexao:
+            for caso_id, (dados, texto) in rascunhos.items():
+                conexao.execute(
+                    "INSERT INTO casos (id, rg_pericia, lacre, itens, dados, criado, atualizado) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET rg_pericia = excluded.rg_pericia, lacre = excluded.lacre, "
+                    "itens = excluded.itens, dados = excluded.dados, atualizado = excluded.atualizado",
+                    (caso_id, str(dados.get('rg_pericia') or '').strip(), str(dados.get('lacre') or '').strip(),
+                     len(dados.get('itens') or []), texto, agora, agora))
+                conexao.execute("DELETE FROM pessoas WHERE caso_id = ?", (caso_id,))
+                conexao.executemany("INSERT INTO pessoas (termo, caso_id) VALUES (?, ?)",
+                                    ((termo, caso_id) for termo in termos_pessoas(dados)))
+
+    def salvar_caso(self, caso_id, dados_laudo):
+        self.salvar_rascunhos({caso_id: (dados_laudo, serializar_rascunho(dados_laudo))})
+
+    def guardar_laudo(self, caso_id, chave, nome, conteudo):
+        """Guarda o .docx gerado (uma vez por conteúdo, pela chave do laudo)."""
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute("INSERT OR IGNORE INTO laudos (caso_id, chave, nome, gerado, conteudo) VALUES (?, ?, ?, ?, ?)",
+                            (caso_id, chave, nome, time.time(), conteudo))
+
+    def excluir_caso(self, caso_id):
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute("DELETE FROM casos WHERE id = ?", (caso_id,))
+
+    # --- Leitura ---
+
+    def carregar_caso(self, caso_id):
+        """dados_laudo salvo (sem imagens) ou None."""
+        linha = self._conexao().execute("SELECT dados FROM casos WHERE id = ?", (caso_id,)).fetchone()
+        if linha is None:
+            return None
+        dados = json.loads(linha['dados'])
+        dados.setdefault('imagens', [])
+        return dados
+
+    def buscar(self, rg_pericia=None, lacre=None, pessoa=None, limite=LIMITE_BUSCA):
+        """Casos mais recentes que casam com todos os filtros informados (prefixos)."""
+        inicio = time.perf_counter()
+        condicoes, parametros = [], []
+        for coluna, valor in (('rg_pericia', rg_pericia), ('lacre', lacre)):
+            valor = (valor or '').strip()
+            if valor:
+                condicoes.append(f"{coluna} >= ? AND {coluna} < ?")
+                parametros.extend(_limites_prefixo(valor))
+        termos = normalizar(pessoa).split()
+        if termos:
+            seletivo = min(termos, key=self._contar_termo)
+            if self._contar_termo(seletivo) < LIMIAR_TERMO_SELETIVO:
+                condicoes.append("id IN (SELECT caso_id FROM pessoas WHERE termo >= ? AND termo < ?)")
+                parametros.extend(_limites_prefixo(seletivo))
+                termos.remove(seletivo)
+            for termo in termos:
+                condicoes.append("EXISTS (SELECT 1 FROM pessoas WHERE pessoas.caso_id = casos.id AND termo >= ? AND termo < ?)")
+                parametros.extend(_limites_prefixo(termo))
+        sql = "SELECT id, rg_pericia, lacre, itens, atualizado FROM casos"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY atualizado DESC LIMIT ?"
+        linhas = self._conexao().execute(sql, parametros + [limite]).fetchall()
+        observar(HISTOGRAMA_ETAPAS, time.perf_counter() - inicio, etapa='buscar_casos')
+        return [dict(linha) for linha in linhas]
+
+    def _contar_termo(self, termo):
+        """Casos com o termo (por prefixo), contando só até LIMIAR_TERMO_SELETIVO."""
+        return self._conexao().execute(
+            "SELECT count(*) FROM (SELECT 1 FROM pessoas WHERE termo >= ? AND termo < ? LIMIT ?)",
+            _limites_prefixo(termo) + (LIMIAR_TERMO_SELETIVO,)).fetchone()[0]
+
+    def laudos_do_caso(self, caso_id):
+        """[{'id', 'nome', 'gerado', 'bytes'}] dos laudos gerados do caso, do mais recente ao mais antigo."""
+        linhas = self._conexao().execute(
+            "SELECT id, nome, gerado, length(conteudo) AS bytes FROM laudos WHERE caso_id = ? ORDER BY gerado DESC", (caso_id,))
+        return [dict(linha) for linha in linhas]
+
+    def obter_laudo(self, laudo_id):
+        """(nome, bytes do .docx) ou None."""
+        linha = self._conexao().execute("SELECT nome, conteudo FROM laudos WHERE id = ?", (laudo_id,)).fetchone()
+        return (linha['nome'], linha['conteudo']) if linha else None
+
+    def __len__(self):
+        return self._conexao().execute("SELECT count(*) FROM casos").fetchone()[0]
+
+class GravadorRascunhos:
+    """Salvamento automático com espera (debounce): várias mudanças viram uma transação."""
+
+    def __init__(self, repositorio, atraso=ATRASO_AUTOSAVE, atraso_maximo=ATRASO_MAXIMO_AUTOSAVE):
+        self.repositorio = repositorio
+        self.atraso = atraso
+        self.atraso_maximo = atraso_maximo
+        self._pendentes = {} # caso_id -> (dados, json) mais recente ainda não gravado
+        self._gravados = {} # caso_id -> json da última gravação (mudança nenhuma não agenda nada)
+        self._primeira = self._ultima = 0.0
+        self._recuo = 0.0 # Espera após a última falha (0: a última gravação deu certo)
+        self._retomar = 0.0 # Antes disto (monotonic) a thread não tenta gravar de novo
+        self._condicao = threading.Condition()
+        self._gravacao = threading.Lock() # Retirar e gravar um lote é atômico: versões não se invertem
+        self._thread = None
+        self.transacoes = 0
+
+    def agendar(self, caso_id, dados_laudo):
+        """Agenda a gravação do estado atual do caso. Retorna False se nada mudou desde a última."""
+        texto = serializar_rascunho(dados_laudo)
+        with self._condicao:
+            if caso_id not in self._pendentes and self._gravados.get(caso_id) == texto:
+                return False
+            agora = time.monotonic()
+            if not self._pendentes:
+                self._primeira = agora
+            self._ultima = agora
+            self._pendentes[caso_id] = (json.loads(texto), texto) # Cópia: a sessão continua mutando dados_laudo
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._trabalhar, name='laudo-autosave', daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+        return True
+
+    def marcar_gravado(self, caso_id, dados_laudo):
+        """Registra que o caso já está no banco com esse conteúdo (ex.: recém-carregado)."""
+        with self._condicao:
+            self._gravados[caso_id] = serializar_rascunho(dados_laudo)
+
+    def _trabalhar(self):
+        while True:
+            with self._condicao:
+                while True:
+                    if self._pendentes:
+                        agora = time.monotonic()
+                        espera = max(min(self._ultima + self.atraso, self._primeira + self.atraso_maximo),
+                                     self._retomar) - agora
+                        if espera <= 0:
+                            break
+                        self._condicao.wait(espera)
+                    else:
+                        self._condicao.wait()
+            self.descarregar()
+
+    def descarregar(self):
+        """Grava agora todos os rascunhos pendentes (numa transação). Retorna quantos."""
+        with self._gravacao:
+            with self._condicao:
+                lote, self._pendentes = self._pendentes, {}
+            if not lote:
+                return 0
+            inicio = time.perf_counter()
+            try:
+                self.repositorio.salvar_rascunhos(lote)
+            except sqlite3.Error as e:
+                incrementar('laudo_falhas_total', tipo='autosave')
+                with self._condicao: # Devolve o que não foi substituído por uma versão mais nova
+                    for caso_id, rascunho in lote.items():
+                        self._pendentes.setdefault(caso_id, rascunho)
+                    primeira_falha = not self._recuo
+                    self._recuo = min(max(self._recuo * 2, self.atraso), self.atraso_maximo)
+                    self._primeira = self._ultima = agora = time.monotonic()
+                    self._retomar = agora + self._recuo
+                if primeira_falha: # Uma vez por sequência de falhas, não a cada tentativa
+                    registrar_evento('falha_autosave', casos=len(lote), erro=str(e))
+                    print(f"Erro ao salvar rascunhos: {e} (novas tentativas com espera crescente, até {self.atraso_maximo:g} s)")
+                return 0
+            with self._condicao:
+                if self._recuo:
+                    print("Rascunhos gravados novamente.")
+                self._recuo = self._retomar = 0.0
+                for caso_id, (_, texto) in lote.items():
+                    self._gravados[caso_id] = texto
+            self.transacoes += 1
+            observar(HISTOGRAMA_ETAPAS, time.perf_counter() - inicio, etapa='autosave')
+            incrementar('laudo_autosave_casos_total', len(lote))
+            return len(lote)
+
+    @property
+    def pendentes(self):
+        return len(self._pendentes)
+
+# Repositório e gravador da interface: criados no primeiro uso, compartilhados pelas sessões
+_padrao = None
+_padrao_lock = threading.Lock()
+
+def armazenamento_padrao():
+    """(RepositorioCasos, GravadorRascunhos) do processo, ou None se LAUDO_CASOS_DB for vazio ou o banco falhar."""
+    global _padrao
+    with _padrao_lock:
+        if _padrao is None:
+            if not CAMINHO_PADRAO:
+                _padrao = False
+            else:
+                try:
+                    repositorio = RepositorioCasos(CAMINHO_PADRAO)
+                    gravador = GravadorRascunhos(repositorio)
+                    atexit.register(gravador.descarregar)
+                    _padrao = (repositorio, gravador)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Armazenamento de casos indisponível ({CAMINHO_PADRAO}): {e}")
+                    _padrao = False
+        return _padrao or None
@@ -0,0 +1,686 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de geração do laudo DOCX (sem dependência do Streamlit).
+
+Contém as constantes do laudo, os estilos (fonte 'Gadugi' e cores SPTC/GO),
+as funções adicionar_* de cada seção e gerar_laudo_docx. Pode ser importado
+por scripts, pools de processos e testes sem carregar a interface.
+Pillow e pytz só são importados quando há imagem ou data a processar.
+As etapas são cronometradas por laudo_metricas (histogramas e log JSON).
+"""
+
+from datetime import datetime
+import io
+import os
+import copy
+import threading
+from docx import Document
+from docx.shared import Pt, Inches, RGBColor
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.style import WD_STYLE_TYPE
+# Importações necessárias para campos de página
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+import traceback
+import time
+from laudo_metricas import etapa, incrementar, registrar_evento, medicao
+# Camada de texto das seções; os termos em itálico são reexportados daqui
+from laudo_secoes import (
+    TERMOS_ITALICO_ORIGINAL, PADRAO_ITALICO, compilar_padrao_italico, segmentar_italico,
+    secao_objetivo_exames, secao_exames, secao_resultados, secao_conclusao,
+    secao_custodia_material, secao_referencias, secao_encerramento_assinatura,
+    ordenar_referencias, descrever_referencias
+)
+# Plural, números por extenso e descrições dos itens pré-montadas; pluralizar_palavra é reexportada daqui
+from laudo_linguagem import pluralizar_palavra, numero_por_extenso, montar_tabela_descricoes, descrever_item
+from laudo_recursos import fuso_horario
+# Tipos de material e substâncias pesquisadas vêm do catálogo declarativo (substancias.json)
+from laudo_substancias import catalogo, classificar
+
+# --- Constantes ---
+TIPOS_MATERIAL_BASE = catalogo().materiais
+
+TIPOS_EMBALAGEM_BASE = {
+    "e": "microtubo do tipo eppendorf",
+    "z": "embalagem do tipo ziplock",
+    "a": "papel alumínio",
+    "pl": "plástico",
+    "pa": "papel"
+}
+
+CORES_FEMININO_EMBALAGEM = {
+    "t": "transparente", "b": "branca", "az": "azul", "am": "amarela",
+    "vd": "verde", "vm": "vermelha", "p": "preta", "c": "cinza",
+    "m": "marrom", "r": "rosa", "l": "laranja", "violeta": "violeta", "roxa": "roxa"
+}
+
+# Embalagens cuja descrição inclui a cor ("de cor transparente")
+EMBALAGENS_COM_COR = ('pl', 'pa', 'e', 'z')
+
+# Trecho "porções de material ..., acondicionadas ... em ..." de cada combinação de códigos
+DESCRICOES_ITEM = montar_tabela_descricoes(TIPOS_MATERIAL_BASE, TIPOS_EMBALAGEM_BASE,
+                                           CORES_FEMININO_EMBALAGEM, EMBALAGENS_COM_COR)
+
+meses_portugues = {
+    1: "janeiro", 2: "fevereiro", 3: "março", 4: "abril", 5: "maio", 6: "junho",
+    7: "julho", 8: "agosto", 9: "setembro", 10: "outubro", 11: "novembro", 12: "dezembro"
+}
+
+dias_semana_portugues = {
+    0: "Segunda-feira", 1: "Terça-feira", 2: "Quarta-feira", 3: "Quinta-feira",
+    4: "Sexta-feira", 5: "Sábado", 6: "Domingo"
+}
+
+# Fonte padrão do laudo (corpo, títulos, cabeçalho e rodapé)
+FONTE_PADRAO = 'Gadugi'
+
+# Backend de geração: 'docx' (python-docx), 'ooxml' (XML direto, ver laudo_ooxml.py) ou
+# 'fluxo' (XML direto gravado no zip à medida que é gerado, com memória constante)
+BACKENDS_LAUDO = ('docx', 'ooxml', 'fluxo')
+BACKEND_PADRAO = 'docx'
+# Opcional: sem backend explícito, laudos a partir deste número de itens saem em 'fluxo'
+# (LAUDO_LIMIAR_FLUXO; padrão 0, desligado). A troca é avisada no console e no log JSON.
+LIMIAR_ITENS_FLUXO = int(os.environ.get('LAUDO_LIMIAR_FLUXO', '0'))
+
+# Cores Institucionais SPTC/GO (para uso no DOCX)
+DOCX_COR_AZUL_SPTC = RGBColor(0, 71, 143)
+DOCX_COR_CINZA_SPTC = RGBColor(110, 110, 110)
+DOCX_COR_PRETO = RGBColor(0, 0, 0)
+
+# --- Funções Auxiliares (Pluralização, Extenso, Parágrafo, Imagem) ---
+def obter_quantidade_extenso(qtd):
+    """Retorna a quantidade por extenso, no feminino (concorda com 'porções')."""
+    return numero_por_extenso(qtd)
+
+def descricao_item(tipo_mat_cod, emb_cod, cor_emb_cod, qtd):
+    """Descrição do material e da embalagem de um item (sem número e quantidade)."""
+    return descrever_item(DESCRICOES_ITEM, TIPOS_MATERIAL_BASE, TIPOS_EMBALAGEM_BASE, CORES_FEMININO_EMBALAGEM,
+                          EMBALAGENS_COM_COR, tipo_mat_cod, emb_cod, cor_emb_cod, qtd)
+
+# Alinhamentos aceitos por adicionar_paragrafo (montado uma única vez)
+MAPA_ALINHAMENTO = {
+    'justify': WD_ALIGN_PARAGRAPH.JUSTIFY, 'center': WD_ALIGN_PARAGRAPH.CENTER,
+    'right': WD_ALIGN_PARAGRAPH.RIGHT, 'left': WD_ALIGN_PARAGRAPH.LEFT
+}
+
+def adicionar_paragrafo(doc, text, style=None, align=None, color=None, size=None, bold=False, italic=False, segmentos=None):
+    """Adiciona um parágrafo ao documento docx com formatação flexível.
+
+    Os termos de TERMOS_ITALICO_ORIGINAL saem em itálico já na criação do
+    parágrafo: um run por trecho, e não um run por caractere. segmentos são os
+    trechos (texto, italico) já calculados, se houver (ver laudo_secoes).
+    No backend OOXML (laudo_ooxml.LaudoOOXML) o parágrafo é gerado direto como XML;
+    só os parágrafos das seções (com segmentos) são candidatos ao cache de XML.
+    """
+    adicionar_paragrafo_xml = getattr(doc, 'adicionar_paragrafo_xml', None)
+    if adicionar_paragrafo_xml is not None:
+        return adicionar_paragrafo_xml(text, style, align, color, size, bold, italic, fixo=segmentos is not None)
+
+    p = doc.add_paragraph()
+    # Aplica estilo de parágrafo; documentos do modelo base trazem o mapa nome -> id pronto
+    estilos = getattr(doc.part, 'estilos_laudo', None)
+    if style and estilos is not None and style in estilos:
+        p._p.style = estilos[style] # Mesmo efeito de p.style = ..., sem varrer todos os estilos a cada parágrafo
+    elif style and style in doc.styles:
+        try:
+            p.style = doc.styles[style]
+        except Exception as e:
+            print(f"Erro ao aplicar estilo '{style}': {e}. Usando 'Normal'.")
+            p.style = doc.styles['Normal']
+    elif style: # Se o estilo for passado mas não existir, usar Normal
+        print(f"Estilo '{style}' não encontrado. Usando 'Normal'.")
+        p.style = doc.styles['Normal']
+
+    # Aplica alinhamento (garante que a chave é string e minúscula)
+    if align:
+        p.alignment = MAPA_ALINHAMENTO.get(str(align).lower(), WD_ALIGN_PARAGRAPH.LEFT)
+
+    # Resolve a formatação de caractere uma vez para todos os runs
+    cor_rgb = None
+    if color:
+        if isinstance(color, RGBColor): cor_rgb = color
+        elif isinstance(color, (tuple, list)) and len(color) == 3: cor_rgb = RGBColor(color[0], color[1], color[2])
+        else: print(f"Formato de cor inválido: {color}")
+    tamanho = None
+    if size:
+        try: tamanho = Pt(int(size))
+        except ValueError: print(f"Tamanho de fonte inválido: {size}")
+
+    # Adiciona o texto, um run por trecho comum/itálico
+    for trecho, trecho_italico in (segmentar_italico(text) if segmentos is None else segmentos):
+        run = p.add_run(trecho)
+        if cor_rgb is not None: run.font.color.rgb = cor_rgb
+        if tamanho is not None: run.font.size = tamanho
+        if bold: run.font.bold = True
+        if italic or trecho_italico: run.font.italic = True
+    return p
+
+def adicionar_fragmentos(doc, paragrafos):
+    """Materializa no documento os parágrafos (laudo_secoes.Paragrafo) de uma seção."""
+    for par in paragrafos:
+        if par.texto is None:
+            doc.add_paragraph() # Espaço
+        else:
+            adicionar_paragrafo(doc, par.texto, par.estilo, par.alinhamento, None, par.tamanho, par.negrito, par.italico, par.segmentos)
+
+class ErroImagemLaudo(Exception):
+    """Falha ao processar ou inserir a imagem no laudo."""
+
+def _falha_imagem(erro, ao_erro):
+    """Trata a falha de uma imagem: chama ao_erro(mensagem) ou levanta ErroImagemLaudo."""
+    mensagem = f"Erro ao inserir imagem no docx: {erro}"
+    print(f"Erro detalhado ao inserir imagem: {erro}\n{''.join(traceback.format_exception(type(erro), erro, erro.__traceback__))}")
+    incrementar('laudo_falhas_total', tipo='imagem')
+    registrar_evento('falha_imagem', erro=f"{type(erro).__name__}: {erro}")
+    if ao_erro is None:
+        raise ErroImagemLaudo(mensagem) from erro
+    ao_erro(mensagem)
+
+def _adicionar_figura(doc, preparada):
+    """Adiciona um parágrafo centralizado com a imagem já preparada."""
+    adicionar_figura_xml = getattr(doc, 'adicionar_figura_xml', None)
+    if adicionar_figura_xml is not None:
+        return adicionar_figura_xml(preparada)
+    p = doc.add_paragraph()
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    p.add_run().add_picture(io.BytesIO(preparada.dados), width=Inches(preparada.largura_polegadas))
+
+@etapa()
+def inserir_imagem_docx(doc, image_file_uploader, ao_erro=None):
+    """Insere uma imagem (objeto com getvalue(), ex.: st.file_uploader, ou laudo_uploads.ArquivoEmDisco) no documento docx, centralizada.
+
+    A imagem é reduzida e recomprimida por laudo_imagem.preparar_imagem antes de
+    ser embutida. Em caso de falha chama ao_erro(mensagem), se informado; senão
+    levanta ErroImagemLaudo.
+    """
+    try:
+        if image_file_uploader:
+            from laudo_imagem import preparar_imagem, fonte_imagem # Pillow só é carregado quando há imagem
+            _adicionar_figura(doc, preparar_imagem(fonte_imagem(image_file_uploader)))
+    except Exception as e:
+        _falha_imagem(e, ao_erro)
+
+def obter_ilustracoes(dados_laudo):
+    """Lista as ilustrações do laudo como [(arquivo, itens)].
+
+    Aceita dados_laudo['imagens'] (arquivos ou dicts {'arquivo', 'itens'}, onde
+    itens são referências '1.x') e a chave antiga dados_laudo['imagem'].
+    """
+    imagens = dados_laudo.get('imagens') or []
+    if not imagens and dados_laudo.get('imagem'):
+        imagens = [dados_laudo['imagem']]
+    ilustracoes = []
+    for imagem in imagens:
+        if isinstance(imagem, dict):
+            if imagem.get('arquivo'):
+                ilustracoes.append((imagem['arquivo'], list(imagem.get('itens') or [])))
+        elif imagem:
+            ilustracoes.append((imagem, []))
+    return ilustracoes
+
+def descrever_itens_ilustracao(itens):
+    """Ex.: ['1.1'] -> 'item 1.1'; ['1.1', '1.2'] -> 'itens 1.1 e 1.2'."""
+    if not itens:
+        return ""
+    return f"item {itens[0]}" if len(itens) == 1 else f"itens {' e '.join(itens)}"
+
+def legenda_ilustracao(numero, itens):
+    """Legenda 'Ilustração N: Material(is) recebido(s) (item 1.x).'"""
+    referencia = descrever_itens_ilustracao(itens)
+    return f"Ilustração {numero}: Material(is) recebido(s)" + (f" ({referencia})" if referencia else "") + "."
+
+def legenda_folha_contato(itens_por_quadro):
+    """Legenda da grade: 'Ilustração 1: Material(is) recebido(s) (quadro 1: item 1.1; quadro 2: ...).'"""
+    partes = [f"quadro {quadro}: {descrever_itens_ilustracao(itens)}"
+              for quadro, itens in enumerate(itens_por_quadro, 1) if itens]
+    return "Ilustração 1: Material(is) recebido(s)" + (f" ({'; '.join(partes)})" if partes else "") + "."
+
+@etapa()
+def inserir_ilustracoes_docx(doc, ilustracoes, grade=False, ao_erro=None):
+    """Insere as ilustrações [(arquivo, itens)] com legendas 'Ilustração N' numeradas.
+
+    As imagens são decodificadas e reduzidas em paralelo. Com grade=True e mais
+    de uma imagem, todas são combinadas numa única folha de contato numerada.
+    Imagens com falha são puladas (ao_erro) ou levantam ErroImagemLaudo.
+    """
+    try:
+        from laudo_imagem import preparar_imagens, montar_folha_contato, fonte_imagem # Pillow só é carregado quando há imagem
+        lista_dados = [fonte_imagem(arquivo) for arquivo, _ in ilustracoes] # Arquivos em disco são lidos pelo Pillow
+    except Exception as e:
+        _falha_imagem(e, ao_erro)
+        return
+
+    if grade and len(ilustracoes) > 1:
+        preparada, erros = montar_folha_contato(lista_dados)
+        for _, erro in erros:
+            _falha_imagem(erro, ao_erro)
+        if preparada:
+            posicoes_com_erro = {posicao for posicao, _ in erros}
+            itens_por_quadro = [itens for posicao, (_, itens) in enumerate(ilustracoes, 1) if posicao not in posicoes_com_erro]
+            _adicionar_figura(doc, preparada)
+            adicionar_paragrafo(doc, legenda_folha_contato(itens_por_quadro), style='Ilustracao')
+        return
+
+    numero = 0
+    for (_, itens), (preparada, erro) in zip(ilustracoes, preparar_imagens(lista_dados)):
+        if erro is not None:
+            _falha_imagem(erro, ao_erro)
+            continue
+        numero += 1
+        _adicionar_figura(doc, preparada)
+        # Legenda usa a cor Cinza SPTC e fonte Gadugi definidas no estilo 'Ilustracao'
+        adicionar_paragrafo(doc, legenda_ilustracao(numero, itens), style='Ilustracao')
+
+# --- Funções de Estrutura do Documento DOCX ---
+
+@etapa()
+def configurar_estilos(doc):
+    """Configura os estilos de parágrafo e caractere do documento docx
+       usando a fonte 'Gadugi' e cores institucionais da SPTC/GO."""
+
+    COR_TEXTO_PRINCIPAL = DOCX_COR_PRETO
+    COR_DESTAQUE = DOCX_COR_AZUL_SPTC
+    COR_TEXTO_SECUNDARIO = DOCX_COR_CINZA_SPTC
+
+    def get_or_add_style(doc, style_name, style_type):
+        """Tenta obter um estilo, se não existir, tenta adicioná-lo."""
+        if style_name in doc.styles:
+            return doc.styles[style_name]
+        else:
+            try:
+                return doc.styles.add_style(style_name, style_type)
+            except Exception as e:
+                print(f"Falha ao adicionar estilo '{style_name}': {e}. Usando 'Normal' como fallback.")
+                return doc.styles['Normal'] # Retorna um estilo padrão seguro
+
+    # Estilo Normal (Base)
+    paragrafo_style = doc.styles['Normal']
+    paragrafo_style.font.name = FONTE_PADRAO # Gadugi
+    paragrafo_style.font.size = Pt(12)
+    paragrafo_style.font.color.rgb = COR_TEXTO_PRINCIPAL
+    paragrafo_style.paragraph_format.line_spacing = 1.15
+    paragrafo_style.paragraph_format.space_before = Pt(0)
+    paragrafo_style.paragraph_format.space_after = Pt(8)
+
+    # Estilo para Títulos Principais (Seções)
+    titulo_principal_style = get_or_add_style(doc, 'TituloPrincipal', WD_STYLE_TYPE.PARAGRAPH)
+    titulo_principal_style.base_style = doc.styles['Normal']
+    titulo_principal_style.font.name = FONTE_PADRAO # Gadugi
+    titulo_principal_style.font.size = Pt(14)
+    titulo_principal_style.font.bold = True
+    titulo_principal_style.font.color.rgb = COR_DESTAQUE # Azul SPTC
+    titulo_principal_style.paragraph_format.space_before = Pt(12)
+    titulo_principal_style.paragraph_format.space_after = Pt(6)
+
+    # Estilo para Títulos Secundários (Subseções)
+    titulo_secundario_style = get_or_add_style(doc, 'TituloSecundario', WD_STYLE_TYPE.PARAGRAPH)
+    titulo_secundario_style.base_style = doc.styles['Normal']
+    titulo_secundario_style.font.name = FONTE_PADRAO # Gadugi
+    titulo_secundario_style.font.size = Pt(12)
+    titulo_secundario_style.font.bold = True
+    titulo_secundario_style.font.color.rgb = COR_DESTAQUE # Azul SPTC
+    titulo_secundario_style.paragraph_format.space_before = Pt(10)
+    titulo_secundario_style.paragraph_format.space_after = Pt(4)
+
+    # Estilo para Legendas de Ilustrações
+    ilustracao_style = get_or_add_style(doc, 'Ilustracao', WD_STYLE_TYPE.PARAGRAPH)
+    ilustracao_style.base_style = doc.styles['Normal']
+    ilustracao_style.font.name = FONTE_PADRAO # Gadugi
+    ilustracao_style.font.size = Pt(10) # Tamanho menor para legenda
+    ilustracao_style.font.italic = True
+    ilustracao_style.font.color.rgb = COR_TEXTO_SECUNDARIO # Cinza SPTC
+    ilustracao_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    ilustracao_style.paragraph_format.space_before = Pt(4)
+    ilustracao_style.paragraph_format.space_after = Pt(10)
+
+def configurar_pagina(doc):
+    """Configura margens da página (padrão ABNT)."""
+    for section in doc.sections:
+        section.page_height = Inches(11.69) # A4 Altura
+        section.page_width = Inches(8.27)  # A4 Largura
+        section.top_margin = Inches(1.18)  # 3 cm
+        section.bottom_margin = Inches(0.79) # 2 cm
+        section.left_margin = Inches(1.18)   # 3 cm
+        section.right_margin = Inches(0.79)  # 2 cm
+
+def adicionar_cabecalho_rodape(doc):
+    """Adiciona cabeçalho e rodapé padrão ao documento docx."""
+    FONTE_CABECALHO_RODAPE = FONTE_PADRAO # Usar Gadugi aqui também
+    TAMANHO_CABECALHO_RODAPE = Pt(10)
+
+    section = doc.sections[0] # Assume que há pelo menos uma seção
+
+    # --- Cabeçalho ---
+    header = section.header
+    # Limpa cabeçalho existente para evitar duplicação
+    if header.paragraphs:
+        for para in header.paragraphs:
+            p_element = para._element
+            if p_element.getparent() is not None:
+                p_element.getparent().remove(p_element)
+
+    # Adiciona novo cabeçalho
+    header_paragraph = header.add_paragraph()
+    run_header_left = header_paragraph.add_run("POLÍCIA CIENTÍFICA DE GOIÁS")
+    run_header_left.font.name = FONTE_CABECALHO_RODAPE
+    run_header_left.font.size = TAMANHO_CABECALHO_RODAPE
+    run_header_left.font.bold = True
+    header_paragraph.add_run("\t\t") # Usar tabulação para espaçar
+    run_header_right = header_paragraph.add_run("LAUDO DE PERÍCIA CRIMINAL")
+    run_header_right.font.name = FONTE_CABECALHO_RODAPE
+    run_header_right.font.size = TAMANHO_CABECALHO_RODAPE
+    run_header_right.font.bold = False
+    header_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT # Alinhado à direita fica melhor
+
+    # --- Rodapé (Numeração de Página) ---
+    footer = section.footer
+    # Limpa rodapé existente
+    if footer.paragraphs:
+        for para in footer.paragraphs:
+             p_element = para._element
+             if p_element.getparent() is not None:
+                 p_element.getparent().remove(p_element)
+    # Adiciona parágrafo para numeração
+    page_num_paragraph = footer.add_paragraph()
+    page_num_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    # Adiciona "Página X"
+    run_page = page_num_paragraph.add_run("Página ")
+    run_page.font.name = FONTE_CABECALHO_RODAPE
+    run_page.font.size = TAMANHO_CABECALHO_RODAPE
+    # Campo PAGE
+    fld_char_begin = OxmlElement('w:fldChar')
+    fld_char_begin.set(qn('w:fldCharType'), 'begin')
+    run_page._r.append(fld_char_begin)
+    instr_text = OxmlElement('w:instrText')
+    instr_text.set(qn('xml:space'), 'preserve')
+    instr_text.text = 'PAGE \* MERGEFORMAT'
+    run_page._r.append(instr_text)
+    fld_char_sep = OxmlElement('w:fldChar')
+    fld_char_sep.set(qn('w:fldCharType'), 'separate')
+    run_page._r.append(fld_char_sep)
+    fld_char_end = OxmlElement('w:fldChar')
+    fld_char_end.set(qn('w:fldCharType'), 'end')
+    run_page._r.append(fld_char_end)
+
+    # Adiciona " de Y"
+    run_num_pages = page_num_paragraph.add_run(" de ")
+    run_num_pages.font.name = FONTE_CABECALHO_RODAPE
+    run_num_pages.font.size = TAMANHO_CABECALHO_RODAPE
+    # Campo NUMPAGES
+    fld_char_begin_np = OxmlElement('w:fldChar')
+    fld_char_begin_np.set(qn('w:fldCharType'), 'begin')
+    run_num_pages._r.append(fld_char_begin_np)
+    instr_text_np = OxmlElement('w:instrText')
+    instr_text_np.set(qn('xml:space'), 'preserve')
+    instr_text_np.text = 'NUMPAGES \* MERGEFORMAT'
+    run_num_pages._r.append(instr_text_np)
+    fld_char_sep_np = OxmlElement('w:fldChar')
+    fld_char_sep_np.set(qn('w:fldCharType'), 'separate')
+    run_num_pages._r.append(fld_char_sep_np)
+    fld_char_end_np = OxmlElement('w:fldChar')
+    fld_char_end_np.set(qn('w:fldCharType'), 'end')
+    run_num_pages._r.append(fld_char_end_np)
+
+# --- Cache do Modelo Base (estilos + página + cabeçalho/rodapé) ---
+# Montado uma vez por processo e copiado (deepcopy da árvore lxml) para cada laudo.
+_template_base = {'chave': None, 'documento': None}
+_template_lock = threading.Lock()
+
+def chave_template_base():
+    """Chave do modelo base: muda quando a fonte ou as cores DOCX_COR_* mudam."""
+    return (FONTE_PADRAO, tuple(DOCX_COR_AZUL_SPTC), tuple(DOCX_COR_CINZA_SPTC), tuple(DOCX_COR_PRETO))
+
+@etapa()
+def mapear_estilos_paragrafo(document):
+    """Nome -> style_id dos estilos de parágrafo; None para o estilo padrão (como em Paragraph.style)."""
+    padrao = document.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+    return {estilo.name: (None if padrao is not None and estilo.style_id == padrao.style_id else estilo.style_id)
+            for estilo in document.styles if estilo.type == WD_STYLE_TYPE.PARAGRAPH}
+
+@etapa()
+def montar_template_base():
+    """Cria o documento base já com estilos, página e cabeçalho/rodapé."""
+    document = Document()
+    configurar_estilos(document) # Configura estilos COM fonte Gadugi e cores SPTC
+    configurar_pagina(document)
+    adicionar_cabecalho_rodape(document)
+    # Vai junto em cada deepcopy do modelo e é usado por adicionar_paragrafo
+    document.part.estilos_laudo = mapear_estilos_paragrafo(document)
+    return document
+
+def obter_template_base():
+    """Retorna o modelo base em cache, remontando-o se as constantes de estilo mudaram."""
+    chave = chave_template_base()
+    with _template_lock:
+        if _template_base['chave'] != chave:
+            _template_base['documento'] = montar_template_base()
+            _template_base['chave'] = chave
+        return _template_base['documento']
+
+@etapa()
+def novo_documento_laudo():
+    """Retorna uma cópia independente do modelo base para um novo laudo."""
+    return copy.deepcopy(obter_template_base())
+
+def limpar_cache_template():
+    """Descarta o modelo base em cache (será remontado no próximo uso)."""
+    with _template_lock:
+        _template_base['chave'] = None
+        _template_base['documento'] = None
+
+# --- Funções das Seções do Laudo (Numeração e Conteúdo Ajustados) ---
+
+def texto_item(item_num_str, item):
+    """'1.1 3 (três) porções de material ..., acondicionadas, individualmente, em ...' de um item."""
+    qtd = item.get('qtd', 1)
+    descricao = descricao_item(item.get('tipo_mat', ''), item.get('emb', ''), item.get('cor_emb'), qtd)
+    ref_texto = f", relacionada a {item['pessoa']}" if item.get('pessoa') else ""
+    subitem_ref = item.get('ref', '')
+    # Texto adaptado do código Colab original
+    subitem_texto = f", referente à amostra do subitem {subitem_ref} do laudo de constatação supracitado" if subitem_ref else ""
+    return f"{item_num_str} {qtd} ({obter_quantidade_extenso(qtd)}) {descricao}{subitem_texto}{ref_texto}."
+
+def agrupar_itens_identicos(itens):
+    """[(números 1.x, itens)] agrupando itens de mesmo material, embalagem, cor e pessoa, na ordem da primeira ocorrência."""
+    grupos = {}
+    for i, item in enumerate(itens):
+        emb = item.get('emb', '')
+        cor = item.get('cor_emb') if emb in EMBALAGENS_COM_COR else None
+        numeros, grupo = grupos.setdefault((item.get('tipo_mat', ''), emb, cor or None, item.get('pessoa') or ''), ([], []))
+        numeros.append(f"1.{i + 1}")
+        grupo.append(item)
+    return list(grupos.values())
+
+def texto_grupo_itens(numeros, grupo):
+    """Parágrafo de um grupo de itens idênticos, com as quantidades somadas e as referências em intervalos."""
+    if len(grupo) == 1:
+        return texto_item(numeros[0], grupo[0])
+    primeiro = grupo[0]
+    qtd = sum(item.get('qtd', 1) for item in grupo)
+    descricao = descricao_item(primeiro.get('tipo_mat', ''), primeiro.get('emb', ''), primeiro.get('cor_emb'), qtd)
+    subitens = ordenar_referencias(dict.fromkeys(item['ref'] for item in grupo if item.get('ref')))
+    if len(subitens) == 1:
+        subitem_texto = f", referente à amostra do subitem {subitens[0]} do laudo de constatação supracitado"
+    elif subitens:
+        subitem_texto = (f", referentes às amostras dos subitens {descrever_referencias(subitens, True)[0]} "
+                         f"do laudo de constatação supracitado")
+    else:
+        subitem_texto = ""
+    ref_texto = f", relacionadas a {primeiro['pessoa']}" if primeiro.get('pessoa') else ""
+    itens_texto = descrever_referencias(numeros, True)[0]
+    return f"Itens {itens_texto}: {qtd} ({obter_quantidade_extenso(qtd)}) {descricao}{subitem_texto}{ref_texto}."
+
+@etapa()
+def adicionar_material_recebido(doc, dados_laudo, ao_erro_imagem=None):
+    """Adiciona a seção '1 MATERIAL RECEBIDO PARA EXAME' ao laudo docx."""
+    # Numeração corrigida para 1.
+    adicionar_paragrafo(doc, "1 MATERIAL RECEBIDO PARA EXAME", style='TituloPrincipal')
+    # Texto introdutório pode ser adicionado aqui se desejado. Ex:
+    # adicionar_paragrafo(doc, "O material foi recebido neste Instituto devidamente acondicionado e lacrado.", align='justify', style='Normal')
+
+    ilustracoes = obter_ilustracoes(dados_laudo)
+    if ilustracoes:
+        inserir_ilustracoes_docx(doc, ilustracoes, grade=dados_laudo.get('ilustracao_grade', False), ao_erro=ao_erro_imagem)
+
+    if not dados_laudo.get('itens'):
+        adicionar_paragrafo(doc, "Nenhum item de material foi descrito para exame.", style='Normal')
+        return {}
+
+    itens = dados_laudo['itens']
+    if dados_laudo.get('agrupar_itens'):
+        # Grandes apreensões: um parágrafo por grupo de itens idênticos ("Itens 1.1 a 1.250: ...")
+        for numeros, grupo in agrupar_itens_identicos(itens):
+            adicionar_paragrafo(doc, texto_grupo_itens(numeros, grupo), style='Normal', align='justify')
+    else:
+        for i, item in enumerate(itens):
+            adicionar_paragrafo(doc, texto_item(f"1.{i + 1}", item), style='Normal', align='justify')
+
+    # Mapeamento para Exames/Resultados/Conclusão: {substância: {subitem: '1.x'}}, pelo índice do catálogo
+    return classificar(itens)
+
+def referencias_ordenadas(subitens):
+    """Referências 1.x de uma substância, em ordem numérica ('1.2' antes de '1.10'), como chave das seções em cache."""
+    return ordenar_referencias(subitens.values())
+
+def substancias_presentes(subitens):
+    """Ids das substâncias de subitens (ver classificar), na ordem do catálogo."""
+    por_id = catalogo().por_id
+    return tuple(sorted(subitens, key=lambda id_substancia: por_id[id_substancia].ordem))
+
+def referencias_por_substancia(subitens):
+    """Pares (id, referências 1.x ordenadas), na ordem do catálogo, como chave das seções em cache."""
+    return tuple((id_substancia, referencias_ordenadas(subitens[id_substancia])) for id_substancia in substancias_presentes(subitens))
+
+@etapa()
+def adicionar_objetivo_exames(doc):
+    """Adiciona a seção '2 OBJETIVO DOS EXAMES' (Texto do Colab)."""
+    adicionar_fragmentos(doc, secao_objetivo_exames())
+
+@etapa()
+def adicionar_exames(doc, subitens, dados_laudo):
+    """Adiciona a seção '3 EXAMES' (Texto e lógica do Colab)."""
+    adicionar_fragmentos(doc, secao_exames(substancias_presentes(subitens), bool(dados_laudo.get('itens'))))
+
+@etapa()
+def adicionar_resultados(doc, subitens, dados_laudo):
+    """Adiciona a seção '4 RESULTADOS' (Texto e lógica do Colab)."""
+    adicionar_fragmentos(doc, secao_resultados(referencias_por_substancia(subitens), bool(dados_laudo.get('itens')),
+                                               bool(dados_laudo.get('agrupar_itens'))))
+
+@etapa()
+def adicionar_conclusao(doc, subitens, dados_laudo):
+    """Adiciona a seção '5 CONCLUSÃO' (Texto e lógica do Colab)."""
+    adicionar_fragmentos(doc, secao_conclusao(referencias_por_substancia(subitens), bool(dados_laudo.get('itens')),
+                                              bool(dados_laudo.get('agrupar_itens'))))
+
+@etapa()
+def adicionar_custodia_material(doc, dados_laudo):
+    """Adiciona a seção '6 CUSTÓDIA DO MATERIAL' (Texto do Colab, com Lacre do input)."""
+    # Pega o lacre do estado da sessão (que veio do input do Streamlit)
+    lacre = dados_laudo.get('lacre', '_______') # Usa placeholder se não informado
+    adicionar_fragmentos(doc, secao_custodia_material(lacre))
+
+@etapa()
+def adicionar_referencias(doc, subitens):
+    """Adiciona a seção 'REFERÊNCIAS' (Texto e lógica do Colab)."""
+    adicionar_fragmentos(doc, secao_referencias(substancias_presentes(subitens)))
+
+@etapa()
+def adicionar_encerramento_assinatura(doc):
+    """Adiciona a frase de encerramento, data, local e a assinatura do perito (formato Colab)."""
+    # Frase de encerramento pode ser omitida ou adaptada se preferir o "É o laudo."
+    # adicionar_paragrafo(doc, "\nÉ o laudo. Nada mais havendo a lavrar, encerra-se o presente.", style='Normal', align='justify')
+
+    adicionar_fragmentos(doc, secao_encerramento_assinatura(data_formatada_laudo()))
+
+def data_formatada_laudo():
+    """Data e local do encerramento, no fuso de Brasília: 'Goiânia, 1 de maio de 2025.'"""
+    try:
+        hoje = datetime.now(fuso_horario()) # pytz importado só quando a data é necessária
+    except Exception:
+        hoje = datetime.now() # Fallback
+    mes_atual = meses_portugues.get(hoje.month, f"Mês {hoje.month}")
+    # Formato da data e local do código Colab
+    return f"Goiânia, {hoje.day} de {mes_atual} de {hoje.year}."
+
+# --- Função Principal de Geração do DOCX ---
+
+def gerar_laudo_docx(dados_laudo, ao_erro_imagem=None, backend=None):
+    """Gera o laudo completo em formato docx.
+
+    ao_erro_imagem: callback(mensagem) para falhas na imagem; se None, a falha
+    levanta ErroImagemLaudo.
+    backend: 'docx' (Document do python-docx), 'ooxml' (laudo_ooxml.LaudoOOXML,
+    mais rápido) ou 'fluxo' (laudo_ooxml.LaudoOOXMLFluxo, memória constante);
+    padrão: ver escolher_backend. Todos oferecem save(destino); depois de
+    salvar, fechar_documento(document) libera o arquivo temporário do 'fluxo'.
+    """
+    pedido, backend = backend, escolher_backend(dados_laudo, backend)
+    if not pedido and backend == 'fluxo':
+        n_itens = len(dados_laudo.get('itens') or ())
+        print(f"Laudo com {n_itens} itens (LAUDO_LIMIAR_FLUXO={LIMIAR_ITENS_FLUXO}): usando o backend 'fluxo'.")
+        registrar_evento('backend_fluxo', rg_pericia=dados_laudo.get('rg_pericia'), itens=n_itens,
+                         limiar=LIMIAR_ITENS_FLUXO)
+    inicio = time.perf_counter()
+    with medicao() as etapas:
+        try:
+            document = _montar_laudo(dados_laudo, ao_erro_imagem, backend)
+        except Exception as e:
+            incrementar('laudo_falhas_total', tipo='laudo')
+            registrar_evento('falha_laudo', rg_pericia=dados_laudo.get('rg_pericia'), backend=backend,
+                             erro=f"{type(e).__name__}: {e}")
+            raise
+    segundos = time.perf_counter() - inicio
+    n_itens = len(dados_laudo.get('itens') or [])
+    incrementar('laudo_laudos_total', backend=backend)
+    incrementar('laudo_itens_total', n_itens)
+    registrar_evento('laudo_gerado', rg_pericia=dados_laudo.get('rg_pericia'), backend=backend, itens=n_itens,
+                     ms=round(segundos * 1000, 3), etapas_ms={nome: round(t * 1000, 3) for nome, t in etapas.items()})
+    return document
+
+def escolher_backend(dados_laudo, backend=None):
+    """O backend pedido; sem pedido, BACKEND_PADRAO ('fluxo' a partir de LIMIAR_ITENS_FLUXO itens, se configurado)."""
+    if backend:
+        return backend
+    if LIMIAR_ITENS_FLUXO and len(dados_laudo.get('itens') or ()) >= LIMIAR_ITENS_FLUXO:
+        return 'fluxo'
+    return BACKEND_PADRAO
+
+def fechar_documento(document):
+    """Libera os recursos do documento após save() (o arquivo temporário do 'fluxo'); nos demais não faz nada."""
+    fechar = getattr(document, 'close', None)
+    if fechar is not None:
+        fechar()
+
+@etapa('gerar_laudo_docx')
+def _montar_laudo(dados_laudo, ao_erro_imagem, backend):
+    """Cria o documento no backend escolhido e adiciona as seções."""
+    if backend == 'ooxml':
+        from laudo_ooxml import novo_documento_ooxml
+        document = novo_documento_ooxml()
+    elif backend == 'fluxo':
+        # Corpo gravado no zip (arquivo temporário) durante o laço dos itens
+        from laudo_ooxml import novo_documento_fluxo
+        document = novo_documento_fluxo()
+    elif backend == 'docx':
+        # Cópia do modelo base com estilos (Gadugi + cores SPTC), página e cabeçalho/rodapé
+        document = novo_documento_laudo()
+    else:
+        raise ValueError(f"Backend desconhecido: '{backend}' (use {', '.join(BACKENDS_LAUDO)})")
+
+    # Adiciona Seções na Ordem Correta usando as funções modificadas
+    try:
+        subitens = adicionar_material_recebido(document, dados_laudo, ao_erro_imagem)
+        adicionar_objetivo_exames(document)
+        adicionar_exames(document, subitens, dados_laudo)
+        adicionar_resultados(document, subitens, dados_laudo)
+        adicionar_conclusao(document, subitens, dados_laudo)
+        adicionar_custodia_material(document, dados_laudo) # Passa dados_laudo para pegar o lacre
+        adicionar_referencias(document, subitens)
+        adicionar_encerramento_assinatura(document)
+    except BaseException:
+        fechar_documento(document) # Quem chamou não recebe o documento: o 'fluxo' libera o temporário aqui
+        raise
+
+    return document
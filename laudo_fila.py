@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Fila de geração de laudos compartilhada pelas sessões da interface.
+
+Em vez de gerar o laudo na thread do script do Streamlit (bloqueando os
+reruns da sessão e usando um núcleo por vez), a interface submete o pedido a
+FilaGeracao, que o executa num pool de processos do servidor e devolve uma
+Tarefa para acompanhar (posição na fila, tempo estimado, resultado).
+
+    - Deduplicação (single-flight): pedidos com a mesma chave_laudo (hash do
+      conteúdo) enquanto o primeiro ainda está na fila ou em geração viram
+      uma única tarefa; todas as sessões recebem o mesmo resultado. Pronto,
+      o laudo vai para o cache compartilhado, e os pedidos seguintes nem
+      chegam à fila.
+    - Justiça entre usuários: cada usuário (sessão) tem sua fila e o
+      despacho é em rodízio, um pedido de cada usuário por vez.
+    - Limites: no máximo LAUDO_FILA_MAX pedidos pendentes no total e
+      LAUDO_FILA_MAX_POR_USUARIO por usuário (FilaGeracaoCheia).
+
+Só 'processos' tarefas vão ao pool ao mesmo tempo; as demais esperam aqui,
+onde a ordem ainda pode ser decidida. As métricas dos trabalhadores voltam
+com o resultado e são somadas às do processo da interface.
+
+Uso:
+    fila = fila_padrao()
+    tarefa = fila.submeter(dados_laudo, chave=chave, usuario=id_da_sessao)
+    fila.posicao(tarefa), tarefa.estado        # 3, 'fila' ... 0, 'gerando' ... 'pronta'
+    entrada = tarefa.resultado()               # EntradaLaudo
+"""
+
+import atexit
+import functools
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import laudo_metricas
+from laudo_metricas import HISTOGRAMA_ETAPAS, definir, incrementar, observar
+
+# --- Configuração ---
+PROCESSOS_FILA = int(os.environ.get('LAUDO_FILA_PROCESSOS', '0')) or os.cpu_count() or 1
+MAX_PENDENTES = int(os.environ.get('LAUDO_FILA_MAX', '0')) or PROCESSOS_FILA * 8
+MAX_POR_USUARIO = int(os.environ.get('LAUDO_FILA_MAX_POR_USUARIO', '2'))
+AMOSTRAS_DURACAO = 20 # Gerações recentes usadas na estimativa de tempo
+
+class FilaGeracaoCheia(Exception):
+    """Pedido recusado: fila cheia ou usuário com pedidos demais pendentes."""
+
+# --- Processo Trabalhador ---
+
+def _aquecer_trabalhador():
+    """Inicializador do pool: carrega os recursos e gera um laudo descartável antes do primeiro laudo."""
+    from laudo_recursos import aquecer
+    aquecer(interface=False)
+
+def _nada():
+    """Tarefa vazia: só faz o pool subir um processo (que aquece no inicializador)."""
+
+def _gerar_no_trabalhador(dados_laudo, backend):
+    """Executa no processo trabalhador. Retorna (EntradaLaudo, métricas extraídas do processo)."""
+    from laudo_cache import gerar_entrada
+    entrada = gerar_entrada(dados_laudo, backend)
+    return entrada, laudo_metricas.extrair()
+
+# --- Tarefas ---
+
+class Tarefa:
+    """Um pedido de laudo na fila: chave, usuário, estado e o resultado (EntradaLaudo) quando pronto."""
+
+    def __init__(self, chave, dados_laudo, backend, usuario):
+        self.chave = chave
+        self.usuario = usuario
+        self.backend = backend
+        self.dados = dados_laudo # Liberado ao concluir
+        self.assinantes = 1 # Pedidos idênticos atendidos por esta tarefa
+        self.criada = time.monotonic()
+        self.iniciada = None
+        self.concluida = None
+        self._futuro = Future()
+
+    @property
+    def estado(self):
+        """'fila', 'gerando', 'pronta' ou 'erro'."""
+        if self._futuro.done():
+            return 'erro' if self._futuro.exception() is not None else 'pronta'
+        return 'gerando' if self.iniciada is not None else 'fila'
+
+    def resultado(self, timeout=None):
+        """EntradaLaudo (espera até 'timeout' segundos); levanta a exceção da geração, se houve."""
+        return self._futuro.result(timeout)
+
+    def __repr__(self):
+        return f"Tarefa({self.chave[:12]}, {self.usuario!r}, {self.estado})"
+
+class FilaGeracao:
+    """Fila de laudos com deduplicação por chave e rodízio entre usuários, executada num pool de processos."""
+
+    def __init__(self, processos=None, max_pendentes=None, max_por_usuario=None, compartilhado=None):
+        self.processos = processos or PROCESSOS_FILA
+        # Cache (CacheLaudos) onde o laudo pronto entra na hora, antes de a sessão que pediu buscá-lo
+        self.compartilhado = compartilhado
+        self.max_pendentes = max_pendentes or MAX_PENDENTES
+        self.max_por_usuario = max_por_usuario or MAX_POR_USUARIO
+        self._filas = OrderedDict() # usuário -> deque de Tarefa; o primeiro usuário é o próximo atendido
+        self._pendentes = {} # chave -> Tarefa (na fila ou em geração)
+        self._gerando = 0
+        self._duracoes = deque(maxlen=AMOSTRAS_DURACAO)
+        self._executor = None
+        # RLock: o callback do futuro pode rodar na própria thread que submeteu
+        self._lock = threading.RLock()
+        self._encerrada = False
+
+    def _obter_executor(self):
+        if self._executor is None:
+            # forkserver: o servidor do Streamlit tem várias threads, e fork() copiaria locks em uso
+            metodos = multiprocessing.get_all_start_methods()
+            contexto = multiprocessing.get_context('forkserver' if 'forkserver' in metodos else 'spawn')
+            if contexto.get_start_method() == 'forkserver':
+                # O servidor já importa o gerador (e não o __main__, que pode ser um script sem guarda)
+                contexto.set_forkserver_preload(['laudo_cache', 'laudo_docx'])
+            self._executor = ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto,
+                                                 initializer=_aquecer_trabalhador)
+        return self._executor
+
+    def submeter(self, dados_laudo, chave=None, backend=None, usuario=''):
+        """Enfileira o laudo (ou se junta ao pedido idêntico pendente) e devolve a Tarefa.
+
+        Levanta FilaGeracaoCheia se a fila ou a cota do usuário estiverem cheias.
+        """
+        if chave is None:
+            from laudo_cache import chave_laudo
+            chave = chave_laudo(dados_laudo, backend)
+        with self._lock:
+            if self._encerrada:
+                raise RuntimeError("fila de geração encerrada")
+            existente = self._pendentes.get(chave)
+            if existente is not None:
+                existente.assinantes += 1
+                incrementar('laudo_fila_total', resultado='deduplicado')
+                return existente
+            if len(self._pendentes) >= self.max_pendentes:
+                incrementar('laudo_fila_total', resultado='recusado')
+                raise FilaGeracaoCheia(f"fila de geração cheia ({self.max_pendentes} laudos pendentes)")
+            if sum(1 for pendente in self._pendentes.values() if pendente.usuario == usuario) >= self.max_por_usuario:
+                incrementar('laudo_fila_total', resultado='recusado')
+                raise FilaGeracaoCheia(f"já há {self.max_por_usuario} laudos seus pendentes na fila")
+            tarefa = Tarefa(chave, dados_laudo, backend, usuario)
+            self._pendentes[chave] = tarefa
+            self._filas.setdefault(usuario, deque()).append(tarefa)
+            incrementar('laudo_fila_total', resultado='enfileirado')
+            self._despachar()
+        self._atualizar_metricas()
+        return tarefa
+
+    def _despachar(self):
+        """Envia tarefas ao pool enquanto há processo livre, em rodízio entre os usuários (chamar com _lock)."""
+        while self._gerando < self.processos and self._filas:
+            usuario, fila = next(iter(self._filas.items()))
+            tarefa = fila.popleft()
+            del self._filas[usuario] # O usuário atendido vai para o fim do rodízio
+            if fila:
+                self._filas[usuario] = fila
+            self._gerando += 1
+            tarefa.iniciada = time.monotonic()
+            observar(HISTOGRAMA_ETAPAS, tarefa.iniciada - tarefa.criada, etapa='fila_laudo')
+            executor = self._obter_executor()
+            try:
+                futuro = executor.submit(_gerar_no_trabalhador, tarefa.dados, tarefa.backend)
+            except Exception as e: # Pool quebrado (trabalhador morto)
+                self._descartar_executor_quebrado(executor, e)
+                futuro = Future()
+                futuro.set_exception(e)
+            futuro.add_done_callback(functools.partial(self._ao_concluir, tarefa, executor))
+
+    def _descartar_executor_quebrado(self, executor, erro):
+        """Descarta o pool quebrado (recriado no próximo despacho); só se ainda for o atual (chamar com _lock)."""
+        if isinstance(erro, BrokenProcessPool) and self._executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _ao_concluir(self, tarefa, executor, futuro):
+        erro = futuro.exception() if not futuro.cancelled() else RuntimeError("geração cancelada")
+        entrada = None
+        if erro is None:
+            entrada, metricas = futuro.result()
+            laudo_metricas.mesclar(metricas)
+        tarefa.concluida = time.monotonic()
+        with self._lock:
+            if erro is not None:
+                self._descartar_executor_quebrado(executor, erro)
+            else:
+                self._duracoes.append(tarefa.concluida - tarefa.iniciada)
+            self._gerando -= 1
+            if self._pendentes.get(tarefa.chave) is tarefa:
+                del self._pendentes[tarefa.chave]
+            tarefa.dados = None
+            if not self._encerrada:
+                self._despachar()
+        incrementar('laudo_fila_total', resultado='erro' if erro is not None else 'ok')
+        if erro is not None:
+            incrementar('laudo_falhas_total', tipo='laudo')
+            tarefa._futuro.set_exception(erro)
+        else:
+            if self.compartilhado is not None:
+                self.compartilhado.guardar(tarefa.chave, entrada)
+            tarefa._futuro.set_result(entrada)
+        self._atualizar_metricas()
+
+    def posicao(self, tarefa):
+        """Posição da tarefa na ordem de despacho (1 = a próxima); 0 se já está em geração ou concluída."""
+        with self._lock:
+            if tarefa.iniciada is not None:
+                return 0
+            filas = [list(fila) for fila in self._filas.values()]
+        posicao = 0
+        for rodada in range(max((len(fila) for fila in filas), default=0)):
+            for fila in filas:
+                if rodada < len(fila):
+                    posicao += 1
+                    if fila[rodada] is tarefa:
+                        return posicao
+        return 0
+
+    def estimativa(self, tarefa):
+        """Segundos estimados até a tarefa ficar pronta (None sem histórico de gerações)."""
+        with self._lock:
+            if not self._duracoes:
+                return None
+            media = statistics.fmean(self._duracoes)
+        if tarefa.concluida is not None:
+            return 0.0
+        if tarefa.iniciada is not None:
+            return max(0.0, media - (time.monotonic() - tarefa.iniciada))
+        # À frente: posicao - 1 tarefas, processadas em lotes de 'processos', mais a própria geração
+        return ((self.posicao(tarefa) - 1) // self.processos + 1) * media + media / 2
+
+    def aquecer(self):
+        """Sobe agora todos os processos do pool, em vez de no primeiro laudo de cada um; espera terminarem."""
+        with self._lock:
+            if self._encerrada:
+                return
+            executor = self._obter_executor()
+        # O pool só cria um processo novo quando não há nenhum livre: 'processos' tarefas simultâneas sobem todos
+        futuros = [executor.submit(_nada) for _ in range(self.processos)]
+        wait(futuros)
+
+    def estado(self):
+        with self._lock:
+            return {
+                'processos': self.processos,
+                'gerando': self._gerando,
+                'na_fila': sum(len(fila) for fila in self._filas.values()),
+                'usuarios_na_fila': len(self._filas),
+                'media_s': round(statistics.fmean(self._duracoes), 3) if self._duracoes else None,
+            }
+
+    def _atualizar_metricas(self):
+        estado = self.estado()
+        definir('laudo_fila_gerando', estado['gerando'])
+        definir('laudo_fila_aguardando', estado['na_fila'])
+
+    def encerrar(self):
+        """Recusa novos pedidos, cancela os que aguardam e encerra o pool."""
+        with self._lock:
+            self._encerrada = True
+            aguardando = [tarefa for fila in self._filas.values() for tarefa in fila]
+            self._filas.clear()
+            for tarefa in aguardando:
+                self._pendentes.pop(tarefa.chave, None)
+            executor, self._executor = self._executor, None
+        for tarefa in aguardando:
+            tarefa._futuro.set_exception(RuntimeError("fila de geração encerrada"))
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.encerrar()
+
+# Fila do processo (interface): criada no primeiro uso, compartilhada pelas sessões
+_fila_padrao = None
+_fila_padrao_lock = threading.Lock()
+
+def fila_padrao():
+    """FilaGeracao compartilhada pelo processo, com as configurações das variáveis de ambiente."""
+    global _fila_padrao
+    with _fila_padrao_lock:
+        if _fila_padrao is None:
+            from laudo_cache import cache_compartilhado
+            _fila_padrao = FilaGeracao(compartilhado=cache_compartilhado)
+            atexit.register(_fila_padrao.encerrar)
+        return _fila_padrao
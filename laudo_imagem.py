@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Pré-processamento das imagens (ilustrações) antes de inseri-las no laudo DOCX.
+
+Fotos de celular vêm com 12+ megapixels e EXIF; no laudo elas são impressas
+com no máximo 6 polegadas de largura. Aqui a imagem é reduzida para a
+resolução de impressão desejada (DPI_ALVO), recomprimida em JPEG e gravada
+sem EXIF (a orientação é aplicada aos pixels antes). JPEGs são decodificados
+em modo draft, já em escala reduzida pelo libjpeg.
+
+Os resultados ficam num cache LRU indexado pelo hash do conteúdo, de modo que
+gerar de novo o mesmo laudo não processa a imagem outra vez.
+
+As funções aceitam os bytes da imagem ou um arquivo em disco (objeto com
+'caminho' e 'sha256', ver laudo_uploads.ArquivoEmDisco): este é lido aos
+poucos pelo Pillow, sem carregar o original inteiro na memória.
+
+Várias ilustrações são processadas em paralelo numa pool de threads (o Pillow
+libera o GIL ao decodificar, redimensionar e codificar) e podem ainda ser
+combinadas numa folha de contato (grade) embutida como uma única imagem.
+"""
+
+import hashlib
+import io
+import math
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from laudo_metricas import etapa, incrementar
+
+# --- Configuração ---
+LARGURA_MAXIMA_POLEGADAS = 6.0 # Largura máxima A4 menos margens
+DPI_ALVO = 200 # Resolução de impressão: 6" x 200 dpi = 1200 px de largura
+QUALIDADE_JPEG = 85
+LADO_PREVIA = 320 # Lado maior (px) das prévias guardadas na sessão
+QUALIDADE_PREVIA = 70
+DPI_PADRAO = 96 # Usado quando a imagem não informa DPI
+CACHE_MAX_BYTES = 64 * 1024 * 1024 # Soma máxima das imagens processadas em cache
+THREADS_IMAGEM = min(8, os.cpu_count() or 1) # Threads para processar várias imagens
+ESPACO_GRADE_PX = 12 # Espaço entre os quadros da folha de contato
+PROPORCAO_QUADRO = 3 / 4 # Altura/largura de cada quadro da folha de contato
+
+# Orientações EXIF que trocam largura e altura (rotação de 90/270 graus)
+_ORIENTACOES_TRANSPOSTAS = (5, 6, 7, 8)
+_TAG_ORIENTACAO = 0x0112
+
+ImagemPreparada = namedtuple('ImagemPreparada', ['dados', 'largura_px', 'altura_px', 'largura_polegadas', 'dpi'])
+
+_cache = OrderedDict() # chave -> ImagemPreparada (mais recente no fim)
+_cache_bytes = [0]
+_cache_lock = threading.Lock()
+
+def fonte_imagem(arquivo):
+    """O que passar às funções deste módulo: o próprio arquivo em disco ou os bytes (getvalue())."""
+    if hasattr(arquivo, 'caminho'):
+        return arquivo
+    return arquivo if isinstance(arquivo, (bytes, bytearray)) else arquivo.getvalue()
+
+def _abrir(dados):
+    """Image.open dos bytes ou do arquivo em disco (lido sob demanda)."""
+    return Image.open(dados.caminho if hasattr(dados, 'caminho') else io.BytesIO(dados))
+
+def _digest(dados):
+    return bytes.fromhex(dados.sha256) if hasattr(dados, 'sha256') else hashlib.sha256(dados).digest()
+
+def _tamanho(dados):
+    return dados.tamanho if hasattr(dados, 'tamanho') else len(dados)
+
+def _para_rgb(img):
+    """Converte para RGB, compondo a transparência sobre fundo branco."""
+    if img.mode == 'RGB':
+        return img
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        fundo = Image.new('RGB', img.size, (255, 255, 255))
+        fundo.paste(img, mask=img.getchannel('A'))
+        return fundo
+    return img.convert('RGB')
+
+@etapa()
+def processar_imagem(dados, dpi_alvo=DPI_ALVO, qualidade=QUALIDADE_JPEG):
+    """Reduz, orienta e recomprime a imagem (bytes ou arquivo em disco). Retorna ImagemPreparada (sem cache)."""
+    with _abrir(dados) as original:
+        dpi = original.info.get('dpi', (DPI_PADRAO, DPI_PADRAO))[0] # Tenta obter DPI, padrão 96
+        if not dpi or dpi <= 0: dpi = DPI_PADRAO # Evita divisão por zero
+        orientacao = original.getexif().get(_TAG_ORIENTACAO, 1)
+        transposta = orientacao in _ORIENTACOES_TRANSPOSTAS
+
+        # Dimensões como a imagem será vista (já com a orientação aplicada)
+        largura, altura = original.size
+        if transposta: largura, altura = altura, largura
+
+        # Mesma largura de exibição de antes: tamanho físico pelo DPI, limitado a 6"
+        largura_polegadas = min(largura / dpi, LARGURA_MAXIMA_POLEGADAS)
+        largura_alvo = min(largura, max(1, round(largura_polegadas * dpi_alvo)))
+        altura_alvo = max(1, round(altura * largura_alvo / largura))
+
+        if largura_alvo < largura and original.format == 'JPEG':
+            # Draft: o libjpeg decodifica direto em 1/2, 1/4 ou 1/8 da escala
+            tamanho_draft = (altura_alvo, largura_alvo) if transposta else (largura_alvo, altura_alvo)
+            original.draft('RGB', tamanho_draft)
+
+        img = ImageOps.exif_transpose(original) # Aplica a orientação do EXIF aos pixels
+        if img.size != (largura_alvo, altura_alvo):
+            img = img.resize((largura_alvo, altura_alvo), Image.LANCZOS)
+        img = _para_rgb(img)
+
+        saida = io.BytesIO()
+        # Sem o parâmetro exif, o Pillow grava o JPEG sem metadados EXIF
+        img.save(saida, 'JPEG', quality=qualidade, optimize=True, dpi=(dpi_alvo, dpi_alvo))
+        return ImagemPreparada(saida.getvalue(), img.width, img.height, largura_polegadas, dpi_alvo)
+
+def _obter_do_cache(chave):
+    with _cache_lock:
+        preparada = _cache.get(chave)
+        if preparada is not None:
+            _cache.move_to_end(chave)
+        return preparada
+
+def _guardar_no_cache(chave, preparada):
+    with _cache_lock:
+        if chave not in _cache:
+            _cache[chave] = preparada
+            _cache_bytes[0] += len(preparada.dados)
+            # Descarta as menos usadas até caber no limite
+            while _cache_bytes[0] > CACHE_MAX_BYTES and len(_cache) > 1:
+                _, antiga = _cache.popitem(last=False)
+                _cache_bytes[0] -= len(antiga.dados)
+
+def preparar_imagem(dados, dpi_alvo=DPI_ALVO, qualidade=QUALIDADE_JPEG):
+    """Versão com cache de processar_imagem, indexada pelo SHA-256 do conteúdo."""
+    chave = (_digest(dados), dpi_alvo, qualidade, LARGURA_MAXIMA_POLEGADAS)
+    preparada = _obter_do_cache(chave)
+    if preparada is None:
+        incrementar('laudo_imagem_cache_total', resultado='falta')
+        preparada = processar_imagem(dados, dpi_alvo, qualidade)
+        _guardar_no_cache(chave, preparada)
+        incrementar('laudo_imagens_total')
+        incrementar('laudo_imagem_bytes_entrada_total', _tamanho(dados))
+    else:
+        incrementar('laudo_imagem_cache_total', resultado='acerto')
+    incrementar('laudo_imagem_bytes_saida_total', len(preparada.dados))
+    return preparada
+
+def _em_paralelo(funcao, argumentos, threads):
+    """Aplica funcao a cada argumento numa pool de threads. Retorna [(resultado, erro)] na mesma ordem."""
+    def protegida(argumento):
+        try:
+            return funcao(argumento), None
+        except Exception as e:
+            return None, e
+    if len(argumentos) <= 1 or threads <= 1:
+        return [protegida(argumento) for argumento in argumentos]
+    with ThreadPoolExecutor(max_workers=min(threads, len(argumentos))) as executor:
+        return list(executor.map(protegida, argumentos))
+
+def preparar_imagens(lista_dados, dpi_alvo=DPI_ALVO, qualidade=QUALIDADE_JPEG, threads=None):
+    """Prepara várias imagens em paralelo. Retorna [(ImagemPreparada ou None, erro ou None)] na ordem recebida."""
+    return _em_paralelo(lambda dados: preparar_imagem(dados, dpi_alvo, qualidade), lista_dados, threads or THREADS_IMAGEM)
+
+def _miniatura(dados, caixa):
+    """Decodifica (draft), orienta e reduz a imagem para caber na caixa (largura, altura)."""
+    with _abrir(dados) as original:
+        if original.format == 'JPEG':
+            transposta = original.getexif().get(_TAG_ORIENTACAO, 1) in _ORIENTACOES_TRANSPOSTAS
+            original.draft('RGB', (caixa[1], caixa[0]) if transposta else caixa)
+        img = _para_rgb(ImageOps.exif_transpose(original))
+        img.thumbnail(caixa, Image.LANCZOS)
+        return img
+
+def gerar_previa(dados, lado=LADO_PREVIA, qualidade=QUALIDADE_PREVIA):
+    """JPEG pequeno (lado maior = lado px) para exibir na interface no lugar do original."""
+    img = _miniatura(dados, (lado, lado))
+    saida = io.BytesIO()
+    img.save(saida, 'JPEG', quality=qualidade)
+    return saida.getvalue()
+
+@etapa()
+def montar_folha_contato(lista_dados, colunas=None, dpi_alvo=DPI_ALVO, qualidade=QUALIDADE_JPEG, threads=None):
+    """Combina as imagens numa grade numerada (1, 2, 3...) com a largura máxima do laudo.
+
+    Retorna (ImagemPreparada, erros), onde erros é a lista [(posição, exceção)] das
+    imagens que não puderam ser lidas (ficam fora da grade). Se nenhuma imagem
+    for lida, a ImagemPreparada é None.
+    """
+    colunas = colunas or math.ceil(math.sqrt(len(lista_dados)))
+    chave = (tuple(_digest(dados) for dados in lista_dados), colunas, dpi_alvo, qualidade, LARGURA_MAXIMA_POLEGADAS)
+    preparada = _obter_do_cache(chave)
+    if preparada is not None:
+        incrementar('laudo_imagem_cache_total', resultado='acerto')
+        incrementar('laudo_imagem_bytes_saida_total', len(preparada.dados))
+        return preparada, []
+    incrementar('laudo_imagem_cache_total', resultado='falta')
+
+    largura_total = round(LARGURA_MAXIMA_POLEGADAS * dpi_alvo)
+    largura_quadro = (largura_total - ESPACO_GRADE_PX * (colunas - 1)) // colunas
+    altura_quadro = round(largura_quadro * PROPORCAO_QUADRO)
+    resultados = _em_paralelo(lambda dados: _miniatura(dados, (largura_quadro, altura_quadro)), lista_dados, threads or THREADS_IMAGEM)
+
+    miniaturas = [(posicao, img) for posicao, (img, erro) in enumerate(resultados, 1) if erro is None]
+    erros = [(posicao, erro) for posicao, (img, erro) in enumerate(resultados, 1) if erro is not None]
+    if not miniaturas:
+        return None, erros
+
+    linhas = math.ceil(len(miniaturas) / colunas)
+    altura_total = linhas * altura_quadro + ESPACO_GRADE_PX * (linhas - 1)
+    folha = Image.new('RGB', (largura_total, altura_total), (255, 255, 255))
+    desenho = ImageDraw.Draw(folha)
+    fonte = ImageFont.load_default()
+    for indice, (posicao, img) in enumerate(miniaturas):
+        x = (indice % colunas) * (largura_quadro + ESPACO_GRADE_PX)
+        y = (indice // colunas) * (altura_quadro + ESPACO_GRADE_PX)
+        # Centraliza a miniatura no quadro
+        folha.paste(img, (x + (largura_quadro - img.width) // 2, y + (altura_quadro - img.height) // 2))
+        # Número do quadro no canto superior esquerdo, sobre fundo branco
+        rotulo = str(indice + 1)
+        caixa = desenho.textbbox((0, 0), rotulo, font=fonte)
+        desenho.rectangle([x, y, x + caixa[2] + 8, y + caixa[3] + 6], fill=(255, 255, 255))
+        desenho.text((x + 4, y + 3), rotulo, fill=(0, 0, 0), font=fonte)
+
+    saida = io.BytesIO()
+    folha.save(saida, 'JPEG', quality=qualidade, optimize=True, dpi=(dpi_alvo, dpi_alvo))
+    # Só guarda em cache quando todas as imagens entraram na grade
+    preparada = ImagemPreparada(saida.getvalue(), folha.width, folha.height, LARGURA_MAXIMA_POLEGADAS, dpi_alvo)
+    incrementar('laudo_imagens_total', len(miniaturas))
+    incrementar('laudo_imagem_bytes_entrada_total', sum(_tamanho(lista_dados[posicao - 1]) for posicao, _ in miniaturas))
+    incrementar('laudo_imagem_bytes_saida_total', len(preparada.dados))
+    if not erros:
+        _guardar_no_cache(chave, preparada)
+    return preparada, erros
+
+def limpar_cache_imagens():
+    """Esvazia o cache de imagens processadas."""
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes[0] = 0
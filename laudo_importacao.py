@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Importação de itens em lote: códigos abreviados do Colab ou CSV.
+
+Formato abreviado (uma linha por item, campos separados por espaço):
+    qtd tipo_mat emb [cor] [ref] [pessoa...]
+    3 v z t 1.2 Fulano de Tal
+    1 po e 2.1
+    10 v a - 1.3 Violeta Souza    ('-' pula a cor: nome começando com código de cor)
+
+Os códigos são os de TIPOS_MATERIAL_BASE, TIPOS_EMBALAGEM_BASE e
+CORES_FEMININO_EMBALAGEM (maiúsculas ou minúsculas). A cor só é reconhecida
+como cor se for um código válido; a referência é o primeiro campo seguinte que
+começa com dígito; o resto da linha é a pessoa. Linhas vazias e iniciadas por
+'#' são ignoradas.
+
+Formato CSV (com cabeçalho; separador ',' ';' ou tabulação):
+    qtd,tipo_mat,emb,cor_emb,ref,pessoa
+
+importar_itens() devolve (itens, erros); cada erro é (número da linha, texto
+da linha, mensagem), e as linhas com erro ficam fora de itens.
+"""
+
+import csv
+import io
+
+from laudo_docx import TIPOS_MATERIAL_BASE, TIPOS_EMBALAGEM_BASE, CORES_FEMININO_EMBALAGEM
+
+CAMPOS_ITEM = ('qtd', 'tipo_mat', 'emb', 'cor_emb', 'ref', 'pessoa')
+EMBALAGENS_COM_COR = frozenset(('pl', 'pa', 'e', 'z'))
+SEM_COR = '-'
+
+# Códigos em minúsculas -> código canônico (montados uma vez)
+_MATERIAIS = {codigo.lower(): codigo for codigo in TIPOS_MATERIAL_BASE}
+_EMBALAGENS = {codigo.lower(): codigo for codigo in TIPOS_EMBALAGEM_BASE}
+_CORES = {codigo.lower(): codigo for codigo in CORES_FEMININO_EMBALAGEM}
+_LISTA_MATERIAIS = ', '.join(TIPOS_MATERIAL_BASE)
+_LISTA_EMBALAGENS = ', '.join(TIPOS_EMBALAGEM_BASE)
+_LISTA_CORES = ', '.join(CORES_FEMININO_EMBALAGEM)
+
+def validar_item(qtd, tipo_mat, emb, cor_emb=None, ref='', pessoa=''):
+    """Valida e normaliza os campos de um item. Retorna o dict do item ou levanta ValueError."""
+    try:
+        qtd = int(qtd)
+    except (TypeError, ValueError):
+        raise ValueError(f"quantidade inválida: '{qtd}'")
+    if qtd < 1:
+        raise ValueError(f"quantidade deve ser pelo menos 1: {qtd}")
+    material = _MATERIAIS.get((tipo_mat or '').lower())
+    if material is None:
+        raise ValueError(f"tipo de material desconhecido: '{tipo_mat}' (use {_LISTA_MATERIAIS})")
+    embalagem = _EMBALAGENS.get((emb or '').lower())
+    if embalagem is None:
+        raise ValueError(f"embalagem desconhecida: '{emb}' (use {_LISTA_EMBALAGENS})")
+    cor = None
+    if cor_emb and cor_emb != SEM_COR:
+        cor = _CORES.get(cor_emb.lower())
+        if cor is None:
+            raise ValueError(f"cor desconhecida: '{cor_emb}' (use {_LISTA_CORES})")
+        if embalagem not in EMBALAGENS_COM_COR:
+            raise ValueError(f"a embalagem '{embalagem}' não leva cor (só {', '.join(sorted(EMBALAGENS_COM_COR))})")
+    return {'qtd': qtd, 'tipo_mat': material, 'emb': embalagem, 'cor_emb': cor,
+            'ref': (ref or '').strip(), 'pessoa': (pessoa or '').strip()}
+
+def ler_linha_abreviada(linha):
+    """'3 v z t 1.2 Fulano' -> dict do item. Levanta ValueError com a causa."""
+    campos = linha.split()
+    if len(campos) < 3:
+        raise ValueError("esperado 'qtd tipo_mat emb [cor] [ref] [pessoa]'")
+    qtd, tipo_mat, emb = campos[:3]
+    resto = campos[3:]
+    cor = None
+    if resto and (resto[0] == SEM_COR or resto[0].lower() in _CORES):
+        cor = resto.pop(0)
+    ref = ''
+    if resto and resto[0][0].isdigit():
+        ref = resto.pop(0)
+    return validar_item(qtd, tipo_mat, emb, cor, ref, ' '.join(resto))
+
+def _linhas_uteis(texto):
+    """Gera (número da linha, linha) ignorando linhas vazias e comentários '#'."""
+    for num_linha, linha in enumerate(texto.splitlines(), 1):
+        linha = linha.strip()
+        if linha and not linha.startswith('#'):
+            yield num_linha, linha
+
+def importar_abreviado(texto):
+    """Importa o formato abreviado. Retorna (itens, erros)."""
+    itens, erros = [], []
+    for num_linha, linha in _linhas_uteis(texto):
+        try:
+            itens.append(ler_linha_abreviada(linha))
+        except ValueError as e:
+            erros.append((num_linha, linha, str(e)))
+    return itens, erros
+
+def importar_csv(texto):
+    """Importa CSV com cabeçalho (colunas de CAMPOS_ITEM). Retorna (itens, erros)."""
+    amostra = texto[:4096]
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.DictReader(io.StringIO(texto), dialect=dialeto)
+    cabecalho = [(campo or '').strip().lower() for campo in leitor.fieldnames or []]
+    faltando = [campo for campo in ('qtd', 'tipo_mat', 'emb') if campo not in cabecalho]
+    if faltando:
+        return [], [(1, ','.join(leitor.fieldnames or []), f"cabeçalho sem a(s) coluna(s): {', '.join(faltando)}")]
+    leitor.fieldnames = cabecalho
+    itens, erros = [], []
+    for linha in leitor:
+        num_linha = leitor.line_num
+        if not any((valor or '').strip() for valor in linha.values() if isinstance(valor, str)):
+            continue # Linha em branco
+        try:
+            itens.append(validar_item(*((linha.get(campo) or '').strip() for campo in CAMPOS_ITEM)))
+        except ValueError as e:
+            erros.append((num_linha, ','.join(str(linha.get(campo) or '') for campo in CAMPOS_ITEM), str(e)))
+    return itens, erros
+
+def detectar_formato(texto):
+    """'csv' se a primeira linha útil for um cabeçalho (começa com 'qtd' ou cita 'tipo_mat'); senão 'abreviado'."""
+    for _, linha in _linhas_uteis(texto):
+        linha = linha.lower()
+        return 'csv' if linha.startswith('qtd') or 'tipo_mat' in linha else 'abreviado'
+    return 'abreviado'
+
+def importar_itens(texto, formato=None):
+    """Importa itens do texto colado ou do conteúdo de um arquivo. Retorna (itens, erros)."""
+    formato = formato or detectar_formato(texto)
+    if formato == 'csv':
+        return importar_csv(texto)
+    return importar_abreviado(texto)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Flexão e números por extenso em português para o texto do laudo.
+
+numero_por_extenso() escreve cardinais até centenas de bilhões, no feminino
+(porções: 'duas', 'duzentas e uma') ou no masculino; 'milhão/bilhão' são
+substantivos masculinos e não concordam ('duzentos milhões e duas').
+pluralizar() aplica as regras de plural uma vez por palavra (com exceções
+em PLURAIS_IRREGULARES e palavras invariáveis em PALAVRAS_INVARIAVEIS).
+
+montar_tabela_descricoes() monta, na carga do módulo que a chama, o trecho
+'porções de material X, acondicionadas ... em Y de cor Z' de todas as
+combinações de material, embalagem e cor, no singular e no plural; as cores
+ficam no feminino, concordando com 'cor'.
+"""
+
+import functools
+
+# --- Plural ---
+
+# Expressões que o laudo mantém iguais no plural ("acondicionadas, individualmente, em microtubo ...")
+PALAVRAS_INVARIAVEIS = frozenset(("microtubo do tipo eppendorf", "embalagem do tipo ziplock", "papel alumínio"))
+PLURAIS_IRREGULARES = {"papel": "papéis"}
+
+@functools.lru_cache(maxsize=1024)
+def pluralizar(palavra):
+    """Plural de uma palavra ou expressão (regras básicas do português)."""
+    if palavra in PALAVRAS_INVARIAVEIS:
+        return palavra
+    if palavra in PLURAIS_IRREGULARES:
+        return PLURAIS_IRREGULARES[palavra]
+    if palavra.endswith('m'):
+        return palavra[:-1] + 'ns' # item -> itens
+    if palavra.endswith('ão'):
+        return palavra[:-2] + 'ões' # porção -> porções
+    if palavra.endswith(('r', 'z')):
+        return palavra + 'es' # cor -> cores
+    if palavra.endswith('s'):
+        return palavra # lápis -> lápis (simplificado)
+    if palavra.endswith('l'):
+        return palavra[:-1] + 'is' # vegetal -> vegetais
+    return palavra + 's'
+
+def pluralizar_palavra(palavra, quantidade):
+    """A palavra no singular (quantidade 1) ou no plural."""
+    return palavra if quantidade == 1 else pluralizar(palavra)
+
+# --- Números por Extenso ---
+
+_UNIDADES = ("zero", "um", "dois", "três", "quatro", "cinco", "seis", "sete", "oito", "nove", "dez",
+             "onze", "doze", "treze", "quatorze", "quinze", "dezesseis", "dezessete", "dezoito", "dezenove")
+_DEZENAS = ("", "", "vinte", "trinta", "quarenta", "cinquenta", "sessenta", "setenta", "oitenta", "noventa")
+_CENTENAS = ("", "cento", "duzentos", "trezentos", "quatrocentos", "quinhentos",
+             "seiscentos", "setecentos", "oitocentos", "novecentos")
+# Escalas acima de mil: (singular, plural); são substantivos masculinos
+_ESCALAS = ((10 ** 9, "bilhão", "bilhões"), (10 ** 6, "milhão", "milhões"))
+MAXIMO_EXTENSO = 10 ** 12 - 1
+
+def _feminino(palavra):
+    if palavra == "um":
+        return "uma"
+    if palavra == "dois":
+        return "duas"
+    if palavra.endswith("entos"):
+        return palavra[:-2] + "as" # duzentos -> duzentas
+    return palavra
+
+def _ate_999(n, feminino):
+    """0 < n < 1000 por extenso."""
+    if n == 100:
+        return "cem"
+    partes = []
+    centena, resto = divmod(n, 100)
+    if centena:
+        partes.append(_CENTENAS[centena])
+    if resto >= 20:
+        dezena, unidade = divmod(resto, 10)
+        partes.append(_DEZENAS[dezena])
+        if unidade:
+            partes.append(_UNIDADES[unidade])
+    elif resto:
+        partes.append(_UNIDADES[resto])
+    if feminino:
+        partes = [_feminino(parte) for parte in partes]
+    return " e ".join(partes)
+
+@functools.lru_cache(maxsize=4096)
+def numero_por_extenso(n, feminino=True):
+    """Cardinal por extenso ('mil duzentas e trinta e quatro'); fora de 0..MAXIMO_EXTENSO, os dígitos."""
+    if not isinstance(n, int) or isinstance(n, bool) or n < 0 or n > MAXIMO_EXTENSO:
+        return str(n)
+    if n == 0:
+        return "zero"
+    grupos = [] # (texto, valor do grupo) do maior para o menor
+    for escala, singular, plural in _ESCALAS:
+        quantidade, n = divmod(n, escala)
+        if quantidade:
+            grupos.append((f"{_ate_999(quantidade, False)} {singular if quantidade == 1 else plural}", quantidade))
+    milhares, n = divmod(n, 1000)
+    if milhares:
+        grupos.append(("mil" if milhares == 1 else f"{_ate_999(milhares, feminino)} mil", milhares))
+    if n:
+        grupos.append((_ate_999(n, feminino), n))
+    if len(grupos) == 1:
+        return grupos[0][0]
+    # 'e' antes do último grupo só quando ele é menor que cem ou centena exata ('mil e duzentas', 'mil duzentas e uma')
+    *iniciais, (ultimo, valor) = grupos
+    ligacao = " e " if valor < 100 or valor % 100 == 0 else " "
+    return " ".join(texto for texto, _ in iniciais) + ligacao + ultimo
+
+# --- Descrição dos Itens ---
+
+def _descrever(material, embalagem, cor, plural):
+    """'porções de material X, acondicionadas, individualmente, em Y de cor Z' (sem quantidade)."""
+    if plural:
+        return (f"{pluralizar('porção')} de material {material}, acondicionadas, individualmente, "
+                f"em {pluralizar(embalagem)}{f' de cor {cor}' if cor else ''}")
+    return f"porção de material {material}, acondicionada em {embalagem}{f' de cor {cor}' if cor else ''}"
+
+def montar_tabela_descricoes(materiais, embalagens, cores, embalagens_com_cor):
+    """{(material, embalagem, cor ou None, plural): descrição} para todas as combinações de códigos.
+
+    A cor só entra nas embalagens de embalagens_com_cor (nas outras, a chave usa cor None).
+    """
+    tabela = {}
+    for cod_mat, material in materiais.items():
+        for cod_emb, embalagem in embalagens.items():
+            opcoes_cor = [(None, None)] + (list(cores.items()) if cod_emb in embalagens_com_cor else [])
+            for cod_cor, cor in opcoes_cor:
+                for plural in (False, True):
+                    tabela[(cod_mat, cod_emb, cod_cor, plural)] = _descrever(material, embalagem, cor, plural)
+    return tabela
+
+def descrever_item(tabela, materiais, embalagens, cores, embalagens_com_cor, tipo_mat, emb, cor_emb, qtd):
+    """Descrição de um item pela tabela; códigos desconhecidos são descritos na hora."""
+    plural = qtd != 1
+    cor_emb = cor_emb if cor_emb and emb in embalagens_com_cor else None
+    descricao = tabela.get((tipo_mat, emb, cor_emb, plural))
+    if descricao is None:
+        descricao = _descrever(materiais.get(tipo_mat, f"tipo '{tipo_mat}'"), embalagens.get(emb, f"embalagem '{emb}'"),
+                               cores.get(cor_emb, cor_emb) if cor_emb else None, plural)
+    return descricao
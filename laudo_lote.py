@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Geração de laudos em lote (linha de comando, sem Streamlit).
+
+Lê um manifesto JSONL ou CSV com os dados de cada caso e gera um
+'<rg_pericia>.docx' por caso num pool de processos. RG repetido no manifesto
+não sobrescreve o laudo anterior: na pasta e no ZIP, o segundo vira
+'<rg_pericia>_2.docx', o terceiro '_3' e assim por diante.
+
+Formato JSONL (um caso por linha, mesmo formato de dados_laudo):
+    {"rg_pericia": "2025_04_12345", "lacre": "0001234", "imagem": "fotos/caso1.jpg",
+     "itens": [{"qtd": 3, "tipo_mat": "v", "emb": "z", "cor_emb": "t", "ref": "1", "pessoa": "Fulano"}]}
+    Várias ilustrações: "imagens": ["a.jpg", {"arquivo": "b.jpg", "itens": ["1.2"]}]
+    e, opcionalmente, "ilustracao_grade": true.
+    Com "agrupar_itens": true, itens idênticos (material, embalagem, cor e
+    pessoa) saem num único parágrafo ("Itens 1.1 a 1.250: ...").
+
+Formato CSV (uma linha por item; linhas do mesmo caso devem ser consecutivas):
+    rg_pericia,lacre,imagem,qtd,tipo_mat,emb,cor_emb,ref,pessoa
+
+Caminhos de imagem relativos são resolvidos a partir da pasta do manifesto.
+
+Com --zip os laudos vão, à medida que ficam prontos, para um único arquivo ZIP
+(ou para a saída padrão com '--zip -'), junto com 'manifesto.json' contendo o
+tamanho e os tempos de cada entrada.
+
+Com --pdf cada laudo também é convertido para PDF no pool de conversores do
+laudo_pdf ('<rg_pericia>.pdf' ao lado do .docx ou no mesmo ZIP).
+
+Uso:
+    python laudo_lote.py casos.jsonl -o laudos/ -j 8
+    python laudo_lote.py casos.jsonl --zip laudos.zip
+    python laudo_lote.py casos.jsonl --zip - > laudos.zip
+    python laudo_lote.py casos.jsonl --metricas metricas.prom --log-json
+    python laudo_lote.py casos.jsonl --zip laudos.zip --pdf --pdf-trabalhadores 4
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import laudo_metricas
+from laudo_metricas import cronometro, incrementar, registrar_evento
+from laudo_uploads import ArquivoEmDisco
+
+CAMPOS_ITEM_CSV = ('qtd', 'tipo_mat', 'emb', 'cor_emb', 'ref', 'pessoa')
+MAX_ERROS_RESUMO = 50 # Erros guardados para o resumo final (todos aparecem no progresso)
+
+# --- Leitura do Manifesto (streaming) ---
+
+def ler_manifesto_jsonl(arquivo):
+    """Gera (linha, dados_laudo ou None, erro ou None) para cada linha do JSONL."""
+    for num_linha, linha in enumerate(arquivo, 1):
+        linha = linha.strip()
+        if not linha:
+            continue
+        try:
+            dados = json.loads(linha)
+            if not isinstance(dados, dict):
+                raise ValueError("a linha não contém um objeto JSON")
+            yield num_linha, dados, None
+        except ValueError as e:
+            yield num_linha, None, f"JSON inválido: {e}"
+
+def _item_csv(linha):
+    """Converte os campos de item de uma linha CSV para o formato de dados_laudo['itens']."""
+    if not (linha.get('tipo_mat') or '').strip():
+        return None # Linha de caso sem itens
+    item = {campo: (linha.get(campo) or '').strip() for campo in CAMPOS_ITEM_CSV}
+    item['qtd'] = int(item['qtd'] or 1)
+    item['cor_emb'] = item['cor_emb'] or None
+    return item
+
+def ler_manifesto_csv(arquivo):
+    """Gera (linha, dados_laudo ou None, erro ou None) agrupando linhas consecutivas do mesmo RG."""
+    leitor = csv.DictReader(arquivo)
+    linhas_numeradas = enumerate(leitor, 2) # Linha 1 é o cabeçalho
+    for rg, grupo in itertools.groupby(linhas_numeradas, key=lambda par: (par[1].get('rg_pericia') or '').strip()):
+        grupo = list(grupo) # Apenas as linhas de um caso ficam em memória
+        num_linha, primeira = grupo[0]
+        try:
+            itens = [item for item in (_item_csv(linha) for _, linha in grupo) if item]
+        except ValueError as e:
+            yield num_linha, None, f"quantidade inválida: {e}"
+            continue
+        yield num_linha, {
+            'rg_pericia': rg,
+            'lacre': (primeira.get('lacre') or '').strip(),
+            'imagem': (primeira.get('imagem') or '').strip() or None,
+            'itens': itens,
+        }, None
+
+def ler_manifesto(arquivo, formato):
+    """Escolhe o leitor do manifesto conforme o formato ('jsonl' ou 'csv')."""
+    if formato == 'csv':
+        return ler_manifesto_csv(arquivo)
+    return ler_manifesto_jsonl(arquivo)
+
+# --- Geração de um caso (executa no processo trabalhador) ---
+
+def nome_arquivo_laudo(rg_pericia):
+    """Nome do arquivo de saída, sem separadores de caminho vindos do RG."""
+    nome = str(rg_pericia).strip().replace('/', '_').replace('\\', '_')
+    return f"{nome}.docx"
+
+def nome_unico_laudo(rg_pericia, usados):
+    """nome_arquivo_laudo sem repetir os nomes em 'usados' (RG repetido: '<rg>_2.docx', '<rg>_3.docx'...); registra o nome."""
+    nome = nome_arquivo_laudo(rg_pericia)
+    base, sufixo = nome[:-len('.docx')], 2
+    while nome in usados: # RG repetido no manifesto
+        nome = f"{base}_{sufixo}.docx"
+        sufixo += 1
+    usados.add(nome)
+    return nome
+
+def _carregar_arquivo(pasta_base, caminho):
+    """Imagem do disco como ArquivoEmDisco: o Pillow lê o arquivo sob demanda, sem carregar o original na memória."""
+    return ArquivoEmDisco.de_caminho(os.path.join(pasta_base, caminho))
+
+def gerar_documento_caso(dados_laudo, pasta_base, backend=None):
+    """Carrega as imagens do caso e gera o Document. Levanta exceção se o caso for inválido."""
+    rg_pericia = str(dados_laudo.get('rg_pericia') or '').strip()
+    if not rg_pericia:
+        raise ValueError("caso sem 'rg_pericia'")
+    from laudo_docx import gerar_laudo_docx
+
+    dados = dict(dados_laudo)
+    if dados.get('imagem'):
+        dados['imagem'] = _carregar_arquivo(pasta_base, dados['imagem'])
+    imagens = []
+    for imagem in dados.get('imagens') or []:
+        if isinstance(imagem, dict):
+            imagens.append({'arquivo': _carregar_arquivo(pasta_base, imagem['arquivo']), 'itens': imagem.get('itens') or []})
+        else:
+            imagens.append(_carregar_arquivo(pasta_base, imagem))
+    dados['imagens'] = imagens
+    return gerar_laudo_docx(dados, backend=backend)
+
+def gerar_caso(dados_laudo, caminho_saida, pasta_base, backend=None):
+    """Gera o laudo de um caso. Retorna (rg, ok, segundos, bytes, erro, conteudo, metricas).
+
+    Com caminho_saida (escolhido pelo processo principal, ver nome_unico_laudo)
+    grava o .docx no disco (conteudo é None); sem ele, devolve os bytes do
+    .docx em conteudo (usado na exportação ZIP).
+    metricas é o laudo_metricas.extrair() do processo, a ser mesclado no principal.
+    """
+    from laudo_docx import fechar_documento
+    inicio = time.perf_counter()
+    rg_pericia = str(dados_laudo.get('rg_pericia') or '').strip()
+    document = None
+    try:
+        document = gerar_documento_caso(dados_laudo, pasta_base, backend)
+        if caminho_saida is None:
+            saida = io.BytesIO()
+            with cronometro('save'):
+                document.save(saida)
+            conteudo = saida.getvalue()
+            return rg_pericia, True, time.perf_counter() - inicio, len(conteudo), None, conteudo, laudo_metricas.extrair()
+        with cronometro('save'):
+            document.save(caminho_saida)
+        return rg_pericia, True, time.perf_counter() - inicio, os.path.getsize(caminho_saida), None, None, laudo_metricas.extrair()
+    except Exception as e:
+        print(f"Erro detalhado no caso '{rg_pericia}': {e}\n{traceback.format_exc()}", file=sys.stderr)
+        return rg_pericia, False, time.perf_counter() - inicio, 0, f"{type(e).__name__}: {e}", None, laudo_metricas.extrair()
+    finally:
+        fechar_documento(document)
+
+# --- Exportação ZIP (streaming) ---
+
+class ExportadorZip:
+    """Grava cada laudo numa entrada do ZIP assim que ele fica pronto.
+
+    O destino pode ser um caminho ou um stream sem seek (ex.: stdout). As
+    entradas são gravadas sem recompressão (o .docx já é comprimido) e, ao
+    fechar, o ZIP recebe 'manifesto.json' com tamanho e tempos de cada entrada.
+    """
+
+    NOME_MANIFESTO = 'manifesto.json'
+
+    def __init__(self, destino):
+        self._zip = zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_STORED)
+        self._nomes = set()
+        self.entradas = []
+
+    def adicionar(self, rg_pericia, conteudo, num_linha=None, segundos_geracao=0.0):
+        """Grava o laudo (bytes do .docx ou Document, salvo direto na entrada) e registra no manifesto."""
+        nome = nome_unico_laudo(rg_pericia, self._nomes)
+        inicio = time.perf_counter()
+        info = zipfile.ZipInfo(nome, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        with self._zip.open(info, 'w') as entrada:
+            if isinstance(conteudo, (bytes, bytearray)):
+                entrada.write(conteudo)
+            else:
+                with cronometro('save'):
+                    conteudo.save(entrada)
+        registro = {'arquivo': nome, 'rg_pericia': rg_pericia, 'linha': num_linha, 'bytes': info.file_size,
+                    'segundos_geracao': round(segundos_geracao, 4),
+                    'segundos_gravacao': round(time.perf_counter() - inicio, 4)}
+        self.entradas.append(registro)
+        return registro
+
+    def adicionar_pdf(self, registro, pdf):
+        """Grava o PDF de um laudo já adicionado ('<nome>.pdf') e o anota no registro do manifesto."""
+        nome = registro['arquivo'][:-len('.docx')] + '.pdf'
+        info = zipfile.ZipInfo(nome, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        self._zip.writestr(info, pdf)
+        registro['pdf'] = nome
+        registro['bytes_pdf'] = len(pdf)
+
+    def registrar_falha(self, rg_pericia, num_linha, erro, segundos_geracao=0.0):
+        """Registra no manifesto um caso que não gerou laudo."""
+        self.entradas.append({'arquivo': None, 'rg_pericia': rg_pericia, 'linha': num_linha,
+                              'segundos_geracao': round(segundos_geracao, 4), 'erro': erro})
+
+    def fechar(self):
+        """Grava o manifesto e finaliza o ZIP."""
+        manifesto = {'gerado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'laudos': sum(1 for entrada in self.entradas if entrada['arquivo']),
+                     'falhas': sum(1 for entrada in self.entradas if not entrada['arquivo']),
+                     'pdfs': sum(1 for entrada in self.entradas if entrada.get('pdf')),
+                     'entradas': self.entradas}
+        self._zip.writestr(self.NOME_MANIFESTO, json.dumps(manifesto, ensure_ascii=False, indent=1))
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+# --- Conversão para PDF ---
+
+class FilaPdf:
+    """PDFs em conversão no pool do laudo_pdf, gravados pela thread principal conforme ficam prontos.
+
+    O destino de cada PDF é o registro do laudo no ExportadorZip ou o caminho
+    do .docx no disco (o PDF vai ao lado, com extensão .pdf).
+    """
+
+    def __init__(self, pool, exportador=None):
+        self.pool = pool
+        self.exportador = exportador
+        self._pendentes = []
+        self.ok = 0
+        self.erros = [] # (rg, mensagem)
+
+    def enviar(self, rg_pericia, conteudo, destino):
+        """Enfileira a conversão (espera vaga se a fila do pool estiver cheia)."""
+        self._pendentes.append((self.pool.submeter(conteudo), rg_pericia, destino))
+
+    def gravar_prontos(self, esperar=False):
+        """Grava os PDFs já convertidos (todos, com esperar=True). Retorna [(rg, erro ou None)]."""
+        gravados, restantes = [], []
+        for futuro, rg_pericia, destino in self._pendentes:
+            if not esperar and not futuro.done():
+                restantes.append((futuro, rg_pericia, destino))
+                continue
+            try:
+                pdf = futuro.result()
+                if self.exportador is not None:
+                    self.exportador.adicionar_pdf(destino, pdf)
+                else:
+                    with open(destino[:-len('.docx')] + '.pdf', 'wb') as f:
+                        f.write(pdf)
+                self.ok += 1
+                gravados.append((rg_pericia, None))
+            except Exception as e:
+                erro = f"PDF: {type(e).__name__}: {e}"
+                self.erros.append((rg_pericia, erro))
+                gravados.append((rg_pericia, erro))
+        self._pendentes = restantes
+        return gravados
+
+def exportar_zip(casos, destino, pasta_base='.', ao_progresso=None, backend=None, pool_pdf=None):
+    """Gera os laudos em sequência, no próprio processo, salvando cada um direto no ZIP.
+
+    Usado pela interface (sem pool de processos). ao_progresso(registro) é
+    chamado após cada caso. Com pool_pdf (laudo_pdf.PoolConversao), o ZIP
+    também recebe o PDF de cada laudo. Retorna a lista de entradas do manifesto.
+    """
+    from laudo_docx import fechar_documento
+    with ExportadorZip(destino) as exportador:
+        fila_pdf = FilaPdf(pool_pdf, exportador) if pool_pdf is not None else None
+        for num_linha, dados, erro in casos:
+            inicio = time.perf_counter()
+            rg_pericia = (dados or {}).get('rg_pericia')
+            if erro is None:
+                document = None
+                try:
+                    document = gerar_documento_caso(dados, pasta_base, backend)
+                    if fila_pdf is None:
+                        registro = exportador.adicionar(rg_pericia, document, num_linha, time.perf_counter() - inicio)
+                    else: # Os bytes do .docx vão também para o conversor
+                        saida = io.BytesIO()
+                        with cronometro('save'):
+                            document.save(saida)
+                        registro = exportador.adicionar(rg_pericia, saida.getvalue(), num_linha, time.perf_counter() - inicio)
+                        fila_pdf.enviar(rg_pericia, saida.getvalue(), registro)
+                        fila_pdf.gravar_prontos()
+                except Exception as e:
+                    print(f"Erro detalhado no caso '{rg_pericia}': {e}\n{traceback.format_exc()}", file=sys.stderr)
+                    erro = f"{type(e).__name__}: {e}"
+                finally:
+                    fechar_documento(document)
+            if erro is not None:
+                exportador.registrar_falha(rg_pericia, num_linha, erro, time.perf_counter() - inicio)
+                registro = exportador.entradas[-1]
+            if ao_progresso:
+                ao_progresso(registro)
+        if fila_pdf is not None:
+            for rg_pericia, erro in fila_pdf.gravar_prontos(esperar=True):
+                if erro:
+                    print(f"Erro no PDF do caso '{rg_pericia}': {erro}", file=sys.stderr)
+        return exportador.entradas
+
+# --- Execução do Lote ---
+
+def executar_lote(casos, pasta_saida=None, pasta_base='.', processos=None, janela=None, saida_progresso=sys.stderr, exportador=None,
+                  backend=None, pool_pdf=None):
+    """Gera os laudos de 'casos' num pool de processos e retorna o resumo do lote.
+
+    Os laudos vão para pasta_saida ou, se um ExportadorZip for informado, são
+    devolvidos pelos processos e gravados no ZIP conforme ficam prontos.
+    No máximo 'janela' casos ficam pendentes ao mesmo tempo, de modo que o
+    manifesto é consumido aos poucos e a memória não cresce com o seu tamanho.
+    Com pool_pdf (laudo_pdf.PoolConversao), cada laudo também vira PDF.
+    """
+    processos = processos or os.cpu_count() or 1
+    janela = janela or processos * 2
+    if exportador is None:
+        os.makedirs(pasta_saida, exist_ok=True)
+    resumo = {'ok': 0, 'falhas': 0, 'bytes': 0, 'erros': [], 'pdfs': 0, 'falhas_pdf': 0}
+    inicio = time.perf_counter()
+    fila_pdf = FilaPdf(pool_pdf, exportador) if pool_pdf is not None else None
+
+    nomes = set() # Nomes já dados aos .docx na pasta (RG repetido não sobrescreve outro laudo)
+
+    def registrar(num_linha, rg, ok, segundos, tamanho, erro, conteudo=None, caminho=None):
+        if exportador is not None:
+            if ok:
+                try:
+                    registro = exportador.adicionar(rg, conteudo, num_linha, segundos)
+                    if fila_pdf is not None:
+                        fila_pdf.enviar(rg, conteudo, registro)
+                except Exception as e: # Ex.: falha de escrita no destino do ZIP
+                    ok, erro = False, f"{type(e).__name__}: {e}"
+            if not ok:
+                exportador.registrar_falha(rg, num_linha, erro, segundos)
+        elif ok and fila_pdf is not None:
+            with open(caminho, 'rb') as f:
+                fila_pdf.enviar(rg, f.read(), caminho)
+        total = resumo['ok'] + resumo['falhas'] + 1
+        if ok:
+            resumo['ok'] += 1
+            resumo['bytes'] += tamanho
+        else:
+            resumo['falhas'] += 1
+            incrementar('laudo_falhas_total', tipo='lote')
+            if len(resumo['erros']) < MAX_ERROS_RESUMO:
+                resumo['erros'].append((num_linha, rg, erro))
+        decorrido = time.perf_counter() - inicio
+        status = "ok" if ok else f"ERRO: {erro}"
+        print(f"[{total}] linha {num_linha} {rg or '-'}: {status} ({segundos:.2f}s) | {total / decorrido:.1f} laudos/s",
+              file=saida_progresso)
+        registrar_evento('caso_lote', linha=num_linha, rg_pericia=rg, ok=ok, ms=round(segundos * 1000, 3), bytes=tamanho, erro=erro)
+
+    def gravar_pdfs(esperar=False):
+        for rg, erro in fila_pdf.gravar_prontos(esperar):
+            if erro is None:
+                resumo['pdfs'] += 1
+                continue
+            resumo['falhas_pdf'] += 1
+            if len(resumo['erros']) < MAX_ERROS_RESUMO:
+                resumo['erros'].append((None, rg, erro))
+            print(f"[pdf] {rg or '-'}: ERRO: {erro}", file=saida_progresso)
+
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        pendentes = {}
+
+        def coletar(retorno_quando):
+            concluidos, _ = wait(pendentes, return_when=retorno_quando)
+            for futuro in concluidos:
+                num_linha, rg, caminho = pendentes.pop(futuro)
+                try:
+                    _, ok, segundos, tamanho, erro, conteudo, metricas = futuro.result()
+                    laudo_metricas.mesclar(metricas)
+                except Exception as e: # Processo trabalhador morreu, erro de pickle etc.
+                    ok, segundos, tamanho, erro, conteudo = False, 0.0, 0, f"{type(e).__name__}: {e}", None
+                registrar(num_linha, rg, ok, segundos, tamanho, erro, conteudo, caminho)
+            if fila_pdf is not None:
+                gravar_pdfs()
+
+        for num_linha, dados, erro in casos:
+            if erro:
+                registrar(num_linha, None, False, 0.0, 0, erro)
+                continue
+            caminho = None
+            if exportador is None: # O nome é escolhido aqui, na ordem do manifesto, como no ZIP
+                caminho = os.path.join(pasta_saida, nome_unico_laudo(str(dados.get('rg_pericia') or '').strip(), nomes))
+            futuro = executor.submit(gerar_caso, dados, caminho, pasta_base, backend)
+            pendentes[futuro] = (num_linha, dados.get('rg_pericia'), caminho)
+            if len(pendentes) >= janela:
+                coletar(FIRST_COMPLETED)
+        while pendentes:
+            coletar(FIRST_COMPLETED)
+    if fila_pdf is not None:
+        gravar_pdfs(esperar=True)
+
+    resumo['segundos'] = time.perf_counter() - inicio
+    return resumo
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera laudos .docx em lote a partir de um manifesto JSONL ou CSV.")
+    parser.add_argument('manifesto', help="Arquivo .jsonl ou .csv com os casos ('-' para ler JSONL da entrada padrão)")
+    parser.add_argument('-o', '--saida', default='laudos', help="Pasta de saída dos .docx (padrão: ./laudos)")
+    parser.add_argument('-j', '--processos', type=int, default=None, help="Número de processos (padrão: núcleos da CPU)")
+    parser.add_argument('-f', '--formato', choices=['jsonl', 'csv'], default=None, help="Formato do manifesto (padrão: pela extensão)")
+    parser.add_argument('--zip', default=None, metavar='ARQUIVO', help="Grava os laudos num único ZIP ('-' para a saída padrão) em vez da pasta")
+    parser.add_argument('--backend', choices=['docx', 'ooxml', 'fluxo'], default=None,
+                        help="Backend de geração: 'docx' (python-docx), 'ooxml' (XML direto, mais rápido) ou "
+                             "'fluxo' (XML direto gravado aos poucos, para apreensões enormes)")
+    parser.add_argument('--metricas', default=None, metavar='ARQUIVO', help="Grava as métricas (formato Prometheus) ao final do lote")
+    parser.add_argument('--log-json', action='store_true', help="Emite um evento JSON por laudo/caso na saída de erro")
+    parser.add_argument('--pdf', action='store_true', help="Converte também cada laudo para PDF")
+    parser.add_argument('--pdf-conversor', default=None, help="Conversor de PDF: 'libreoffice' (padrão) ou 'stub'")
+    parser.add_argument('--pdf-trabalhadores', type=int, default=None, help="Conversores de PDF em paralelo (padrão: 2)")
+    parser.add_argument('--pdf-timeout', type=float, default=None, help="Tempo limite por PDF, em segundos (padrão: 120)")
+    args = parser.parse_args(argv)
+    if args.log_json:
+        laudo_metricas.configurar_log_json()
+    pool_pdf = None
+    if args.pdf:
+        import laudo_pdf
+        if not laudo_pdf.conversor_disponivel(args.pdf_conversor):
+            print(f"Conversor de PDF '{args.pdf_conversor or laudo_pdf.CONVERSOR_PADRAO}' indisponível "
+                  "(LibreOffice não encontrado ou nome desconhecido).", file=sys.stderr)
+            return 2
+        pool_pdf = laudo_pdf.PoolConversao(args.pdf_conversor,
+                                           trabalhadores=args.pdf_trabalhadores or laudo_pdf.TRABALHADORES_PADRAO,
+                                           timeout=args.pdf_timeout or laudo_pdf.TIMEOUT_PADRAO)
+
+    formato = args.formato or ('csv' if args.manifesto.lower().endswith('.csv') else 'jsonl')
+    if args.manifesto == '-':
+        arquivo, pasta_base = sys.stdin, '.'
+    else:
+        arquivo = open(args.manifesto, encoding='utf-8', newline='')
+        pasta_base = os.path.dirname(os.path.abspath(args.manifesto))
+    try:
+        casos = ler_manifesto(arquivo, formato)
+        if args.zip:
+            destino_zip = sys.stdout.buffer if args.zip == '-' else args.zip
+            with ExportadorZip(destino_zip) as exportador:
+                resumo = executar_lote(casos, None, pasta_base, args.processos, exportador=exportador, backend=args.backend,
+                                       pool_pdf=pool_pdf)
+        else:
+            resumo = executar_lote(casos, args.saida, pasta_base, args.processos, backend=args.backend, pool_pdf=pool_pdf)
+    finally:
+        if arquivo is not sys.stdin:
+            arquivo.close()
+        if pool_pdf is not None:
+            pool_pdf.encerrar()
+
+    total = resumo['ok'] + resumo['falhas']
+    taxa = total / resumo['segundos'] if resumo['segundos'] else 0.0
+    print(f"\nConcluído: {total} caso(s), {resumo['ok']} gerado(s), {resumo['falhas']} com erro, "
+          f"{resumo['bytes'] / 1e6:.1f} MB em {resumo['segundos']:.1f}s ({taxa:.1f} laudos/s).", file=sys.stderr)
+    if pool_pdf is not None:
+        print(f"PDF: {resumo['pdfs']} convertido(s), {resumo['falhas_pdf']} com erro "
+              f"({pool_pdf.reinicios} reinício(s) de conversor).", file=sys.stderr)
+    if args.metricas:
+        with open(args.metricas, 'w', encoding='utf-8') as f:
+            f.write(laudo_metricas.exportar_prometheus())
+    for num_linha, rg, erro in resumo['erros']:
+        print(f"  linha {num_linha or '-'} ({rg or 'sem RG'}): {erro}", file=sys.stderr)
+    if resumo['falhas'] + resumo['falhas_pdf'] > len(resumo['erros']):
+        print(f"  ... e mais {resumo['falhas'] + resumo['falhas_pdf'] - len(resumo['erros'])} erro(s).", file=sys.stderr)
+    return 1 if resumo['falhas'] or resumo['falhas_pdf'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
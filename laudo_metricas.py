@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de desempenho do laudo (somente biblioteca padrão).
+
+Cada etapa de gerar_laudo_docx e do tratamento de imagens é cronometrada pelo
+decorador @etapa e entra num histograma de latência ('laudo_etapa_segundos');
+contadores registram laudos, itens, bytes de imagem e falhas, e medidores (gauges)
+guardam valores atuais, como a memória das sessões. As métricas
+podem ser exportadas no formato texto do Prometheus (exportar_prometheus) ou
+como dict (instantaneo), e cada laudo gerado produz um evento em log JSON no
+logger 'laudo' (desligado até configurar_log_json ou LAUDO_LOG_JSON=1).
+
+O custo é de alguns microssegundos por etapa (duas leituras de relógio e um
+lock); com LAUDO_METRICAS=0 (ou ATIVO = False) o decorador só repassa a chamada.
+Dentro de suspenso() a thread atual não registra métricas nem eventos (ex.: os
+laudos descartáveis do aquecimento, ver laudo_recursos).
+
+Uso:
+    with laudo_metricas.medicao() as etapas:   # tempos do laudo atual, por etapa
+        document = gerar_laudo_docx(dados)
+    print(laudo_metricas.exportar_prometheus())
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+ATIVO = os.environ.get('LAUDO_METRICAS', '1') != '0'
+
+# Limites (em segundos) dos baldes do histograma de latência
+LIMITES_SEGUNDOS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HISTOGRAMA_ETAPAS = 'laudo_etapa_segundos'
+
+# Descrição (HELP) das métricas conhecidas
+DESCRICOES = {
+    HISTOGRAMA_ETAPAS: "Duração de cada etapa da geração do laudo",
+    'laudo_laudos_total': "Laudos gerados",
+    'laudo_itens_total': "Itens de material descritos nos laudos gerados",
+    'laudo_imagens_total': "Imagens processadas (fora do cache)",
+    'laudo_imagem_cache_total': "Consultas ao cache de imagens processadas",
+    'laudo_imagem_bytes_entrada_total': "Bytes das imagens recebidas para processamento",
+    'laudo_imagem_bytes_saida_total': "Bytes das imagens processadas embutidas no laudo",
+    'laudo_falhas_total': "Falhas por tipo (imagem, laudo, lote, autosave)",
+    'laudo_cache_laudos_total': "Pedidos de laudo por origem (sessao, compartilhado, gerado)",
+    'laudo_pdf_total': "Conversões para PDF por resultado (ok, erro, timeout, fila_cheia)",
+    'laudo_pdf_reinicios_total': "Conversores de PDF reiniciados após travar ou morrer",
+    'laudo_api_requisicoes_total': "Requisições à API HTTP por rota e status",
+    'laudo_autosave_casos_total': "Rascunhos de casos gravados pelo salvamento automático",
+    'laudo_uploads_total': "Imagens recebidas na interface e gravadas em disco (novo, repetido)",
+    'laudo_uploads_bytes_total': "Bytes das imagens recebidas gravados em disco",
+    'laudo_sessao_orcamento_excedido_total': "Prévias descartadas por exceder o orçamento de memória da sessão",
+    'laudo_sessoes_uploads': "Sessões com imagens em disco",
+    'laudo_sessoes_bytes_memoria': "Bytes mantidos em memória pelas sessões (prévias das imagens)",
+    'laudo_sessao_bytes_memoria_max': "Maior uso de memória de uma sessão (prévias das imagens)",
+    'laudo_sessao_orcamento_bytes': "Orçamento de memória por sessão (LAUDO_ORCAMENTO_SESSAO_MB)",
+    'laudo_sessoes_bytes_disco': "Bytes das imagens das sessões gravadas em disco",
+    'laudo_fila_total': "Pedidos à fila de geração (enfileirado, deduplicado, recusado, ok, erro)",
+    'laudo_fila_gerando': "Laudos em geração no pool da fila",
+    'laudo_fila_aguardando': "Laudos aguardando na fila de geração",
+    'laudo_aquecimentos_total': "Aquecimentos do processo (recursos e laudo descartável, ver laudo_recursos)",
+}
+
+logger = logging.getLogger('laudo')
+
+_lock = threading.Lock()
+_contadores = {} # (nome, rótulos) -> valor
+_histogramas = {} # (nome, rótulos) -> [contagem por balde..., +Inf, soma]
+_medidores = {} # (nome, rótulos) -> valor atual (gauge)
+_local = threading.local() # _local.etapas: dict da medicao() ativa nesta thread; _local.suspenso: ver suspenso()
+
+def _rotulos(rotulos):
+    return tuple(sorted(rotulos.items()))
+
+def _registrando():
+    return ATIVO and not getattr(_local, 'suspenso', False)
+
+@contextlib.contextmanager
+def suspenso():
+    """Nesta thread, dentro do bloco, contadores, medidores, histogramas e eventos são descartados."""
+    anterior = getattr(_local, 'suspenso', False)
+    _local.suspenso = True
+    try:
+        yield
+    finally:
+        _local.suspenso = anterior
+
+def incrementar(nome, valor=1, **rotulos):
+    """Soma valor ao contador nome{rotulos}."""
+    if not _registrando():
+        return
+    chave = (nome, _rotulos(rotulos))
+    with _lock:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+def definir(nome, valor, **rotulos):
+    """Define o valor atual do medidor (gauge) nome{rotulos}."""
+    if not _registrando():
+        return
+    chave = (nome, _rotulos(rotulos))
+    with _lock:
+        _medidores[chave] = valor
+
+def observar(nome, segundos, **rotulos):
+    """Registra uma duração no histograma nome{rotulos}."""
+    if not _registrando():
+        return
+    chave = (nome, _rotulos(rotulos))
+    balde = bisect.bisect_left(LIMITES_SEGUNDOS, segundos)
+    with _lock:
+        valores = _histogramas.get(chave)
+        if valores is None:
+            valores = _histogramas[chave] = [0] * (len(LIMITES_SEGUNDOS) + 1) + [0.0]
+        valores[balde] += 1
+        valores[-1] += segundos
+
+def _registrar_etapa(nome, segundos):
+    observar(HISTOGRAMA_ETAPAS, segundos, etapa=nome)
+    etapas = getattr(_local, 'etapas', None)
+    if etapas is not None:
+        etapas[nome] = etapas.get(nome, 0.0) + segundos
+
+def etapa(nome=None):
+    """Decorador: cronometra a função como a etapa 'nome' (padrão: nome da função)."""
+    def decorador(funcao):
+        nome_etapa = nome or funcao.__name__
+
+        @functools.wraps(funcao)
+        def cronometrada(*args, **kwargs):
+            if not ATIVO:
+                return funcao(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                _registrar_etapa(nome_etapa, time.perf_counter() - inicio)
+        return cronometrada
+    return decorador
+
+@contextlib.contextmanager
+def cronometro(nome):
+    """Cronometra um bloco como a etapa 'nome'."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ATIVO:
+            _registrar_etapa(nome, time.perf_counter() - inicio)
+
+@contextlib.contextmanager
+def medicao():
+    """Coleta num dict {etapa: segundos} as etapas executadas nesta thread dentro do bloco.
+
+    Medições aninhadas também somam seus tempos na medição externa.
+    """
+    anterior = getattr(_local, 'etapas', None)
+    etapas = _local.etapas = {}
+    try:
+        yield etapas
+    finally:
+        _local.etapas = anterior
+        if anterior is not None:
+            for nome, segundos in etapas.items():
+                anterior[nome] = anterior.get(nome, 0.0) + segundos
+
+# --- Log JSON ---
+
+def registrar_evento(evento, nivel=logging.INFO, **campos):
+    """Emite uma linha JSON {'evento': ..., 'ts': ..., **campos} no logger 'laudo'."""
+    if not logger.isEnabledFor(nivel) or getattr(_local, 'suspenso', False):
+        return
+    registro = {'ts': round(time.time(), 3), 'evento': evento}
+    registro.update(campos)
+    logger.log(nivel, json.dumps(registro, ensure_ascii=False, default=str))
+
+def configurar_log_json(stream=None, nivel=logging.INFO):
+    """Envia os eventos do logger 'laudo' (uma linha JSON cada) para stream (padrão: stderr)."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(nivel)
+    logger.propagate = False
+    return handler
+
+if os.environ.get('LAUDO_LOG_JSON') == '1':
+    configurar_log_json()
+
+# --- Exportação ---
+
+def _formatar_rotulos(rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in pares) + '}'
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def exportar_prometheus():
+    """Métricas no formato texto de exposição do Prometheus (0.0.4)."""
+    with _lock:
+        contadores = sorted(_contadores.items())
+        histogramas = sorted((chave, list(valores)) for chave, valores in _histogramas.items())
+        medidores = sorted(_medidores.items())
+    linhas, descritas = [], set()
+
+    def cabecalho(nome, tipo):
+        if nome not in descritas:
+            descritas.add(nome)
+            if nome in DESCRICOES:
+                linhas.append(f"# HELP {nome} {DESCRICOES[nome]}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+
+    for (nome, rotulos), valor in contadores:
+        cabecalho(nome, 'counter')
+        linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_numero(valor)}")
+    for (nome, rotulos), valor in medidores:
+        cabecalho(nome, 'gauge')
+        linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_numero(valor)}")
+    for (nome, rotulos), valores in histogramas:
+        cabecalho(nome, 'histogram')
+        acumulado = 0
+        for limite, contagem in zip(LIMITES_SEGUNDOS + ('+Inf',), valores):
+            acumulado += contagem
+            linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, [('le', limite)])} {acumulado}")
+        linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_numero(valores[-1])}")
+        linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {acumulado}")
+    return '\n'.join(linhas) + '\n'
+
+def _copiar():
+    """Cópia serializável das métricas (chamar com _lock adquirido)."""
+    return {
+        'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _contadores.items()],
+        'histogramas': [[nome, dict(rotulos), list(valores)] for (nome, rotulos), valores in _histogramas.items()],
+        'medidores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _medidores.items()],
+    }
+
+def instantaneo():
+    """Cópia das métricas como dict serializável em JSON (ver também mesclar)."""
+    with _lock:
+        return _copiar()
+
+def mesclar(dados):
+    """Soma um instantaneo() (ex.: vindo de um processo trabalhador) às métricas deste processo.
+
+    Os medidores (gauges) não se somam: ficam com o valor recebido.
+    """
+    with _lock:
+        for nome, rotulos, valor in dados['contadores']:
+            chave = (nome, _rotulos(rotulos))
+            _contadores[chave] = _contadores.get(chave, 0) + valor
+        for nome, rotulos, valores in dados['histogramas']:
+            chave = (nome, _rotulos(rotulos))
+            atuais = _histogramas.setdefault(chave, [0] * (len(LIMITES_SEGUNDOS) + 1) + [0.0])
+            for i, valor in enumerate(valores):
+                atuais[i] += valor
+        for nome, rotulos, valor in dados.get('medidores', ()):
+            _medidores[(nome, _rotulos(rotulos))] = valor
+
+def zerar():
+    """Descarta todas as métricas coletadas."""
+    with _lock:
+        _contadores.clear()
+        _histogramas.clear()
+        _medidores.clear()
+
+def extrair():
+    """instantaneo() seguido de zerar(), atomicamente (para enviar as métricas a outro processo)."""
+    with _lock:
+        dados = _copiar()
+        _contadores.clear()
+        _histogramas.clear()
+        _medidores.clear()
+    return dados
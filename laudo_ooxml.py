@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Backend OOXML direto para o laudo (alternativa rápida ao python-docx).
+
+Em vez de criar objetos do python-docx (parágrafos, runs, fontes) para cada
+chamada de adicionar_paragrafo, este backend gera o XML de cada parágrafo como
+texto e monta 'word/document.xml' por concatenação. Os fragmentos são
+memorizados (lru_cache): os parágrafos fixos das seções de objetivo, exames,
+resultados, conclusão, custódia, referências e assinatura são renderizados uma
+vez por processo; só o texto variável (itens, lacre, datas) gera XML novo. O
+cache guarda apenas parágrafos das seções (laudo_secoes) de até
+LIMITE_TEXTO_CACHE caracteres: os dos itens, e os das seções com as listas de
+referências de apreensões grandes, são montados sem guardar.
+
+As demais partes do pacote (estilos, cabeçalho/rodapé, tema etc.) vêm do
+modelo base de laudo_docx, serializado uma vez, e são copiadas para o .docx.
+O resultado é semanticamente equivalente ao do backend python-docx.
+
+Para apreensões excepcionais (dezenas de milhares de itens), LaudoOOXMLFluxo
+(backend 'fluxo') não guarda o corpo: cada parágrafo vai para o zip assim que
+é gerado, por um word/document.xml aberto em escrita (ZipFile.open(..., 'w')),
+e a memória de pico deixa de crescer com o número de itens.
+
+Uso (via laudo_docx):
+    gerar_laudo_docx(dados_laudo, backend='ooxml').save('laudo.docx')
+    gerar_laudo_docx(dados_laudo, backend='fluxo').save('laudo.docx')
+"""
+
+import functools
+import io
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+from laudo_docx import obter_template_base, chave_template_base, segmentar_italico, mapear_estilos_paragrafo
+from laudo_metricas import etapa
+
+_CT_JPEG = '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+_TIPO_REL_IMAGEM = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+_EMU_POR_POLEGADA = 914400
+
+# Alinhamentos de adicionar_paragrafo -> valor de <w:jc> (mesmo mapeamento do python-docx)
+_JC = {'justify': 'both', 'center': 'center', 'right': 'right', 'left': 'left'}
+
+_PARAGRAFO_VAZIO = '<w:p/>'
+
+_FIGURA_XML = (
+    '<w:p><w:pPr><w:jc w:val="center"/></w:pPr><w:r><w:drawing>'
+    '<wp:inline distT="0" distB="0" distL="0" distR="0">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{id}" name="Picture {id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+    '<a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:nvPicPr><pic:cNvPr id="0" name="{nome}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr>'
+    '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+)
+
+# --- Pacote Modelo (partes do .docx base, serializadas uma vez) ---
+
+class PacoteModelo:
+    """Partes do modelo base: document.xml dividido em prefixo/sufixo e as demais partes prontas."""
+
+    def __init__(self, document):
+        saida = io.BytesIO()
+        document.save(saida)
+        with zipfile.ZipFile(saida) as z:
+            self.partes = [(info, z.read(info.filename)) for info in z.infolist()]
+        partes = {info.filename: dados for info, dados in self.partes}
+
+        # Corpo vazio do modelo: '<w:body>' + '<w:sectPr ...>...</w:body></w:document>'
+        document_xml = partes['word/document.xml'].decode('utf-8')
+        inicio_corpo = document_xml.index('<w:body>') + len('<w:body>')
+        inicio_sect = document_xml.index('<w:sectPr', inicio_corpo)
+        self.prefixo = document_xml[:inicio_corpo]
+        self.sufixo = document_xml[inicio_sect:]
+
+        self.rels = partes['word/_rels/document.xml.rels'].decode('utf-8')
+        self.content_types = partes['[Content_Types].xml'].decode('utf-8')
+        if _CT_JPEG not in self.content_types:
+            self.content_types = self.content_types.replace('<Default ', _CT_JPEG + '<Default ', 1)
+
+        # Nome do estilo -> id usado em <w:pStyle>; o estilo padrão (Normal) não é gravado
+        self.estilos = mapear_estilos_paragrafo(document)
+
+_pacote = {'chave': None, 'pacote': None}
+_pacote_lock = threading.Lock()
+
+def obter_pacote_modelo():
+    """Retorna o PacoteModelo do modelo base em cache (acompanha a invalidação de laudo_docx)."""
+    chave = chave_template_base()
+    with _pacote_lock:
+        if _pacote['chave'] != chave:
+            _pacote['pacote'] = PacoteModelo(obter_template_base())
+            _pacote['chave'] = chave
+        return _pacote['pacote']
+
+# --- Fragmentos XML ---
+
+_ESPECIAIS_RUN = re.compile(r'(\t|\r\n|\n|\r)')
+
+def _texto_run_xml(texto):
+    """Conteúdo de um run: <w:t>, com tabulação -> <w:tab/> e quebra de linha -> <w:br/> (como o python-docx)."""
+    partes = []
+    for pedaco in _ESPECIAIS_RUN.split(texto):
+        if not pedaco:
+            continue
+        if pedaco == '\t':
+            partes.append('<w:tab/>')
+        elif pedaco in ('\n', '\r', '\r\n'):
+            partes.append('<w:br/>')
+        elif pedaco[0].isspace() or pedaco[-1].isspace():
+            partes.append(f'<w:t xml:space="preserve">{escape(pedaco)}</w:t>')
+        else:
+            partes.append(f'<w:t>{escape(pedaco)}</w:t>')
+    return ''.join(partes)
+
+# Parágrafos fixos (das seções) maiores que isto não entram no cache de paragrafo_xml
+LIMITE_TEXTO_CACHE = 2000
+
+def montar_paragrafo_xml(texto, estilo_id=None, jc=None, cor=None, meio_pontos=None, negrito=False, italico=False):
+    """XML de um parágrafo com os termos em itálico."""
+    ppr = ''
+    if estilo_id or jc:
+        ppr = ('<w:pPr>' + (f'<w:pStyle w:val="{estilo_id}"/>' if estilo_id else '')
+               + (f'<w:jc w:val="{jc}"/>' if jc else '') + '</w:pPr>')
+    # Propriedades de caractere na ordem do esquema: b, i, color, sz
+    comum = ('<w:b/>' if negrito else '', f'<w:color w:val="{cor}"/>' if cor else '',
+             f'<w:sz w:val="{meio_pontos}"/>' if meio_pontos else '')
+    runs = []
+    for trecho, trecho_italico in segmentar_italico(texto):
+        rpr = comum[0] + ('<w:i/>' if italico or trecho_italico else '') + comum[1] + comum[2]
+        runs.append('<w:r>' + (f'<w:rPr>{rpr}</w:rPr>' if rpr else '') + _texto_run_xml(trecho) + '</w:r>')
+    return '<w:p>' + ppr + ''.join(runs) + '</w:p>'
+
+# Memorizado: parágrafos fixos saem do cache (ver adicionar_paragrafo_xml)
+paragrafo_xml = functools.lru_cache(maxsize=1024)(montar_paragrafo_xml)
+
+# --- Documento OOXML ---
+
+class LaudoOOXML:
+    """Laudo montado como XML; expõe save() como o Document do python-docx.
+
+    As funções adicionar_* de laudo_docx reconhecem este objeto pelos métodos
+    adicionar_paragrafo_xml e adicionar_figura_xml. Pode ser usado em 'with'
+    (close() ao sair), como LaudoOOXMLFluxo.
+    """
+
+    def __init__(self, pacote=None):
+        self.pacote = pacote or obter_pacote_modelo()
+        self.corpo = []
+        self.midias = [] # [(rId, nome do arquivo em word/media, bytes)]
+
+    def add_paragraph(self):
+        """Parágrafo vazio (espaçamento), como doc.add_paragraph()."""
+        self.corpo.append(_PARAGRAFO_VAZIO)
+
+    def adicionar_paragrafo_xml(self, text, style=None, align=None, color=None, size=None, bold=False, italic=False, fixo=False):
+        """Equivalente de adicionar_paragrafo para este backend; fixo: parágrafo de seção, candidato ao cache."""
+        estilo_id = None
+        if style:
+            if style in self.pacote.estilos:
+                estilo_id = self.pacote.estilos[style]
+            else: # Se o estilo for passado mas não existir, usar Normal
+                print(f"Estilo '{style}' não encontrado. Usando 'Normal'.")
+        jc = _JC.get(str(align).lower(), 'left') if align else None
+        cor = None
+        if color:
+            if isinstance(color, (tuple, list)) and len(color) == 3: cor = '%02X%02X%02X' % tuple(color) # RGBColor também é tupla
+            else: print(f"Formato de cor inválido: {color}")
+        meio_pontos = None
+        if size:
+            try: meio_pontos = int(size) * 2
+            except ValueError: print(f"Tamanho de fonte inválido: {size}")
+        montar = paragrafo_xml if fixo and len(text) <= LIMITE_TEXTO_CACHE else montar_paragrafo_xml
+        self.corpo.append(montar(text, estilo_id, jc, cor, meio_pontos, bool(bold), bool(italic)))
+
+    def adicionar_figura_xml(self, preparada):
+        """Parágrafo centralizado com a imagem (ImagemPreparada, JPEG) embutida."""
+        numero = len(self.midias) + 1
+        rid, nome = f"rIdLaudoImg{numero}", f"image{numero}.jpeg"
+        self.midias.append((rid, nome, preparada.dados))
+        # Mesmo cálculo do python-docx: tamanho nativo pelo DPI, escalado para a largura pedida
+        cx = int(preparada.largura_polegadas * _EMU_POR_POLEGADA)
+        largura_nativa = int(preparada.largura_px / preparada.dpi * _EMU_POR_POLEGADA)
+        altura_nativa = int(preparada.altura_px / preparada.dpi * _EMU_POR_POLEGADA)
+        cy = int(round(altura_nativa * (cx / largura_nativa)))
+        self.corpo.append(_FIGURA_XML.format(cx=cx, cy=cy, id=numero, nome=nome, rid=rid))
+
+    def document_xml(self):
+        """Conteúdo de word/document.xml."""
+        return (self.pacote.prefixo + ''.join(self.corpo) + self.pacote.sufixo).encode('utf-8')
+
+    def save(self, destino):
+        """Grava o .docx (caminho ou stream), copiando as partes do modelo base."""
+        with zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+            for info, dados in self.pacote.partes:
+                if info.filename == 'word/document.xml':
+                    dados = self.document_xml()
+                elif info.filename == 'word/_rels/document.xml.rels' and self.midias:
+                    novas = ''.join(f'<Relationship Id="{rid}" Type="{_TIPO_REL_IMAGEM}" Target="media/{nome}"/>'
+                                    for rid, nome, _ in self.midias)
+                    dados = self.pacote.rels.replace('</Relationships>', novas + '</Relationships>').encode('utf-8')
+                elif info.filename == '[Content_Types].xml' and self.midias:
+                    dados = self.pacote.content_types.encode('utf-8')
+                z.writestr(info, dados)
+            for _, nome, dados in self.midias:
+                z.writestr(zipfile.ZipInfo(f"word/media/{nome}"), dados, compress_type=zipfile.ZIP_STORED) # JPEG já é comprimido
+
+    def close(self):
+        """Nada a liberar: o documento fica todo em memória."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- Documento OOXML em fluxo ---
+
+# Partes do modelo que dependem do laudo (gravadas ao final, em finalizar())
+_PARTES_VARIAVEIS = ('word/document.xml', 'word/_rels/document.xml.rels', '[Content_Types].xml')
+
+def _copiar_info(info):
+    """ZipInfo novo com o nome, a data e a compressão de info (o ZipFile altera o ZipInfo que grava)."""
+    copia = zipfile.ZipInfo(info.filename, info.date_time)
+    copia.compress_type = info.compress_type
+    copia.external_attr = info.external_attr
+    return copia
+
+class _CorpoEmFluxo:
+    """Faz o papel da lista LaudoOOXML.corpo: junta os fragmentos e os grava no fluxo a cada ~64 KB."""
+
+    def __init__(self, fluxo, limite=1 << 16):
+        self.fluxo = fluxo
+        self.limite = limite
+        self.pendentes = []
+        self.tamanho = 0
+
+    def append(self, fragmento):
+        self.pendentes.append(fragmento)
+        self.tamanho += len(fragmento)
+        if self.tamanho >= self.limite:
+            self.descarregar()
+
+    def descarregar(self):
+        if self.pendentes:
+            self.fluxo.write(''.join(self.pendentes).encode('utf-8'))
+            self.pendentes = []
+            self.tamanho = 0
+
+class LaudoOOXMLFluxo(LaudoOOXML):
+    """LaudoOOXML que grava word/document.xml no zip à medida que os parágrafos são adicionados.
+
+    O .docx é montado num arquivo temporário em disco: as partes fixas do
+    modelo entram na criação e o corpo em blocos de ~64 KB. Como o zip só
+    aceita uma entrada aberta por vez, as imagens (poucas e já comprimidas)
+    esperam em memória e entram em finalizar(), com os relacionamentos e os
+    tipos de conteúdo. save() copia o pacote pronto para o destino em blocos;
+    pode ser chamado mais de uma vez. document_xml() finaliza o documento e lê
+    a entrada de volta do zip. O arquivo temporário só é liberado por close()
+    (ou ao sair do 'with'):
+
+        with novo_documento_fluxo() as documento:
+            ...
+            documento.save('laudo.docx')
+    """
+
+    def __init__(self, pacote=None, pasta=None):
+        super().__init__(pacote)
+        self._arquivo = tempfile.TemporaryFile(dir=pasta)
+        self._zip = zipfile.ZipFile(self._arquivo, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._variaveis = {} # nome -> (ZipInfo, conteúdo do modelo)
+        for info, dados in self.pacote.partes:
+            if info.filename in _PARTES_VARIAVEIS:
+                self._variaveis[info.filename] = (info, dados)
+            else:
+                self._zip.writestr(_copiar_info(info), dados)
+        self._fluxo = self._zip.open(_copiar_info(self._variaveis['word/document.xml'][0]), 'w')
+        self._fluxo.write(self.pacote.prefixo.encode('utf-8'))
+        self.corpo = _CorpoEmFluxo(self._fluxo)
+
+    def document_xml(self):
+        """Conteúdo de word/document.xml, lido do pacote temporário (finaliza o documento)."""
+        self.finalizar()
+        self._arquivo.seek(0)
+        with zipfile.ZipFile(self._arquivo) as z:
+            return z.read('word/document.xml')
+
+    def finalizar(self):
+        """Fecha word/document.xml e grava as partes restantes (só na primeira chamada)."""
+        if self._zip is None:
+            return
+        self.corpo.descarregar()
+        self._fluxo.write(self.pacote.sufixo.encode('utf-8'))
+        self._fluxo.close()
+        for nome in _PARTES_VARIAVEIS[1:]:
+            info, dados = self._variaveis[nome]
+            if nome == 'word/_rels/document.xml.rels' and self.midias:
+                novas = ''.join(f'<Relationship Id="{rid}" Type="{_TIPO_REL_IMAGEM}" Target="media/{arquivo}"/>'
+                                for rid, arquivo, _ in self.midias)
+                dados = self.pacote.rels.replace('</Relationships>', novas + '</Relationships>').encode('utf-8')
+            elif nome == '[Content_Types].xml' and self.midias:
+                dados = self.pacote.content_types.encode('utf-8')
+            self._zip.writestr(_copiar_info(info), dados)
+        for _, nome, dados in self.midias:
+            self._zip.writestr(zipfile.ZipInfo(f"word/media/{nome}"), dados, compress_type=zipfile.ZIP_STORED) # JPEG já é comprimido
+        self._zip.close()
+        self._zip = None
+        self.midias = []
+
+    def save(self, destino):
+        """Grava o .docx (caminho ou stream), copiando o pacote temporário em blocos."""
+        self.finalizar()
+        self._arquivo.seek(0)
+        if isinstance(destino, (str, bytes)) or hasattr(destino, '__fspath__'):
+            with open(destino, 'wb') as f:
+                shutil.copyfileobj(self._arquivo, f)
+        else:
+            shutil.copyfileobj(self._arquivo, destino)
+
+    def close(self):
+        """Descarta o arquivo temporário (o documento não pode mais ser salvo)."""
+        if self._zip is not None: # Não finalizado (ex.: falha no meio do laudo): fecha a entrada e o zip
+            zip_aberto, self._zip = self._zip, None
+            try:
+                self._fluxo.close()
+                zip_aberto.close()
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                print(f"Erro ao fechar o laudo em fluxo: {e}")
+        self._arquivo.close()
+
+@etapa()
+def novo_documento_ooxml():
+    """Novo laudo vazio no backend OOXML, sobre o modelo base em cache."""
+    return LaudoOOXML()
+
+@etapa()
+def novo_documento_fluxo():
+    """Novo laudo vazio no backend OOXML em fluxo (document.xml gravado aos poucos num zip temporário)."""
+    return LaudoOOXMLFluxo()
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Conversão dos laudos .docx para PDF num pool de conversores de vida longa.
+
+Cada trabalhador do PoolConversao é uma thread dona de um ConversorPdf, que
+pode manter um processo externo aquecido (ex.: LibreOffice headless) entre um
+laudo e outro. Os pedidos entram numa fila limitada; cada um tem seu tempo
+limite, e o trabalhador cujo conversor morre, trava ou estoura o tempo troca
+o conversor por um novo antes do próximo pedido.
+
+Conversores (registrar_conversor acrescenta outros):
+    'libreoffice'  soffice headless; com o módulo 'uno' disponível, um
+                   processo fica escutando e converte via UNO; sem ele, um
+                   soffice por laudo, reaproveitando o perfil do trabalhador
+    'stub'         PDF mínimo gerado em Python, sem dependências (testes)
+
+Variáveis de ambiente: LAUDO_PDF_CONVERSOR (padrão 'libreoffice'),
+LAUDO_PDF_TRABALHADORES (2), LAUDO_PDF_TIMEOUT (segundos por laudo, 120).
+
+Uso:
+    with PoolConversao('stub', trabalhadores=2) as pool:
+        pdf = pool.converter(conteudo_docx)
+        futuro = pool.submeter(conteudo_docx)   # concurrent.futures.Future
+"""
+
+import atexit
+import hashlib
+import importlib.util
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from laudo_metricas import HISTOGRAMA_ETAPAS, cronometro, incrementar, observar, registrar_evento
+
+CONVERSOR_PADRAO = os.environ.get('LAUDO_PDF_CONVERSOR', 'libreoffice')
+TRABALHADORES_PADRAO = int(os.environ.get('LAUDO_PDF_TRABALHADORES', '2'))
+TIMEOUT_PADRAO = float(os.environ.get('LAUDO_PDF_TIMEOUT', '120'))
+MAX_FILA = 64
+TIMEOUT_INICIO = 60.0 # Tempo para um processo do LibreOffice aceitar conexões
+
+class ErroConversao(Exception):
+    """Falha ao converter um laudo para PDF."""
+
+class TempoEsgotado(ErroConversao):
+    """A conversão passou do tempo limite (o conversor é reiniciado)."""
+
+class FilaCheia(ErroConversao):
+    """A fila do pool de conversão está cheia."""
+
+# --- Conversores ---
+
+class ConversorPdf:
+    """Base dos conversores. Cada trabalhador do pool tem o seu e o usa um pedido por vez.
+
+    converter() deve respeitar o tempo limite (levantando TempoEsgotado) e
+    vivo() dizer se o conversor ainda pode ser usado; quando não puder, o
+    pool chama encerrar() e cria outro.
+    """
+
+    nome = None
+
+    @classmethod
+    def disponivel(cls):
+        """Se o conversor pode ser usado nesta máquina."""
+        return True
+
+    def iniciar(self):
+        pass
+
+    def vivo(self):
+        return True
+
+    def converter(self, conteudo, timeout):
+        """Bytes do .docx -> bytes do PDF."""
+        raise NotImplementedError
+
+    def encerrar(self):
+        pass
+
+def _matar_grupo(processo):
+    """Mata o processo e os filhos (o soffice é um script que dispara o soffice.bin)."""
+    try:
+        os.killpg(processo.pid, signal.SIGKILL)
+    except (AttributeError, OSError): # Sem killpg (Windows) ou processo já encerrado
+        try:
+            processo.kill()
+        except OSError:
+            pass
+
+class ConversorLibreOffice(ConversorPdf):
+    """LibreOffice headless com perfil próprio; via UNO quando o módulo 'uno' existe."""
+
+    nome = 'libreoffice'
+
+    def __init__(self, binario=None):
+        self.binario = binario or self.localizar()
+        self._pasta = None
+        self._processo = None # soffice escutando (modo UNO)
+        self._desktop = None
+
+    @staticmethod
+    def localizar():
+        return shutil.which('soffice') or shutil.which('libreoffice')
+
+    @classmethod
+    def disponivel(cls):
+        return cls.localizar() is not None
+
+    def _argumentos_base(self):
+        perfil = 'file://' + os.path.join(self._pasta, 'perfil').replace(os.sep, '/')
+        return [self.binario, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+                f'-env:UserInstallation={perfil}']
+
+    def iniciar(self):
+        if not self.binario:
+            raise ErroConversao("LibreOffice (soffice) não encontrado no PATH")
+        self._pasta = tempfile.mkdtemp(prefix='laudo_pdf_')
+        if importlib.util.find_spec('uno') is None: # Só existe no Python que acompanha o LibreOffice
+            return # Modo processo: um soffice por laudo, com o perfil já criado a partir do segundo
+        nome_pipe = os.path.basename(self._pasta)
+        self._processo = subprocess.Popen(
+            self._argumentos_base() + [f'--accept=pipe,name={nome_pipe};urp;StarOffice.ComponentContext'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        self._desktop = self._conectar(nome_pipe)
+
+    def _conectar(self, nome_pipe):
+        import uno
+        local = uno.getComponentContext()
+        resolvedor = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        limite = time.monotonic() + TIMEOUT_INICIO
+        while True:
+            try:
+                contexto = resolvedor.resolve(f'uno:pipe,name={nome_pipe};urp;StarOffice.ComponentContext')
+                return contexto.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', contexto)
+            except Exception:
+                if self._processo.poll() is not None or time.monotonic() > limite:
+                    raise ErroConversao("o LibreOffice não aceitou a conexão UNO")
+                time.sleep(0.2)
+
+    def vivo(self):
+        return self._processo is None or self._processo.poll() is None
+
+    def converter(self, conteudo, timeout):
+        entrada = os.path.join(self._pasta, 'laudo.docx')
+        saida = os.path.join(self._pasta, 'laudo.pdf')
+        with open(entrada, 'wb') as f:
+            f.write(conteudo)
+        if os.path.exists(saida):
+            os.remove(saida)
+        if self._desktop is not None:
+            self._converter_uno(entrada, saida, timeout)
+        else:
+            self._converter_processo(entrada, timeout)
+        if not os.path.exists(saida):
+            raise ErroConversao("o LibreOffice não gerou o PDF")
+        with open(saida, 'rb') as f:
+            return f.read()
+
+    def _converter_processo(self, entrada, timeout):
+        processo = subprocess.Popen(
+            self._argumentos_base() + ['--convert-to', 'pdf', '--outdir', self._pasta, entrada],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        try:
+            _, erro = processo.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _matar_grupo(processo)
+            processo.communicate()
+            raise TempoEsgotado(f"conversão passou de {timeout:g}s")
+        if processo.returncode != 0:
+            raise ErroConversao(f"soffice terminou com código {processo.returncode}: {erro.decode(errors='replace').strip()}")
+
+    def _converter_uno(self, entrada, saida, timeout):
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def propriedade(nome, valor):
+            p = PropertyValue()
+            p.Name, p.Value = nome, valor
+            return p
+
+        # Vigia: se a chamada UNO travar, mata o soffice (a chamada então falha)
+        vigia = threading.Timer(timeout, _matar_grupo, args=(self._processo,))
+        vigia.start()
+        try:
+            documento = self._desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(entrada), '_blank', 0, (propriedade('Hidden', True),))
+            try:
+                documento.storeToURL(uno.systemPathToFileUrl(saida), (propriedade('FilterName', 'writer_pdf_Export'),))
+            finally:
+                documento.close(True)
+        except Exception as e:
+            if not vigia.is_alive():
+                raise TempoEsgotado(f"conversão passou de {timeout:g}s")
+            raise ErroConversao(f"falha no LibreOffice: {e}")
+        finally:
+            vigia.cancel()
+
+    def encerrar(self):
+        if self._desktop is not None:
+            try:
+                self._desktop.terminate()
+            except Exception:
+                pass
+            self._desktop = None
+        if self._processo is not None:
+            try:
+                self._processo.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                _matar_grupo(self._processo)
+            self._processo = None
+        if self._pasta:
+            shutil.rmtree(self._pasta, ignore_errors=True)
+            self._pasta = None
+
+def pdf_minimo(texto):
+    """PDF válido de uma página com uma linha de texto (Helvetica)."""
+    escapado = texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    fluxo = f"BT /F1 11 Tf 72 770 Td ({escapado}) Tj ET".encode('latin-1', 'replace')
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n" % len(fluxo) + fluxo + b"\nendstream",
+    ]
+    saida = bytearray(b"%PDF-1.4\n")
+    posicoes = []
+    for numero, objeto in enumerate(objetos, 1):
+        posicoes.append(len(saida))
+        saida += b"%d 0 obj\n" % numero + objeto + b"\nendobj\n"
+    inicio_xref = len(saida)
+    saida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for posicao in posicoes:
+        saida += b"%010d 00000 n \n" % posicao
+    saida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, inicio_xref)
+    return bytes(saida)
+
+class ConversorStub(ConversorPdf):
+    """Conversor local para testes: devolve um PDF mínimo que identifica o .docx.
+
+    atraso simula o tempo de conversão; com falhar_a_cada=N, cada N-ésima
+    conversão 'derruba o processo' (vivo() passa a ser False).
+    """
+
+    nome = 'stub'
+
+    def __init__(self, atraso=0.0, falhar_a_cada=0):
+        self.atraso = atraso
+        self.falhar_a_cada = falhar_a_cada
+        self.conversoes = 0
+        self._vivo = False
+
+    def iniciar(self):
+        self._vivo = True
+
+    def vivo(self):
+        return self._vivo
+
+    def converter(self, conteudo, timeout):
+        self.conversoes += 1
+        if self.falhar_a_cada and self.conversoes % self.falhar_a_cada == 0:
+            self._vivo = False
+            raise ErroConversao("conversor stub encerrado (falha simulada)")
+        if self.atraso:
+            time.sleep(min(self.atraso, timeout))
+            if self.atraso > timeout:
+                raise TempoEsgotado(f"conversão passou de {timeout:g}s")
+        digest = hashlib.sha256(conteudo).hexdigest()
+        return pdf_minimo(f"Laudo convertido (stub): {len(conteudo)} bytes, sha256 {digest[:16]}")
+
+    def encerrar(self):
+        self._vivo = False
+
+CONVERSORES = {
+    ConversorLibreOffice.nome: ConversorLibreOffice,
+    ConversorStub.nome: ConversorStub,
+}
+
+def registrar_conversor(nome, classe):
+    """Torna um conversor (subclasse de ConversorPdf) disponível pelo nome."""
+    CONVERSORES[nome] = classe
+
+def conversor_disponivel(nome=None):
+    """Se o conversor (padrão: CONVERSOR_PADRAO) existe e pode ser usado nesta máquina."""
+    classe = CONVERSORES.get(nome or CONVERSOR_PADRAO)
+    return classe is not None and classe.disponivel()
+
+# --- Pool de Conversão ---
+
+class PoolConversao:
+    """Fila de pedidos atendida por trabalhadores com conversores de vida longa."""
+
+    def __init__(self, conversor=None, trabalhadores=TRABALHADORES_PADRAO, timeout=TIMEOUT_PADRAO, max_fila=MAX_FILA, **opcoes):
+        nome = conversor or CONVERSOR_PADRAO
+        if nome not in CONVERSORES:
+            raise ValueError(f"Conversor desconhecido: '{nome}' (use {', '.join(CONVERSORES)})")
+        self.nome_conversor = nome
+        self.timeout = timeout
+        self._opcoes = opcoes # Repassadas ao construtor do conversor
+        self._fila = queue.Queue(max_fila)
+        self._lock = threading.Lock()
+        self._encerrado = False
+        self.reinicios = 0
+        self._threads = [threading.Thread(target=self._trabalhar, name=f'laudo-pdf-{i}', daemon=True)
+                         for i in range(max(1, trabalhadores))]
+        for thread in self._threads:
+            thread.start()
+
+    def submeter(self, conteudo, timeout=None, bloquear=True):
+        """Enfileira a conversão e retorna um Future com os bytes do PDF.
+
+        Com bloquear=False, levanta FilaCheia em vez de esperar vaga na fila.
+        """
+        if self._encerrado:
+            raise ErroConversao("pool de conversão encerrado")
+        futuro = Future()
+        try:
+            self._fila.put((futuro, conteudo, timeout or self.timeout, time.perf_counter()), block=bloquear)
+        except queue.Full:
+            incrementar('laudo_pdf_total', resultado='fila_cheia')
+            raise FilaCheia(f"fila de conversão cheia ({self._fila.maxsize} pedidos)")
+        return futuro
+
+    def converter(self, conteudo, timeout=None, bloquear=True):
+        """Converte e espera o resultado (bytes do PDF); levanta ErroConversao em caso de falha."""
+        return self.submeter(conteudo, timeout, bloquear).result()
+
+    def _novo_conversor(self):
+        conversor = CONVERSORES[self.nome_conversor](**self._opcoes)
+        conversor.iniciar()
+        return conversor
+
+    def _descartar(self, conversor):
+        try:
+            conversor.encerrar()
+        except Exception as e:
+            print(f"Erro ao encerrar conversor de PDF: {e}")
+
+    def _trabalhar(self):
+        conversor = None
+        while True:
+            tarefa = self._fila.get()
+            if tarefa is None:
+                break
+            futuro, conteudo, timeout, enfileirado = tarefa
+            if not futuro.set_running_or_notify_cancel():
+                continue
+            observar(HISTOGRAMA_ETAPAS, time.perf_counter() - enfileirado, etapa='fila_pdf')
+            try:
+                if conversor is not None and not conversor.vivo(): # Morreu desde o último pedido
+                    self._reiniciado(conversor, 'morto')
+                    conversor = None
+                if conversor is None:
+                    conversor = self._novo_conversor()
+                with cronometro('converter_pdf'):
+                    pdf = conversor.converter(conteudo, timeout)
+            except Exception as e:
+                resultado = 'timeout' if isinstance(e, TempoEsgotado) else 'erro'
+                incrementar('laudo_pdf_total', resultado=resultado)
+                registrar_evento('falha_pdf', conversor=self.nome_conversor, resultado=resultado, erro=f"{type(e).__name__}: {e}")
+                # Conversor travado ou morto: troca já, para o próximo pedido encontrá-lo pronto
+                if conversor is not None and (isinstance(e, TempoEsgotado) or not conversor.vivo()):
+                    self._reiniciado(conversor, resultado)
+                    try:
+                        conversor = self._novo_conversor()
+                    except Exception as erro_inicio:
+                        print(f"Erro ao reiniciar conversor de PDF: {erro_inicio}")
+                        conversor = None
+                futuro.set_exception(e if isinstance(e, ErroConversao) else ErroConversao(f"{type(e).__name__}: {e}"))
+            else:
+                incrementar('laudo_pdf_total', resultado='ok')
+                futuro.set_result(pdf)
+        if conversor is not None:
+            self._descartar(conversor)
+
+    def _reiniciado(self, conversor, motivo):
+        self._descartar(conversor)
+        with self._lock:
+            self.reinicios += 1
+        incrementar('laudo_pdf_reinicios_total', conversor=self.nome_conversor)
+        registrar_evento('reinicio_conversor_pdf', conversor=self.nome_conversor, motivo=motivo)
+
+    def estado(self):
+        """{'conversor', 'trabalhadores', 'fila', 'reinicios'} para exibição."""
+        return {'conversor': self.nome_conversor, 'trabalhadores': sum(t.is_alive() for t in self._threads),
+                'fila': self._fila.qsize(), 'reinicios': self.reinicios}
+
+    def encerrar(self):
+        """Atende os pedidos já enfileirados e encerra trabalhadores e conversores."""
+        if self._encerrado:
+            return
+        self._encerrado = True
+        for _ in self._threads:
+            self._fila.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.encerrar()
+
+# Pool do processo (interface): criado no primeiro uso e mantido aquecido
+_pool_padrao = None
+_pool_padrao_lock = threading.Lock()
+
+def pool_padrao():
+    """PoolConversao compartilhado pelo processo, com as configurações das variáveis de ambiente."""
+    global _pool_padrao
+    with _pool_padrao_lock:
+        if _pool_padrao is None:
+            _pool_padrao = PoolConversao()
+            atexit.register(_pool_padrao.encerrar)
+        return _pool_padrao
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Recursos carregados uma vez por processo: logo, fuso horário e modelo base.
+
+A cada rerun a interface lia o logo do disco e o Streamlit o decodificava e
+reduzia para a largura exibida (~6 ms); o primeiro laudo depois de subir o
+processo pagava ainda a importação do pytz, a montagem do modelo base e a
+inicialização do python-docx/lxml. Aqui cada recurso é carregado no primeiro
+uso e fica no processo (falhas não ficam guardadas: a próxima chamada tenta de
+novo):
+
+    logo(largura)     PNG do logo (LAUDO_LOGO), já na largura exibida
+    fuso_horario()    tzinfo de America/Sao_Paulo (pytz)
+    template_base()   modelo base do DOCX (laudo_docx.obter_template_base)
+
+aquecer() carrega todos e gera um laudo descartável em cada backend, para que
+o primeiro laudo real saia com a latência de regime. Os laudos descartáveis
+rodam com laudo_metricas.suspenso() e ficam fora das métricas e do log: o
+aquecimento só registra a etapa 'aquecimento' e laudo_aquecimentos_total. A
+interface aquece em segundo plano ao subir (LAUDO_AQUECER=0 desliga), e os
+processos da fila e da API aquecem no inicializador do pool.
+
+Uso:
+    st.image(logo(LARGURA_LOGO), width=LARGURA_LOGO)
+    hoje = datetime.now(fuso_horario())
+    tempos = aquecer()                        # {'logo': s, 'fuso_horario': s, ..., 'laudo_docx': s}
+"""
+
+import io
+import os
+import threading
+import time
+
+from laudo_metricas import HISTOGRAMA_ETAPAS, incrementar, observar, suspenso
+
+# --- Configuração ---
+CAMINHO_LOGO = os.environ.get('LAUDO_LOGO', 'logo_policia_cientifica.png')
+FUSO_HORARIO = 'America/Sao_Paulo'
+AQUECER = os.environ.get('LAUDO_AQUECER', '1') != '0'
+LARGURA_LOGO = 100 # px, largura do logo no cabeçalho da interface
+
+# Laudo descartável do aquecimento: passa pelas descrições, pelas referências e pelo save
+DADOS_AQUECIMENTO = {
+    'rg_pericia': 'AQUECIMENTO', 'lacre': '0000000',
+    'itens': [
+        {'qtd': 2, 'tipo_mat': 'v', 'emb': 'z', 'cor_emb': 't', 'ref': '1', 'pessoa': ''},
+        {'qtd': 1, 'tipo_mat': 'po', 'emb': 'e', 'cor_emb': None, 'ref': '2', 'pessoa': ''},
+    ],
+}
+
+# --- Registro ---
+
+_recursos = {} # nome -> valor carregado
+_recursos_lock = threading.RLock() # RLock: logo(largura) carrega logo() com o lock adquirido
+
+def _carregar(nome, carregar):
+    """Valor do recurso 'nome', carregado com carregar() no primeiro uso."""
+    with _recursos_lock:
+        if nome not in _recursos:
+            _recursos[nome] = carregar()
+        return _recursos[nome]
+
+def _ler_logo():
+    with open(CAMINHO_LOGO, 'rb') as f:
+        return f.read()
+
+def _reduzir_logo(largura):
+    """PNG do logo reduzido para 'largura' px (como o Streamlit faria a cada exibição); o original se já couber."""
+    from PIL import Image
+    original = logo()
+    with Image.open(io.BytesIO(original)) as imagem:
+        if imagem.width <= largura:
+            return original
+        altura = int(1.0 * imagem.height * largura / imagem.width)
+        saida = io.BytesIO()
+        imagem.resize((largura, altura), resample=Image.BILINEAR).save(saida, 'PNG')
+    return saida.getvalue()
+
+def logo(largura=None):
+    """Bytes do PNG do logo, reduzido para 'largura' px se informada. Levanta FileNotFoundError sem o arquivo."""
+    if largura is None:
+        return _carregar('logo', _ler_logo)
+    return _carregar(('logo', largura), lambda: _reduzir_logo(largura))
+
+def _obter_fuso():
+    import pytz
+    return pytz.timezone(FUSO_HORARIO)
+
+def fuso_horario():
+    """tzinfo de Brasília (America/Sao_Paulo). Levanta a exceção do pytz se não puder ser carregado."""
+    return _carregar('fuso_horario', _obter_fuso)
+
+def template_base():
+    from laudo_docx import obter_template_base
+    return obter_template_base()
+
+def limpar_recursos():
+    """Descarta os recursos carregados (recarregados no próximo uso)."""
+    with _recursos_lock:
+        _recursos.clear()
+
+# --- Aquecimento ---
+
+def aquecer(gerar_laudo=True, backends=None, interface=True):
+    """Carrega os recursos e gera um laudo descartável por backend. Retorna {etapa: segundos}.
+
+    interface=False (processos da fila e da API) não carrega o logo. Falhas
+    (ex.: logo ausente) são registradas e não interrompem o aquecimento. As
+    etapas rodam com laudo_metricas.suspenso(): os laudos descartáveis não
+    entram em laudo_laudos_total, laudo_itens_total nem nos histogramas das
+    etapas; só 'aquecimento' e laudo_aquecimentos_total são registrados.
+    """
+    from laudo_docx import BACKENDS_LAUDO
+    etapas = [('logo', lambda: logo(LARGURA_LOGO))] if interface else []
+    etapas += [('fuso_horario', fuso_horario), ('template_base', template_base)]
+    if gerar_laudo:
+        from laudo_cache import gerar_entrada
+        etapas += [(f'laudo_{backend}', lambda backend=backend: gerar_entrada(DADOS_AQUECIMENTO, backend))
+                   for backend in backends or BACKENDS_LAUDO]
+    tempos = {}
+    with suspenso():
+        for nome, carregar in etapas:
+            inicio = time.perf_counter()
+            try:
+                carregar()
+            except Exception as e:
+                print(f"Aquecimento: '{nome}' falhou: {e}")
+            tempos[nome] = time.perf_counter() - inicio
+    total = sum(tempos.values())
+    observar(HISTOGRAMA_ETAPAS, total, etapa='aquecimento')
+    incrementar('laudo_aquecimentos_total')
+    return tempos
+
+_aquecimento = {'thread': None}
+
+def aquecer_em_segundo_plano(fila=None):
+    """Aquece este processo numa thread (uma vez por processo) e, se informada, sobe os processos da fila.
+
+    Retorna a thread (já iniciada) ou None com LAUDO_AQUECER=0.
+    """
+    if not AQUECER:
+        return None
+    with _recursos_lock:
+        if _aquecimento['thread'] is None:
+            def trabalhar():
+                aquecer()
+                if fila is not None:
+                    fila.aquecer()
+            _aquecimento['thread'] = threading.Thread(target=trabalhar, name='laudo-aquecimento', daemon=True)
+            _aquecimento['thread'].start()
+        return _aquecimento['thread']
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Camada de texto das seções fixas do laudo (sem python-docx).
+
+Cada secao_* devolve o conteúdo da seção como dados: uma tupla de Paragrafo
+(texto, estilo, alinhamento, tamanho, negrito, itálico e os trechos em
+itálico já separados). O resultado depende só de poucas entradas (substâncias
+presentes, referências 1.x ordenadas, lacre, data) e fica num cache LRU; em
+lote, a mesma combinação de substâncias se repete milhares de vezes e o texto
+é montado uma única vez. As seções com as referências dos itens (resultados e
+conclusão) só entram no cache com até LIMITE_REFERENCIAS_CACHE referências:
+as de apreensões grandes não se repetem e são montadas sem guardar, para o
+cache não reter listas enormes pelo resto do processo. laudo_docx apenas
+materializa os parágrafos.
+
+Os textos de cada substância (exames, resultados, conclusão, referências) vêm
+do catálogo compilado de laudo_substancias; aqui ficam a numeração, os estilos
+e os textos comuns. As substâncias são passadas pelo id, na ordem do catálogo.
+
+Os termos em itálico (TERMOS_ITALICO_ORIGINAL, mais os do catálogo) também
+ficam aqui, pois fazem parte do texto; laudo_docx os reexporta. Todo texto do
+corpo passa por segmentar_italico, que também remove os caracteres que o XML
+não aceita (controles como \x01 e \x0b vindos dos dados): assim os backends
+docx, ooxml e fluxo produzem o mesmo texto, sem erro nem .docx ilegível.
+"""
+
+import functools
+import re
+from collections import namedtuple
+
+from laudo_substancias import catalogo
+
+# Lista de termos para itálico (do código original Colab)
+TERMOS_ITALICO_ORIGINAL = [
+    'Cannabis sativa L.', # Adicionado L. para consistência
+    'Cannabis sativa',
+    'Scientific Working Group for the Analysis of Seized Drugs',
+    'United Nations Office on Drugs and Crime',
+    'Fast blue salt B', # Usado na seção de Exames do código Colab
+    'eppendorf',
+    'ziplock',
+    'Tetrahidrocanabinol', # Mencionado na conclusão Colab
+    'Portaria nº 344/1998', # Itálico não usual, mas presente implicitamente na formatação Colab
+    'RDC nº 970, de 19/03/2025' # Idem
+    # Adicionar outros termos se necessário
+]
+
+def compilar_padrao_italico(termos):
+    """Compila os termos em itálico numa única regex (termo mais longo primeiro)."""
+    termos_ordenados = sorted(termos, key=len, reverse=True)
+    # Fronteiras equivalentes ao isalnum() do código Colab: o termo não pode
+    # estar colado a letras ou dígitos (underscore não conta como alfanumérico).
+    return re.compile(r"(?<![^\W_])(?:" + "|".join(map(re.escape, termos_ordenados)) + r")(?![^\W_])")
+
+# Termos do código original mais os declarados no catálogo de substâncias
+TERMOS_ITALICO = list(dict.fromkeys(TERMOS_ITALICO_ORIGINAL + list(catalogo().termos_italico)))
+
+PADRAO_ITALICO = compilar_padrao_italico(TERMOS_ITALICO)
+
+# Caracteres proibidos no XML 1.0 (o python-docx os recusa com ValueError); tabulação e quebras de linha ficam
+CARACTERES_INVALIDOS_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+def segmentar_italico(texto):
+    """Divide o texto em trechos (texto, italico), juntando o texto comum num só trecho.
+
+    Os caracteres de CARACTERES_INVALIDOS_XML são removidos antes.
+    """
+    texto = CARACTERES_INVALIDOS_XML.sub('', texto)
+    segmentos = []
+    inicio = 0
+    for m in PADRAO_ITALICO.finditer(texto):
+        if m.start() > inicio:
+            segmentos.append((texto[inicio:m.start()], False))
+        segmentos.append((m.group(), True))
+        inicio = m.end()
+    if inicio < len(texto):
+        segmentos.append((texto[inicio:], False))
+    return segmentos
+
+# --- Parágrafos ---
+
+# texto None representa um parágrafo vazio de espaçamento (doc.add_paragraph())
+Paragrafo = namedtuple('Paragrafo', ['texto', 'estilo', 'alinhamento', 'tamanho', 'negrito', 'italico', 'segmentos'])
+
+PARAGRAFO_VAZIO = Paragrafo(None, None, None, None, False, False, ())
+
+def paragrafo(texto, style=None, align=None, size=None, bold=False, italic=False):
+    """Cria um Paragrafo (mesmos parâmetros de adicionar_paragrafo), com os trechos em itálico resolvidos."""
+    return Paragrafo(texto, style, align, size, bold, italic, tuple(segmentar_italico(texto)))
+
+@functools.lru_cache(maxsize=8192)
+def chave_referencia(referencia):
+    """Chave de ordenação numérica: '1.2' < '1.10'; referências não numéricas vêm depois, em ordem alfabética."""
+    referencia = str(referencia)
+    partes = referencia.split('.')
+    if referencia.replace('.', '').isdigit() and '' not in partes:
+        return (0, tuple(map(int, partes)), '')
+    return (1, (), referencia)
+
+def ordenar_referencias(referencias):
+    """Referências em ordem numérica, como tupla."""
+    return tuple(sorted(referencias, key=chave_referencia))
+
+def comprimir_referencias(referencias):
+    """Trechos de referências já ordenadas, com sequências de 3 ou mais em intervalo.
+
+    ('1.1', '1.2', '1.3', '1.5') -> ('1.1 a 1.3', '1.5').
+    """
+    trechos = []
+    sequencia = [] # Referências consecutivas em curso
+    ultima = None # Números da última referência numérica
+    for referencia in referencias:
+        tipo, numeros, _ = chave_referencia(referencia)
+        if sequencia and ultima and tipo == 0 and numeros[:-1] == ultima[:-1] and numeros[-1] == ultima[-1] + 1:
+            sequencia.append(referencia)
+        else:
+            trechos += _trechos_sequencia(sequencia)
+            sequencia = [referencia]
+        ultima = numeros if tipo == 0 else None
+    return tuple(trechos + _trechos_sequencia(sequencia))
+
+def _trechos_sequencia(sequencia):
+    return [f"{sequencia[0]} a {sequencia[-1]}"] if len(sequencia) >= 3 else sequencia
+
+def descrever_referencias(referencias, intervalos=False):
+    """('1.1', '1.2') -> ('1.1 e 1.2', True): texto e se é plural; intervalos=True comprime as sequências."""
+    trechos = comprimir_referencias(referencias) if intervalos else referencias
+    return " e ".join(trechos), len(referencias) != 1
+
+def rotulo_itens(referencias, intervalos=False):
+    """('1.1',) -> 'no item 1.1'; ('1.1', '1.2') -> 'nos itens 1.1 e 1.2'; com intervalos, 'nos itens 1.1 a 1.250'."""
+    refs_str, plural = descrever_referencias(referencias, intervalos)
+    return f"nos itens {refs_str}" if plural else f"no item {refs_str}"
+
+# --- Seções ---
+
+# Seções com mais referências que isto (somando as substâncias) são montadas fora do cache
+LIMITE_REFERENCIAS_CACHE = 64
+
+def _cache_referencias(maxsize):
+    """Como lru_cache, mas só para chamadas com até LIMITE_REFERENCIAS_CACHE referências em refs_substancias."""
+    def decorador(funcao):
+        em_cache = functools.lru_cache(maxsize=maxsize)(funcao)
+
+        @functools.wraps(funcao)
+        def secao(refs_substancias, *args, **kwargs):
+            if sum(len(refs) for _, refs in refs_substancias) > LIMITE_REFERENCIAS_CACHE:
+                return funcao(refs_substancias, *args, **kwargs)
+            return em_cache(refs_substancias, *args, **kwargs)
+        secao.cache_clear = em_cache.cache_clear
+        secao.cache_info = em_cache.cache_info
+        return secao
+    return decorador
+
+@functools.lru_cache(maxsize=1)
+def secao_objetivo_exames():
+    """'2 OBJETIVO DOS EXAMES' (Texto do Colab)."""
+    texto = ("Visa esclarecer à autoridade requisitante quanto às características do material apresentado, "
+             "bem como se ele contém substância de uso proscrito no Brasil e capaz de causar dependência física e/ou psíquica. "
+             "O presente laudo pericial busca demonstrar a materialidade da infração penal apurada.")
+    return (paragrafo("2 OBJETIVO DOS EXAMES", style='TituloPrincipal'),
+            paragrafo(texto, align='justify', style='Normal'))
+
+@functools.lru_cache(maxsize=64)
+def secao_exames(substancias, tem_itens):
+    """'3 EXAMES': um subitem por substância presente (ids, na ordem do catálogo)."""
+    por_id = catalogo().por_id
+    paragrafos = [paragrafo("3 EXAMES", style='TituloPrincipal')]
+    idx_subitem = 1
+    for id_substancia in substancias:
+        titulo, passos = por_id[id_substancia].exames(f"3.{idx_subitem}")
+        paragrafos.append(paragrafo(titulo, style='TituloSecundario'))
+        paragrafos += [paragrafo(passo, style='Normal', align='justify') for passo in passos]
+        idx_subitem += 1
+    # Se nenhuma substância foi indicada mas há itens, adiciona exame macroscópico
+    if not substancias and tem_itens:
+        paragrafos += [
+            paragrafo(f"3.{idx_subitem} Exames realizados", style='TituloSecundario'),
+            paragrafo(f"3.{idx_subitem}.1 Exame macroscópico;", style='Normal', align='justify'),
+        ]
+        idx_subitem += 1
+    if idx_subitem == 1: # Se nenhum item foi adicionado
+        paragrafos.append(paragrafo("Nenhum exame específico a relatar com base nos materiais descritos.", style='Normal'))
+    return tuple(paragrafos)
+
+def _lista_ou(nomes):
+    """('A', 'B', 'C') -> 'A, B ou C'."""
+    return nomes[0] if len(nomes) == 1 else ", ".join(nomes[:-1]) + " ou " + nomes[-1]
+
+@_cache_referencias(maxsize=256)
+def secao_resultados(refs_substancias, tem_itens, intervalos=False):
+    """'4 RESULTADOS': refs_substancias são pares (id, referências 1.x ordenadas), na ordem do catálogo; intervalos como em rotulo_itens."""
+    catalogo_substancias = catalogo()
+    paragrafos = [paragrafo("4 RESULTADOS", style='TituloPrincipal')]
+    idx_subitem = 1
+    for id_substancia, refs in refs_substancias:
+        paragrafos.append(paragrafo(f"4.{idx_subitem} Resultados obtidos para o(s) material(is) descrito(s) {rotulo_itens(refs, intervalos)}:", style='TituloSecundario'))
+        paragrafos += [paragrafo(linha, style='Normal', align='justify')
+                       for linha in catalogo_substancias.por_id[id_substancia].resultados(f"4.{idx_subitem}")]
+        idx_subitem += 1
+    if idx_subitem == 1: # Se nenhum resultado foi adicionado
+        if tem_itens:
+            nomes = _lista_ou([substancia.nome for substancia in catalogo_substancias.substancias])
+            paragrafos.append(paragrafo(f"Não foram obtidos resultados positivos para {nomes} nos testes realizados para os materiais descritos.", style='Normal', align='justify'))
+        else:
+            paragrafos.append(paragrafo("Nenhum material foi submetido a exame, portanto, não há resultados a relatar.", style='Normal', align='justify'))
+    return tuple(paragrafos)
+
+@_cache_referencias(maxsize=256)
+def secao_conclusao(refs_substancias, tem_itens, intervalos=False):
+    """'5 CONCLUSÃO': refs_substancias como em secao_resultados."""
+    por_id = catalogo().por_id
+    conclusoes = [por_id[id_substancia].conclusao(rotulo_itens(refs, intervalos)) for id_substancia, refs in refs_substancias]
+
+    if conclusoes:
+        # Junta as conclusões com "Outrossim," como no código Colab
+        texto_final = "A partir das análises realizadas, conclui-se que, " + " Outrossim, ".join(conclusoes)
+    elif tem_itens: # Se houve itens mas sem resultado positivo
+        texto_final = "A partir das análises realizadas, conclui-se que não foram detectadas substâncias de uso proscrito nos materiais analisados."
+    else: # Se não houve itens
+        texto_final = "Não houve material submetido a exame, portanto, não há conclusões a apresentar."
+    return (paragrafo("5 CONCLUSÃO", style='TituloPrincipal'),
+            paragrafo(texto_final, align='justify', style='Normal'))
+
+@functools.lru_cache(maxsize=1024)
+def secao_custodia_material(lacre):
+    """'6 CUSTÓDIA DO MATERIAL' com o número do lacre."""
+    texto_contraprova = (f"A amostra contraprova ficará armazenada neste Instituto, conforme Portaria 0003/2019/SSP "
+                         f"(Lacre nº {lacre}).")
+    return (paragrafo("6 CUSTÓDIA DO MATERIAL", style='TituloPrincipal'),
+            paragrafo("6.1 Contraprova", style='TituloSecundario'), # Usar TituloSecundario para subitem
+            paragrafo(texto_contraprova, style='Normal', align='justify'))
+
+@functools.lru_cache(maxsize=64)
+def secao_referencias(substancias):
+    """'REFERÊNCIAS': base fixa mais as de cada substância presente (ids, na ordem do catálogo)."""
+    tamanho_ref = 10 # Tamanho da fonte menor para referências
+    referencias = [
+        "BRASIL. Ministério da Saúde. Portaria SVS/MS n° 344, de 12 de maio de 1998. Aprova o regulamento técnico sobre substâncias e medicamentos sujeitos a controle especial. Diário Oficial da União: Brasília, DF, p. 37, 19 maio 1998. Alterada pela RDC nº 970, de 19/03/2025.", # Data da RDC do Colab
+        "GOIÁS. Secretaria de Estado da Segurança Pública. Portaria nº 0003/2019/SSP de 10 de janeiro de 2019. Regulamenta a apreensão, movimentação, exames, acondicionamento, armazenamento e destruição de drogas no âmbito da Secretaria de Estado da Segurança Pública. Diário Oficial do Estado de Goiás: n° 22.972, Goiânia, GO, p. 4-5, 15 jan. 2019.",
+        "SWGDRUG: Scientific Working Group for the Analysis of Seized Drugs. Recommendations. Version 8.0 june. 2019. Disponível em: http://www.swgdrug.org/Documents/SWGDRUG%20Recommendations%20Version%208_FINAL_ForPosting_092919.pdf. Acesso em: 07/10/2019." # Data de acesso fixa do código Colab
+    ]
+    por_id = catalogo().por_id
+    for id_substancia in substancias:
+        referencias += por_id[id_substancia].referencias
+    return (paragrafo("REFERÊNCIAS", style='TituloPrincipal'),) + tuple(
+        paragrafo(ref, style='Normal', align='justify', size=tamanho_ref) for ref in referencias)
+
+@functools.lru_cache(maxsize=8)
+def secao_encerramento_assinatura(data_formatada):
+    """Data/local e assinatura do perito (formato Colab). data_formatada: 'Goiânia, 1 de maio de 2025.'"""
+    return (
+        PARAGRAFO_VAZIO, # Espaço
+        paragrafo(data_formatada, align='right', style='Normal'), # Alinhado à direita como no Colab
+        PARAGRAFO_VAZIO, PARAGRAFO_VAZIO, # Mais espaço
+        # Assinatura - Usando o formato/texto do Colab
+        paragrafo("Laudo assinado digitalmente com dados do assinador à esquerda das páginas", align='left', style='Normal', size=9, italic=True), # Nota sobre assinatura digital
+        paragrafo("________________________________________", align='center', style='Normal'),
+        paragrafo("Daniel Chendes Lima", align='center', style='Normal', bold=True), # Nome do Perito do Colab
+        paragrafo("Perito Criminal", align='center', style='Normal'), # Cargo do Colab
+    )
+
+def limpar_cache_secoes():
+    """Esvazia os caches das seções (ex.: após recarregar o catálogo de substâncias)."""
+    for secao in (secao_objetivo_exames, secao_exames, secao_resultados, secao_conclusao,
+                  secao_custodia_material, secao_referencias, secao_encerramento_assinatura):
+        secao.cache_clear()
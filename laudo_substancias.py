@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Catálogo das substâncias pesquisadas no laudo, lido de um arquivo declarativo.
+
+substancias.json define os tipos de material (código -> descrição) e, para
+cada substância, na ordem em que aparece no laudo: os códigos de material que
+a indicam, o objeto da pesquisa, os exames, os resultados, a conclusão, a base
+legal, as referências e os termos em itálico. Cadastrar uma substância (crack,
+MDMA, selos de LSD...) é acrescentá-la ao arquivo, com o tipo de material se
+for novo; o código não muda. Outro arquivo pode ser indicado em
+LAUDO_SUBSTANCIAS.
+
+catalogo() valida o arquivo e o compila uma única vez por processo: cada
+substância vira funções que devolvem o texto numerado das suas seções, e os
+códigos de material viram um índice código -> substância. Os laudos só
+percorrem as substâncias presentes nos itens, então o custo por laudo não
+cresce com o número de substâncias cadastradas. A montagem dos parágrafos e
+o cache por combinação de substâncias ficam em laudo_secoes.
+"""
+
+import functools
+import json
+import os
+from collections import namedtuple
+
+CAMINHO_SUBSTANCIAS = os.environ.get('LAUDO_SUBSTANCIAS') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'substancias.json')
+
+CAMPOS_TEXTO = ('id', 'nome', 'pesquisa', 'conclusao', 'base_legal')
+CAMPOS_LISTA = ('materiais', 'exames', 'resultados', 'referencias')
+
+class ErroCatalogoSubstancias(ValueError):
+    """Arquivo de substâncias inválido; a mensagem lista todos os problemas encontrados."""
+
+# ordem: posição no arquivo (ordem das subseções no laudo)
+# exames(prefixo) -> (título, passos); resultados(prefixo) -> linhas; conclusao(rotulo) -> texto
+Substancia = namedtuple('Substancia', ['id', 'nome', 'ordem', 'materiais', 'referencias', 'termos_italico',
+                                       'exames', 'resultados', 'conclusao'])
+
+# materiais: {código: descrição}; por_material: {código: Substancia}; por_id: {id: Substancia}
+Catalogo = namedtuple('Catalogo', ['materiais', 'substancias', 'por_material', 'por_id', 'termos_italico'])
+
+def _texto_valido(valor):
+    return isinstance(valor, str) and valor.strip() != ''
+
+def validar(dados):
+    """Lista de problemas do conteúdo do arquivo (vazia se válido)."""
+    if not isinstance(dados, dict):
+        return ["o arquivo deve conter um objeto com 'materiais' e 'substancias'"]
+    problemas = []
+    materiais = dados.get('materiais')
+    if not isinstance(materiais, dict) or not materiais:
+        problemas.append("'materiais' deve ser um objeto {código: descrição} não vazio")
+        materiais = {}
+    for codigo, descricao in materiais.items():
+        if not _texto_valido(descricao):
+            problemas.append(f"material '{codigo}': descrição vazia ou não textual")
+    substancias = dados.get('substancias')
+    if not isinstance(substancias, list) or not substancias:
+        return problemas + ["'substancias' deve ser uma lista não vazia"]
+
+    ids, donos = set(), {} # donos: código de material -> id da substância
+    for i, substancia in enumerate(substancias):
+        if not isinstance(substancia, dict):
+            problemas.append(f"substância nº {i + 1}: deve ser um objeto")
+            continue
+        nome = substancia.get('id') if _texto_valido(substancia.get('id')) else f"nº {i + 1}"
+        for campo in CAMPOS_TEXTO:
+            if not _texto_valido(substancia.get(campo)):
+                problemas.append(f"substância {nome}: '{campo}' ausente ou vazio")
+        for campo in CAMPOS_LISTA + ('termos_italico',):
+            valor = substancia.get(campo, [] if campo == 'termos_italico' else None)
+            if not isinstance(valor, list) or not all(_texto_valido(texto) for texto in valor):
+                problemas.append(f"substância {nome}: '{campo}' deve ser uma lista de textos")
+            elif not valor and campo in ('materiais', 'exames', 'resultados'):
+                problemas.append(f"substância {nome}: '{campo}' vazio")
+        if nome in ids:
+            problemas.append(f"substância {nome}: id repetido")
+        ids.add(nome)
+        for codigo in substancia.get('materiais') or ():
+            if not isinstance(codigo, str):
+                continue
+            if codigo not in materiais:
+                problemas.append(f"substância {nome}: material '{codigo}' não está em 'materiais'")
+            elif codigo in donos:
+                problemas.append(f"substância {nome}: material '{codigo}' já indica {donos[codigo]}")
+            else:
+                donos[codigo] = nome
+    return problemas
+
+def _compilar_substancia(dados, ordem):
+    """Substancia com as funções de texto (os textos fixos já prontos)."""
+    titulo_exames = f"Exames realizados para pesquisa de {dados['pesquisa']}"
+    passos = tuple(dados['exames'])
+    linhas_resultado = tuple(dados['resultados'])
+    conclusao_fixa = f"{dados['conclusao']} {dados['base_legal']}"
+
+    def exames(prefixo):
+        """('3.1') -> ('3.1 Exames realizados ...', ('3.1.1 ...', '3.1.2 ...'))."""
+        return f"{prefixo} {titulo_exames}", tuple(f"{prefixo}.{k} {passo}" for k, passo in enumerate(passos, 1))
+
+    def resultados(prefixo):
+        """('4.1') -> ('4.1.1 ...', '4.1.2 ...'); o título com os itens fica em laudo_secoes."""
+        return tuple(f"{prefixo}.{k} {linha}" for k, linha in enumerate(linhas_resultado, 1))
+
+    def conclusao(rotulo):
+        """('nos itens 1.1 e 1.2') -> 'no(s) material(is) descrito(s) nos itens 1.1 e 1.2, foi detectada ...'."""
+        return f"no(s) material(is) descrito(s) {rotulo}, {conclusao_fixa}"
+
+    return Substancia(dados['id'], dados['nome'], ordem, tuple(dados['materiais']), tuple(dados['referencias']),
+                      tuple(dados.get('termos_italico', ())), exames, resultados, conclusao)
+
+def compilar(dados):
+    """Valida o conteúdo do arquivo e devolve o Catalogo (levanta ErroCatalogoSubstancias)."""
+    problemas = validar(dados)
+    if problemas:
+        raise ErroCatalogoSubstancias("Catálogo de substâncias inválido:\n- " + "\n- ".join(problemas))
+    substancias = tuple(_compilar_substancia(substancia, ordem) for ordem, substancia in enumerate(dados['substancias']))
+    return Catalogo(
+        materiais=dict(dados['materiais']),
+        substancias=substancias,
+        por_material={codigo: substancia for substancia in substancias for codigo in substancia.materiais},
+        por_id={substancia.id: substancia for substancia in substancias},
+        termos_italico=tuple(dict.fromkeys(termo for substancia in substancias for termo in substancia.termos_italico)),
+    )
+
+@functools.lru_cache(maxsize=4)
+def catalogo(caminho=None):
+    """Catálogo compilado do arquivo (padrão: CAMINHO_SUBSTANCIAS), carregado uma vez por processo."""
+    caminho = caminho or CAMINHO_SUBSTANCIAS
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ErroCatalogoSubstancias(f"Não foi possível ler o catálogo de substâncias '{caminho}': {e}") from e
+    return compilar(dados)
+
+def classificar(itens, catalogo_substancias=None):
+    """{id da substância: {chave do subitem: '1.x'}} dos itens, pelo código de material.
+
+    A chave é a referência do item ('ref') ou 'Item_1.x' sem ela, como no
+    mapeamento original; itens de material sem substância ficam de fora.
+    """
+    por_material = (catalogo_substancias or catalogo()).por_material
+    subitens = {}
+    for i, item in enumerate(itens):
+        substancia = por_material.get(item.get('tipo_mat', ''))
+        if substancia is None:
+            continue
+        item_num_str = f"1.{i + 1}"
+        subitens.setdefault(substancia.id, {})[item.get('ref', '') or f"Item_{item_num_str}"] = item_num_str
+    return subitens
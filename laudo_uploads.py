@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Imagens recebidas na interface, gravadas em disco em vez de ficarem na sessão.
+
+O UploadedFile do Streamlit guarda o original inteiro na memória enquanto a
+sessão existir; com vários peritos conectados, a memória cresce com sessões x
+tamanho das fotos. SpoolSessao copia cada upload, em blocos, para uma pasta
+temporária da sessão (LAUDO_UPLOADS_DIR/<sessão>/<sha256>.<ext>) e devolve um
+ArquivoEmDisco: caminho, SHA-256, tamanho, nome e uma prévia JPEG pequena, a
+única parte que fica na memória. Na geração do laudo, laudo_imagem lê o
+arquivo direto do disco (Image.open(caminho)), e o hash já calculado serve de
+chave para o cache de imagens processadas e de laudos.
+
+As prévias de cada sessão respeitam um orçamento (LAUDO_ORCAMENTO_SESSAO_MB):
+quando ele estoura, as prévias mais antigas são descartadas (a interface
+mostra só o nome do arquivo). A pasta da sessão é apagada quando a SpoolSessao
+é coletada (fim da sessão do Streamlit), em encerrar() ou na saída do
+processo; pastas órfãs antigas (processo morto) são removidas na próxima
+inicialização. Os totais das sessões vão para laudo_metricas como medidores.
+
+Uso:
+    spool = SpoolSessao()
+    arquivo = spool.guardar(uploaded_file)      # ArquivoEmDisco
+    dados_laudo['imagens'] = [{'arquivo': arquivo, 'itens': ['1.1']}]
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from laudo_metricas import definir, incrementar
+
+# --- Configuração ---
+DIRETORIO_UPLOADS = os.environ.get('LAUDO_UPLOADS_DIR') or os.path.join(tempfile.gettempdir(), 'laudo_uploads')
+ORCAMENTO_SESSAO_BYTES = int(os.environ.get('LAUDO_ORCAMENTO_SESSAO_MB', '2')) * 1024 * 1024
+TAMANHO_BLOCO = 1024 * 1024 # Cópia do upload para o disco, em blocos
+IDADE_ORFAOS_SEGUNDOS = 24 * 3600 # Pastas de sessão sem atividade há mais tempo que isso são apagadas
+
+# --- Arquivo em Disco ---
+
+class ArquivoEmDisco:
+    """Imagem gravada em disco: caminho, sha256 (hex), tamanho, nome original e prévia (JPEG ou None).
+
+    getvalue() lê o arquivo inteiro, para o código que espera um UploadedFile.
+    """
+
+    def __init__(self, caminho, sha256, tamanho, nome=None, previa=None):
+        self.caminho = caminho
+        self.sha256 = sha256
+        self.tamanho = tamanho
+        self.nome = nome or os.path.basename(caminho)
+        self.previa = previa
+
+    @classmethod
+    def de_caminho(cls, caminho, nome=None):
+        """ArquivoEmDisco de um arquivo existente (o hash é calculado lendo em blocos)."""
+        digest = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+                digest.update(bloco)
+        return cls(caminho, digest.hexdigest(), os.path.getsize(caminho), nome)
+
+    @property
+    def name(self): # Mesmo atributo do UploadedFile
+        return self.nome
+
+    def getvalue(self):
+        with open(self.caminho, 'rb') as f:
+            return f.read()
+
+    def __repr__(self):
+        return f"ArquivoEmDisco({self.nome!r}, {self.tamanho} bytes, {self.sha256[:12]})"
+
+# --- Sessões ---
+
+_sessoes = weakref.WeakSet() # SpoolSessao vivas neste processo
+_sessoes_lock = threading.RLock() # RLock: o finalizador pode rodar (coleta) com o lock já adquirido
+_bases_limpas = set()
+
+def _atualizar_metricas():
+    with _sessoes_lock:
+        sessoes = list(_sessoes)
+    memoria = [sessao.bytes_memoria for sessao in sessoes]
+    definir('laudo_sessoes_uploads', len(sessoes))
+    definir('laudo_sessoes_bytes_memoria', sum(memoria))
+    definir('laudo_sessao_bytes_memoria_max', max(memoria, default=0))
+    definir('laudo_sessoes_bytes_disco', sum(sessao.bytes_disco for sessao in sessoes))
+    definir('laudo_sessao_orcamento_bytes', ORCAMENTO_SESSAO_BYTES)
+
+def _remover_diretorio(diretorio):
+    shutil.rmtree(diretorio, ignore_errors=True)
+    _atualizar_metricas()
+
+def limpar_orfaos(diretorio_base=None, idade=IDADE_ORFAOS_SEGUNDOS):
+    """Apaga pastas de sessão sem atividade há mais de 'idade' segundos (de processos encerrados). Retorna quantas."""
+    diretorio_base = diretorio_base or DIRETORIO_UPLOADS
+    with _sessoes_lock:
+        vivas = {sessao.id for sessao in _sessoes}
+    limite = time.time() - idade
+    removidas = 0
+    try:
+        entradas = list(os.scandir(diretorio_base))
+    except FileNotFoundError:
+        return 0
+    for entrada in entradas:
+        try:
+            if entrada.is_dir() and entrada.name not in vivas and entrada.stat().st_mtime < limite:
+                shutil.rmtree(entrada.path, ignore_errors=True)
+                removidas += 1
+        except OSError:
+            pass
+    return removidas
+
+class SpoolSessao:
+    """Imagens de uma sessão gravadas em disco, por hash do conteúdo, com as prévias limitadas pelo orçamento."""
+
+    def __init__(self, diretorio_base=None, orcamento=None):
+        diretorio_base = diretorio_base or DIRETORIO_UPLOADS
+        with _sessoes_lock:
+            limpar = diretorio_base not in _bases_limpas
+            _bases_limpas.add(diretorio_base)
+        if limpar:
+            limpar_orfaos(diretorio_base)
+        self.id = uuid.uuid4().hex
+        self.diretorio = os.path.join(diretorio_base, self.id)
+        os.makedirs(self.diretorio, exist_ok=True)
+        self.orcamento = ORCAMENTO_SESSAO_BYTES if orcamento is None else orcamento
+        self._arquivos = OrderedDict() # sha256 -> ArquivoEmDisco (mais antigo primeiro)
+        self._lock = threading.Lock()
+        # Apaga a pasta quando a sessão é coletada, em encerrar() ou na saída do processo
+        self._finalizador = weakref.finalize(self, _remover_diretorio, self.diretorio)
+        with _sessoes_lock:
+            _sessoes.add(self)
+        _atualizar_metricas()
+
+    def guardar(self, arquivo, nome=None):
+        """Copia o upload (objeto com read(), ou bytes) para o disco e devolve o ArquivoEmDisco.
+
+        O mesmo conteúdo enviado de novo devolve o arquivo já gravado.
+        """
+        from laudo_imagem import gerar_previa
+        nome = nome or getattr(arquivo, 'name', None) or 'imagem'
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.parcial')
+        digest, tamanho = hashlib.sha256(), 0
+        with os.fdopen(descritor, 'wb') as destino:
+            if isinstance(arquivo, (bytes, bytearray)):
+                blocos = [arquivo]
+            else:
+                if hasattr(arquivo, 'seek'):
+                    arquivo.seek(0)
+                blocos = iter(lambda: arquivo.read(TAMANHO_BLOCO), b'')
+            for bloco in blocos:
+                digest.update(bloco)
+                destino.write(bloco)
+                tamanho += len(bloco)
+        sha256 = digest.hexdigest()
+        with self._lock:
+            existente = self._arquivos.get(sha256)
+        if existente is not None:
+            os.remove(temporario)
+            incrementar('laudo_uploads_total', resultado='repetido')
+            return existente
+
+        extensao = os.path.splitext(nome)[1].lower()[:8]
+        caminho = os.path.join(self.diretorio, sha256 + extensao)
+        os.replace(temporario, caminho)
+        registro = ArquivoEmDisco(caminho, sha256, tamanho, nome)
+        try:
+            registro.previa = gerar_previa(registro)
+        except Exception as e: # Não é imagem legível: o erro aparece ao gerar o laudo
+            print(f"Prévia de '{nome}' não gerada: {e}")
+        with self._lock:
+            self._arquivos[sha256] = registro
+            descartadas = self._aplicar_orcamento()
+        incrementar('laudo_uploads_total', resultado='novo')
+        incrementar('laudo_uploads_bytes_total', tamanho)
+        if descartadas:
+            incrementar('laudo_sessao_orcamento_excedido_total', descartadas)
+        _atualizar_metricas()
+        return registro
+
+    def _aplicar_orcamento(self):
+        """Descarta as prévias mais antigas até caberem no orçamento (chamar com _lock). Retorna quantas."""
+        total = sum(len(registro.previa) for registro in self._arquivos.values() if registro.previa)
+        descartadas = 0
+        for registro in self._arquivos.values():
+            if total <= self.orcamento:
+                break
+            if registro.previa:
+                total -= len(registro.previa)
+                registro.previa = None
+                descartadas += 1
+        return descartadas
+
+    def remover(self, sha256):
+        """Apaga do disco a imagem com esse hash, se existir."""
+        with self._lock:
+            registro = self._arquivos.pop(sha256, None)
+        if registro is not None:
+            try:
+                os.remove(registro.caminho)
+            except OSError:
+                pass
+            _atualizar_metricas()
+
+    def manter(self, arquivos):
+        """Apaga as imagens que não estão em 'arquivos' (ex.: removidas do laudo ou de outro caso)."""
+        manter = {arquivo.sha256 for arquivo in arquivos if getattr(arquivo, 'sha256', None)}
+        with self._lock:
+            descartar = [sha256 for sha256 in self._arquivos if sha256 not in manter]
+        for sha256 in descartar:
+            self.remover(sha256)
+
+    def arquivos(self):
+        with self._lock:
+            return list(self._arquivos.values())
+
+    @property
+    def bytes_memoria(self):
+        """Bytes mantidos na memória pela sessão (as prévias)."""
+        with self._lock:
+            return sum(len(registro.previa) for registro in self._arquivos.values() if registro.previa)
+
+    @property
+    def bytes_disco(self):
+        with self._lock:
+            return sum(registro.tamanho for registro in self._arquivos.values())
+
+    def encerrar(self):
+        """Apaga a pasta da sessão (também ocorre sozinho quando o objeto é coletado)."""
+        with self._lock:
+            self._arquivos.clear()
+        with _sessoes_lock:
+            _sessoes.discard(self)
+        self._finalizador()